@@ -0,0 +1,269 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from config import settings
+from timing import stage
+
+ADMISSION_MAX_CONCURRENCY = settings.admission_max_concurrency
+ADMISSION_INTERACTIVE_RESERVE = settings.admission_interactive_reserve
+ADMISSION_MAX_QUEUE_PER_USER = settings.admission_max_queue_per_user
+
+INTERACTIVE, PR, BATCH, MAINTENANCE = 'interactive', 'pr', 'batch', 'maintenance'
+
+# (method or None for any, path prefix, class); the first match wins
+DEFAULT_ROUTES: List[Tuple[Optional[str], str, str]] = [
+    ('POST', '/chat', INTERACTIVE),
+    (None, '/branches', INTERACTIVE),
+    ('POST', '/pr/generate', INTERACTIVE),
+    ('POST', '/pr/create', PR),
+    ('POST', '/studio/pr', PR),
+    ('POST', '/execute', PR),
+    ('POST', '/fleet', BATCH),
+    ('POST', '/install_requirements', BATCH),
+    (None, '/repos', MAINTENANCE),
+]
+# Never queued or shed
+EXEMPT_PATHS = ('/health', '/startup', '/admission', '/docs', '/redoc', '/openapi.json')
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class WorkClass:
+    """
+    Concurrency cap, queue limit and priority (lower runs first) of one class of requests,
+    with its per-user FIFO queues.
+    """
+
+    def __init__(self, name: str, priority: int, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = settings.get_int(f"ADMISSION_{name.upper()}_CONCURRENCY", max_concurrency)
+        self.max_queue = settings.get_int(f"ADMISSION_{name.upper()}_QUEUE", max_queue)
+        self.max_wait = settings.get_float(f"ADMISSION_{name.upper()}_MAX_WAIT", max_wait)
+        self.running = 0
+        self.queued = 0
+        # user -> waiting futures; users are served round-robin in this order
+        self.queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        # Moving average of request duration, used for Retry-After
+        self.service_time = 1.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def pop_next(self) -> Optional[asyncio.Future]:
+        while self.queues:
+            user, waiters = next(iter(self.queues.items()))
+            future = waiters.popleft()
+            if waiters:
+                self.queues.move_to_end(user)
+            else:
+                del self.queues[user]
+            self.queued -= 1
+            if not future.done():
+                return future
+        return None
+
+    def remove(self, user: str, future: asyncio.Future):
+        waiters = self.queues.get(user)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self.queued -= 1
+        if not waiters:
+            del self.queues[user]
+
+
+def default_classes() -> List[WorkClass]:
+    return [
+        WorkClass(INTERACTIVE, 0, max_concurrency=ADMISSION_MAX_CONCURRENCY, max_queue=64, max_wait=30),
+        WorkClass(PR, 1, max_concurrency=4, max_queue=32, max_wait=120),
+        WorkClass(BATCH, 2, max_concurrency=2, max_queue=8, max_wait=300),
+        WorkClass(MAINTENANCE, 3, max_concurrency=1, max_queue=8, max_wait=60),
+    ]
+
+
+class AdmissionController:
+    """
+    Admits requests into a fixed number of slots by class priority, per-class caps and
+    per-user round-robin. Requests that cannot be queued (queue full, or waited too long)
+    are rejected with a Retry-After estimate instead of piling up until they time out.
+    """
+
+    def __init__(self, classes: Optional[List[WorkClass]] = None, max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+                 interactive_reserve: int = ADMISSION_INTERACTIVE_RESERVE,
+                 max_queue_per_user: int = ADMISSION_MAX_QUEUE_PER_USER,
+                 routes: List[Tuple[Optional[str], str, str]] = DEFAULT_ROUTES):
+        self.classes: Dict[str, WorkClass] = {c.name: c for c in (classes or default_classes())}
+        self.by_priority = sorted(self.classes.values(), key=lambda c: c.priority)
+        self.max_concurrency = max_concurrency
+        self.interactive_reserve = interactive_reserve
+        self.max_queue_per_user = max_queue_per_user
+        self.routes = routes
+        self.running = 0
+
+    def classify(self, method: str, path: str) -> Optional[str]:
+        if method == 'OPTIONS' or path.startswith(EXEMPT_PATHS):
+            return None
+        for route_method, prefix, name in self.routes:
+            if (route_method is None or route_method == method) and path.startswith(prefix):
+                return name
+        return INTERACTIVE
+
+    def _can_run(self, work_class: WorkClass) -> bool:
+        if work_class.running >= work_class.max_concurrency:
+            return False
+        free = self.max_concurrency - self.running
+        reserve = 0 if work_class.priority == 0 else self.interactive_reserve
+        return free > reserve
+
+    def _start(self, work_class: WorkClass):
+        work_class.running += 1
+        work_class.admitted += 1
+        self.running += 1
+
+    def _dispatch(self):
+        # Hand free slots to waiters, highest priority class first
+        progress = True
+        while progress:
+            progress = False
+            for work_class in self.by_priority:
+                if work_class.queued and self._can_run(work_class):
+                    future = work_class.pop_next()
+                    if future is not None:
+                        self._start(work_class)
+                        future.set_result(None)
+                        progress = True
+                        break
+
+    def retry_after(self, work_class: WorkClass) -> int:
+        backlog = work_class.queued + work_class.running + 1
+        return max(1, math.ceil(work_class.service_time * backlog / max(1, work_class.max_concurrency)))
+
+    def _reject(self, work_class: WorkClass, reason: str):
+        work_class.rejected += 1
+        raise AdmissionRejected(reason, self.retry_after(work_class))
+
+    async def acquire(self, name: str, user: str):
+        work_class = self.classes[name]
+        waiting_ahead = any(c.queued for c in self.by_priority if c.priority <= work_class.priority)
+        if not waiting_ahead and self._can_run(work_class):
+            self._start(work_class)
+            return
+        if work_class.queued >= work_class.max_queue:
+            self._reject(work_class, f"Too many queued {name} requests")
+        if len(work_class.queues.get(user, ())) >= self.max_queue_per_user:
+            self._reject(work_class, f"Too many queued {name} requests for user {user}")
+
+        future = asyncio.get_running_loop().create_future()
+        work_class.queues.setdefault(user, deque()).append(future)
+        work_class.queued += 1
+        try:
+            await asyncio.wait_for(future, work_class.max_wait)
+        except asyncio.TimeoutError:
+            work_class.remove(user, future)
+            self._reject(work_class, f"Timed out waiting for a {name} slot")
+        except BaseException:
+            # Cancelled while queued; give the slot back if it was handed over at the same moment
+            work_class.remove(user, future)
+            if future.done() and not future.cancelled():
+                self.release(name)
+            raise
+
+    def release(self, name: str, elapsed: Optional[float] = None):
+        work_class = self.classes[name]
+        work_class.running -= 1
+        self.running -= 1
+        if elapsed is not None:
+            work_class.service_time = 0.8 * work_class.service_time + 0.2 * elapsed
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, name: str, user: str = 'system'):
+        """
+        Hold one slot of class `name` for the duration of the block (raises AdmissionRejected).
+        """
+        await self.acquire(name, user)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(name, time.perf_counter() - started)
+
+    def is_idle(self) -> bool:
+        """
+        True when no interactive or PR request is running or waiting.
+        """
+        return all(not c.running and not c.queued for c in self.by_priority if c.priority <= 1)
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "max_concurrency": self.max_concurrency,
+            "classes": {
+                c.name: {
+                    "priority": c.priority,
+                    "running": c.running,
+                    "queued": c.queued,
+                    "users_waiting": len(c.queues),
+                    "max_concurrency": c.max_concurrency,
+                    "max_queue": c.max_queue,
+                    "admitted": c.admitted,
+                    "rejected": c.rejected,
+                    "service_time": round(c.service_time, 3),
+                }
+                for c in self.by_priority
+            }
+        }
+
+
+def request_user(scope) -> str:
+    """
+    The user a request is accounted to: the X-User header, else the client address.
+    """
+    for key, value in scope.get('headers', []):
+        if key == b'x-user' and value:
+            return value.decode('latin-1')
+    client = scope.get('client')
+    return client[0] if client else 'anonymous'
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware running every HTTP request through an AdmissionController.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        name = self.controller.classify(scope['method'], scope['path'])
+        if name is None:
+            return await self.app(scope, receive, send)
+        try:
+            with stage("queue"):
+                await self.controller.acquire(name, request_user(scope))
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                status_code=429,
+                content={"error": "overloaded", "detail": e.reason, "retry_after": e.retry_after},
+                headers={"Retry-After": str(e.retry_after)}
+            )
+            return await response(scope, receive, send)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(name, time.perf_counter() - started)
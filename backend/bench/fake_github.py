@@ -0,0 +1,139 @@
+"""
+Local stand-in for the parts of the GitHub REST API the backend uses through PyGithub:
+users, organizations, repositories and pull requests (create, get, edit). Repositories are
+created on first lookup. Point the backend at it with GITHUB_API_URL and any GITHUB_TOKEN:
+
+    python -m bench.fake_github --port 8102 --latency 0.05
+"""
+import argparse
+import asyncio
+import threading
+from typing import Dict, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+DEFAULT_LOGIN = "bench-user"
+
+
+class FakeGitHub:
+    def __init__(self, latency: float = 0.05, login: str = DEFAULT_LOGIN):
+        self.latency = latency
+        self.login = login
+        self.lock = threading.Lock()
+        self.pulls: Dict[Tuple[str, str], Dict[int, Dict]] = {}
+        self.requests = 0
+
+    def repo_json(self, base: str, owner: str, name: str) -> Dict:
+        return {
+            "id": abs(hash((owner, name))) % 10 ** 8,
+            "name": name,
+            "full_name": f"{owner}/{name}",
+            "owner": {"login": owner, "url": f"{base}/users/{owner}"},
+            "url": f"{base}/repos/{owner}/{name}",
+            "html_url": f"https://github.example/{owner}/{name}",
+            "default_branch": "main",
+            "private": True,
+        }
+
+    def create_pull(self, base: str, owner: str, name: str, data: Dict) -> Dict:
+        with self.lock:
+            pulls = self.pulls.setdefault((owner, name), {})
+            number = len(pulls) + 1
+            pulls[number] = {
+                "id": number,
+                "number": number,
+                "state": "open",
+                "title": data.get("title", ""),
+                "body": data.get("body", ""),
+                "draft": bool(data.get("draft", False)),
+                "head": {"ref": data.get("head"), "label": data.get("head")},
+                "base": {"ref": data.get("base"), "label": data.get("base")},
+                "url": f"{base}/repos/{owner}/{name}/pulls/{number}",
+                "html_url": f"https://github.example/{owner}/{name}/pull/{number}",
+            }
+            return pulls[number]
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "pulls": sum(len(p) for p in self.pulls.values()),
+                "repos_with_pulls": len(self.pulls),
+            }
+
+
+def create_app(github: Optional[FakeGitHub] = None) -> FastAPI:
+    github = github or FakeGitHub()
+    app = FastAPI()
+    app.state.github = github
+
+    @app.middleware("http")
+    async def simulate_latency(request: Request, call_next):
+        with github.lock:
+            github.requests += 1
+        if github.latency:
+            await asyncio.sleep(github.latency)
+        return await call_next(request)
+
+    def base_url(request: Request) -> str:
+        return str(request.base_url).rstrip('/')
+
+    @app.get("/user")
+    async def get_user(request: Request):
+        return {"login": github.login, "url": f"{base_url(request)}/users/{github.login}", "type": "User"}
+
+    @app.get("/users/{login}")
+    async def get_named_user(login: str, request: Request):
+        return {"login": login, "url": f"{base_url(request)}/users/{login}", "type": "User"}
+
+    @app.get("/orgs/{org}")
+    async def get_org(org: str, request: Request):
+        return {"login": org, "url": f"{base_url(request)}/orgs/{org}", "type": "Organization"}
+
+    @app.get("/repos/{owner}/{name}")
+    async def get_repo(owner: str, name: str, request: Request):
+        return github.repo_json(base_url(request), owner, name)
+
+    @app.post("/repos/{owner}/{name}/pulls")
+    async def create_pull(owner: str, name: str, request: Request):
+        pull = github.create_pull(base_url(request), owner, name, await request.json())
+        return JSONResponse(status_code=201, content=pull)
+
+    @app.get("/repos/{owner}/{name}/pulls/{number}")
+    async def get_pull(owner: str, name: str, number: int):
+        pull = github.pulls.get((owner, name), {}).get(number)
+        if pull is None:
+            return JSONResponse(status_code=404, content={"message": "Not Found"})
+        return pull
+
+    @app.patch("/repos/{owner}/{name}/pulls/{number}")
+    async def edit_pull(owner: str, name: str, number: int, request: Request):
+        pull = github.pulls.get((owner, name), {}).get(number)
+        if pull is None:
+            return JSONResponse(status_code=404, content={"message": "Not Found"})
+        data = await request.json()
+        with github.lock:
+            pull.update({k: v for k, v in data.items() if k in ("title", "body", "state")})
+        return pull
+
+    @app.get("/stats")
+    async def get_stats():
+        return github.stats()
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8102)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    uvicorn.run(create_app(FakeGitHub(args.latency)), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Local stand-in for the Azure OpenAI chat completions API.
+
+Answers the backend's prompts (identify, plan, code, file generation, directory summaries,
+PR descriptions) with small but valid responses, with configurable latency, token rate,
+429 injection and SSE streaming. With --replay, prompts found in pipeline recordings (see
+PIPELINE_RECORD) get their recorded response after their recorded latency instead:
+
+    python -m bench.fake_openai --port 8101 --latency 0.4 --tokens-per-second 120 --error-rate 0.05
+    python -m bench.fake_openai --port 8101 --replay data/.recordings/<trace_id>.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeOpenAIConfig:
+    def __init__(self, latency: float = 0.3, tokens_per_second: float = 150.0, error_rate: float = 0.0,
+                 retry_after: float = 1.0, completion_tokens: int = 300, jitter: float = 0.2,
+                 seed: Optional[int] = None, replies: Optional[Dict[str, Dict]] = None):
+        # Seconds before the first token
+        self.latency = latency
+        # Output speed after the first token; 0 returns the whole completion at once
+        self.tokens_per_second = tokens_per_second
+        # Share of requests answered with 429 + Retry-After
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        # Target size of generated code (capped by max_completion_tokens)
+        self.completion_tokens = completion_tokens
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        # messages_key -> recorded LLM call (content, finish_reason, usage, duration)
+        self.replies = replies or {}
+
+
+def messages_key(messages: List[Dict]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_replies(paths: List[str]) -> Dict[str, Dict]:
+    """
+    The LLM calls of one or more pipeline recordings, keyed by their messages.
+    """
+    replies = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            recording = json.load(f)
+        for call in recording.get('llm_calls') or []:
+            if call.get('content') is not None:
+                replies[messages_key(call['messages'])] = call
+    return replies
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _python_module(filename: str, request: str, tokens: int) -> str:
+    name = re.sub(r'\W', '_', filename.rsplit('/', 1)[-1].rsplit('.', 1)[0]) or 'module'
+    parts = [f'"""{name}: {request[:60]}"""\n', 'import logging\n', '', 'logger = logging.getLogger(__name__)\n']
+    i = 0
+    while approx_tokens('\n'.join(parts)) < tokens:
+        parts.append(f'\ndef {name}_step_{i}(value):\n    logger.info("step {i}: %s", value)\n    return value\n')
+        i += 1
+    return '\n'.join(parts).strip() + '\n'
+
+
+def _line_value(prompt: str, label: str) -> str:
+    m = re.search(rf'^{re.escape(label)}\s*(.*)$', prompt, re.M)
+    return m.group(1).strip() if m else ''
+
+
+def _python_files(text: str) -> List[str]:
+    return [f for f in re.split(r'[\s,]+', text) if f.endswith('.py')]
+
+
+def answer(messages: List[Dict], max_tokens: int, config: FakeOpenAIConfig) -> str:
+    """
+    A plausible answer to one of the backend's prompts.
+    """
+    prompt = messages[-1].get('content') or ''
+    system = messages[0].get('content') or ''
+    request = _line_value(prompt, 'User request:') or 'change'
+    code_tokens = min(config.completion_tokens, max(50, max_tokens - 50))
+
+    if prompt.rstrip().endswith('Relevant file(s):'):
+        files = _python_files(_line_value(prompt, 'Files in repo:'))
+        return ', '.join(files[:2]) or 'main.py'
+    if prompt.rstrip().endswith('Relevant subdirectories:'):
+        dirs = re.findall(r'^(\S+/):', prompt, re.M)
+        return dirs[0] if dirs else 'none'
+    if prompt.rstrip().endswith('Summary:'):
+        return f"Holds the {_line_value(prompt, 'Directory:') or 'root'} part of the synthetic service."
+    if 'Write the complete content of:' in prompt:
+        filename = _line_value(prompt, 'Write the complete content of:')
+        if filename.endswith('.txt'):
+            return 'requests>=2.0\n'
+        return _python_module(filename, request, code_tokens)
+    targets = _python_files(_line_value(prompt, 'Target file(s):')) or ['bench_generated.py']
+    if 'Files:\n' in prompt and 'Plan:' in prompt:
+        return "---\nPlan:\n1. Add logging to the target modules.\n---\nFiles:\n" + '\n'.join(targets[:2]) + "\n---"
+    if 'Code:\n' in prompt:
+        per_file = max(50, code_tokens // len(targets[:2]))
+        code = '\n'.join(f"# {t}\n{_python_module(t, request, per_file)}" for t in targets[:2])
+        return f"---\nPlan:\n1. Add logging to the target modules.\n---\nCode:\n{code}---"
+    if 'PR description' in system or 'pull request description' in prompt.lower():
+        return f"Add logging for: {request[:60]}\n\nThis change adds structured logging to the affected modules."
+    return "OK"
+
+
+class FakeOpenAIStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.streamed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.replayed = 0
+        self.replay_misses = 0
+
+    def as_dict(self) -> Dict:
+        with self.lock:
+            return {k: v for k, v in vars(self).items() if k != 'lock'}
+
+
+def create_app(config: Optional[FakeOpenAIConfig] = None) -> FastAPI:
+    config = config or FakeOpenAIConfig()
+    stats = FakeOpenAIStats()
+    app = FastAPI()
+    app.state.config = config
+    app.state.stats = stats
+
+    async def completions(request: Request, deployment: str):
+        body = await request.json()
+        with stats.lock:
+            stats.requests += 1
+        if config.error_rate and config.random.random() < config.error_rate:
+            with stats.lock:
+                stats.throttled += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                headers={"Retry-After": f"{config.retry_after:g}",
+                         "retry-after-ms": str(int(config.retry_after * 1000))}
+            )
+
+        messages = body.get('messages', [])
+        max_tokens = body.get('max_completion_tokens') or body.get('max_tokens') or 4096
+        recorded = config.replies.get(messages_key(messages)) if config.replies else None
+        if config.replies:
+            with stats.lock:
+                if recorded is not None:
+                    stats.replayed += 1
+                else:
+                    stats.replay_misses += 1
+        content = recorded['content'] if recorded is not None else answer(messages, max_tokens, config)
+        prompt_tokens = sum(approx_tokens(m.get('content') or '') for m in messages)
+        completion_tokens = approx_tokens(content)
+        with stats.lock:
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+        if recorded is not None:
+            # The whole recorded call time, as seen by the backend
+            latency, generation = recorded.get('duration') or 0.0, 0.0
+        else:
+            latency = config.latency * (1 + config.random.uniform(-config.jitter, config.jitter))
+            generation = completion_tokens / config.tokens_per_second if config.tokens_per_second else 0.0
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        if body.get('stream'):
+            with stats.lock:
+                stats.streamed += 1
+
+            async def events():
+                await asyncio.sleep(latency)
+                pieces = re.findall(r'.{1,16}', content, re.S) or ['']
+                delay = generation / len(pieces)
+                for i, piece in enumerate(pieces):
+                    delta = {"content": piece}
+                    if i == 0:
+                        delta["role"] = "assistant"
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": deployment, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if delay:
+                        await asyncio.sleep(delay)
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": deployment, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency + generation)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": (recorded or {}).get('finish_reason') or "stop"}],
+            "usage": usage,
+        }
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_completions(deployment: str, request: Request):
+        return await completions(request, deployment)
+
+    @app.post("/chat/completions")
+    async def openai_completions(request: Request):
+        return await completions(request, 'fake')
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.as_dict()
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8101)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=150.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--completion-tokens', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--replay', nargs='*', default=[], help="pipeline recordings to answer from")
+    args = parser.parse_args()
+    config = FakeOpenAIConfig(args.latency, args.tokens_per_second, args.error_rate, args.retry_after,
+                              args.completion_tokens, seed=args.seed, replies=load_replies(args.replay))
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
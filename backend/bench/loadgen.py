@@ -0,0 +1,385 @@
+"""
+End-to-end load benchmark for the backend.
+
+Starts the fake Azure OpenAI and GitHub servers and local bare remotes, starts the backend
+against them, then drives /chat, /branches, /pr/generate and /studio/pr at each concurrency
+level, once with every client on its own remote (isolated) and once with all of them on the
+same remote (shared). Reports throughput and p50/p95/p99 per endpoint and per stage (from the
+backend's Server-Timing header) and stores the run under bench/results for later comparison:
+
+    cd backend
+    python -m bench.loadgen --concurrency 1,4,8 --requests 16 --label baseline
+    python -m bench.loadgen --concurrency 1,4,8 --requests 16 --compare bench/results/baseline.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.remotes import create_remotes
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(BACKEND_DIR)
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ENDPOINTS = ['chat', 'branches', 'pr_generate', 'studio_pr']
+# isolated: client i works on remote i; shared: every client works on the first remote, so
+# requests contend for one working tree and its repo lock
+REPO_MODES = ['isolated', 'shared']
+REMOTE_PREFIX = 'bench'
+MESSAGE = "Add logging to the service handlers"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    # Nearest-rank percentile
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.4999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """
+    'identify;dur=812.3, generate;dur=1500.0' -> {'identify': 0.8123, 'generate': 1.5}
+    """
+    stages = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                try:
+                    stages[name] = stages.get(name, 0.0) + float(value) / 1000
+                except ValueError:
+                    pass
+    return stages
+
+
+class Service:
+    """
+    A server started as a child process and waited on until it answers `ready_path`.
+    """
+
+    def __init__(self, name: str, args: List[str], port: int, ready_path: str, env: Optional[Dict] = None,
+                 cwd: str = BACKEND_DIR, log_dir: Optional[str] = None):
+        self.name = name
+        self.url = f"http://127.0.0.1:{port}"
+        self.ready_path = ready_path
+        log = open(os.path.join(log_dir, f'{name}.log'), 'w') if log_dir else subprocess.DEVNULL
+        self.process = subprocess.Popen(args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with code {self.process.returncode}")
+            try:
+                if httpx.get(self.url + self.ready_path, timeout=2).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.name} did not become ready in {timeout}s")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def start_services(args, work_dir: str, replay: List[str] = (),
+                   backend_env: Optional[Dict[str, str]] = None) -> Tuple[Service, Service, Service]:
+    """
+    Start the fakes and a backend wired to them, keeping its clones and caches under
+    <work_dir>/data. `replay` recordings are answered from by the fake OpenAI.
+    """
+    python = sys.executable
+    openai_port, github_port, backend_port = free_port(), free_port(), free_port()
+    fake_openai = Service('fake_openai', [
+        python, '-m', 'bench.fake_openai', '--port', str(openai_port),
+        '--latency', str(args.latency), '--tokens-per-second', str(args.tokens_per_second),
+        '--error-rate', str(args.error_rate), '--completion-tokens', str(args.completion_tokens),
+        '--seed', '1', *(['--replay', *replay] if replay else []),
+    ], openai_port, '/stats', log_dir=work_dir)
+    fake_github = Service('fake_github', [
+        python, '-m', 'bench.fake_github', '--port', str(github_port), '--latency', str(args.github_latency),
+    ], github_port, '/stats', log_dir=work_dir)
+
+    env = dict(os.environ)
+    env.pop('GITHUB_ORG', None)
+    env.update({
+        'OPENAI_ENDPOINT': fake_openai.url,
+        'OPENAI_KEY': 'bench',
+        'AZURE_OPENAI_ENDPOINT': fake_openai.url,
+        'AZURE_OPENAI_API_KEY': 'bench',
+        'GITHUB_API_URL': fake_github.url,
+        'GITHUB_TOKEN': 'bench',
+        'DATA_DIR': os.path.join(work_dir, 'data'),
+        'PYTHONPATH': os.pathsep.join([REPO_ROOT, BACKEND_DIR, env.get('PYTHONPATH', '')]),
+        **(backend_env or {}),
+    })
+    backend = Service('backend', [
+        python, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(backend_port),
+        '--log-level', 'warning', '--workers', str(getattr(args, 'workers', 1)),
+    ], backend_port, '/health', env=env, log_dir=work_dir)
+    for service in (fake_openai, fake_github, backend):
+        service.wait_ready()
+    return fake_openai, fake_github, backend
+
+
+class LoadRun:
+    def __init__(self, backend_url: str, remotes: List[str]):
+        self.backend_url = backend_url
+        self.remotes = remotes
+        # remote -> (clone path in the backend, branch created by the warm-up /chat)
+        self.clones: Dict[str, Tuple[str, str]] = {}
+        self.records: List[Dict] = []
+
+    def build(self, endpoint: str, worker: int, level: int, i: int,
+              mode: str = 'isolated') -> Tuple[str, str, Optional[Dict]]:
+        remote = self.remotes[0] if mode == 'shared' else self.remotes[worker % len(self.remotes)]
+        repo_path, warm_branch = self.clones[remote]
+        tag = f"{mode}-c{level}-w{worker}-{i}"
+        if endpoint == 'chat':
+            return 'POST', '/chat', {"message": MESSAGE, "github_link": remote,
+                                     "username": f"bench{worker}", "descriptive_name": f"load {tag}"}
+        if endpoint == 'branches':
+            return 'GET', f"/branches/{repo_path}?prefix=feature/&sort=date&order=desc&limit=50", None
+        if endpoint == 'pr_generate':
+            return 'POST', '/pr/generate', {"repo_path": repo_path, "source_branch": warm_branch,
+                                            "target_branch": "main", "title": "Bench PR",
+                                            "description": MESSAGE, "username": "bench-warm"}
+        if endpoint == 'studio_pr':
+            code = f'"""Studio file {tag}."""\n\n\ndef studio_{i}():\n    return {i}\n'
+            return 'POST', '/studio/pr', {"repo_path": repo_path, "files": {f"studio/studio_{tag}.py": code},
+                                          "original_query": MESSAGE, "username": f"bench{worker}-{tag}",
+                                          "pr_title": f"Studio {tag}"}
+        raise ValueError(f"Unknown endpoint {endpoint}")
+
+    async def send(self, client: httpx.AsyncClient, method: str, path: str, body: Optional[Dict],
+                   user: str) -> Dict:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, self.backend_url + path, json=body, headers={"X-User": user})
+            elapsed = time.perf_counter() - started
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = {}
+            ok = response.status_code == 200 and not (isinstance(payload, dict) and payload.get("status") == "error")
+            return {"status": response.status_code, "ok": ok, "latency": elapsed,
+                    "stages": parse_server_timing(response.headers.get('server-timing', '')),
+                    "error": None if ok else str(payload)[:300], "payload": payload}
+        except httpx.HTTPError as e:
+            return {"status": None, "ok": False, "latency": time.perf_counter() - started, "stages": {},
+                    "error": f"{type(e).__name__}: {e}", "payload": {}}
+
+    async def warm_up(self, client: httpx.AsyncClient):
+        # One /chat per remote clones it, builds the caches and leaves a branch for /pr/generate
+        async def warm(remote: str):
+            body = {"message": MESSAGE, "github_link": remote, "username": "bench-warm", "descriptive_name": "warm"}
+            result = await self.send(client, 'POST', '/chat', body, 'bench-warm')
+            if not result["ok"]:
+                raise RuntimeError(f"Warm-up /chat failed for {remote}: {result['error']}")
+            self.clones[remote] = (result["payload"]["repo_path"], result["payload"]["branch_name"])
+
+        await asyncio.gather(*(warm(r) for r in self.remotes))
+
+    async def run_level(self, client: httpx.AsyncClient, endpoint: str, level: int, requests: int,
+                        mode: str = 'isolated') -> float:
+        """
+        `requests` requests from `level` concurrent workers, each on its own remote (isolated)
+        or all on the same one (shared). Returns the wall time.
+        """
+        async def worker(w: int):
+            for i in range(w, requests, level):
+                method, path, body = self.build(endpoint, w, level, i, mode)
+                result = await self.send(client, method, path, body, f"bench{w}")
+                result.pop("payload")
+                self.records.append({"endpoint": endpoint, "concurrency": level, "mode": mode, **result})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(level)))
+        return time.perf_counter() - started
+
+
+def summarize(records: List[Dict], walls: Dict[Tuple[str, int, str], float]) -> List[Dict]:
+    rows = []
+    for (endpoint, level, mode), wall in walls.items():
+        batch = [r for r in records
+                 if r["endpoint"] == endpoint and r["concurrency"] == level and r["mode"] == mode]
+        ok = [r for r in batch if r["ok"]]
+        latencies = [r["latency"] for r in ok]
+        stage_names = []
+        for r in ok:
+            stage_names.extend(s for s in r["stages"] if s not in stage_names)
+        rows.append({
+            "endpoint": endpoint,
+            "concurrency": level,
+            "mode": mode,
+            "requests": len(batch),
+            "errors": len(batch) - len(ok),
+            "throttled": sum(1 for r in batch if r["status"] == 429),
+            "throughput": round(len(ok) / wall, 3) if wall else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "stages": {
+                name: {p: percentile([r["stages"][name] for r in ok if name in r["stages"]], pct)
+                       for p, pct in (("p50", 50), ("p95", 95), ("p99", 99))}
+                for name in stage_names
+            },
+            "sample_errors": [r["error"] for r in batch if not r["ok"]][:3],
+        })
+    return rows
+
+
+def fmt(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:8.0f}ms"
+
+
+def print_report(rows: List[Dict]):
+    print(f"\n{'endpoint':<12} {'mode':<8} {'conc':>4} {'ok/n':>7} {'req/s':>7} {'p50':>10} {'p95':>10} {'p99':>10}")
+    for row in rows:
+        print(f"{row['endpoint']:<12} {row['mode']:<8} {row['concurrency']:>4} "
+              f"{row['requests'] - row['errors']:>3}/{row['requests']:<3} {row['throughput'] or 0:>7.2f} "
+              f"{fmt(row['p50']):>10} {fmt(row['p95']):>10} {fmt(row['p99']):>10}")
+        for name, pcts in row["stages"].items():
+            print(f"{'':<12} {'':<8} {'':>4} {name:>15} {fmt(pcts['p50']):>10} {fmt(pcts['p95']):>10} {fmt(pcts['p99']):>10}")
+        for error in row["sample_errors"]:
+            print(f"{'':<26} error: {error}")
+
+
+def compare(rows: List[Dict], baseline_file: str, threshold: float) -> List[str]:
+    """
+    Regressions against a stored run: p50/p95 slower or throughput lower by more than `threshold`.
+    """
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        # Runs from before the shared mode existed only measured isolated remotes
+        baseline = {(r["endpoint"], r["concurrency"], r.get("mode", "isolated")): r
+                    for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline_file} (threshold {threshold:.0%}):")
+    for row in rows:
+        base = baseline.get((row["endpoint"], row["concurrency"], row["mode"]))
+        if not base:
+            continue
+        changes = []
+        for metric, higher_is_worse in (("p50", True), ("p95", True), ("throughput", False)):
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            delta = (new - old) / old
+            changes.append(f"{metric} {delta:+.1%}")
+            if (delta > threshold) if higher_is_worse else (delta < -threshold):
+                regressions.append(f"{row['endpoint']} {row['mode']} @{row['concurrency']}: "
+                                   f"{metric} {old:.3f} -> {new:.3f} ({delta:+.1%})")
+        print(f"  {row['endpoint']:<12} {row['mode']:<8} @{row['concurrency']:<3} " + ', '.join(changes))
+    for regression in regressions:
+        print(f"  REGRESSION {regression}")
+    return regressions
+
+
+async def run(args) -> Dict:
+    work_dir = tempfile.mkdtemp(prefix='bench-run-')
+    levels = [int(c) for c in args.concurrency.split(',')]
+    endpoints = args.endpoints.split(',')
+    modes = args.repo_modes.split(',')
+    unknown = set(modes) - set(REPO_MODES)
+    if unknown:
+        raise SystemExit(f"Unknown repo modes: {', '.join(sorted(unknown))} (use {', '.join(REPO_MODES)})")
+    services = ()
+    try:
+        print(f"Creating {max(levels)} remotes in {work_dir}")
+        remotes = create_remotes(os.path.join(work_dir, 'remotes'), max(levels), args.modules, args.branches,
+                                 prefix=REMOTE_PREFIX)
+        services = start_services(args, work_dir)
+        fake_openai, fake_github, backend = services
+        load = LoadRun(backend.url, remotes)
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            print("Warming up")
+            await load.warm_up(client)
+            walls = {}
+            for mode in modes:
+                for level in levels:
+                    for endpoint in endpoints:
+                        print(f"Running {endpoint} at concurrency {level} on {mode} remotes")
+                        walls[(endpoint, level, mode)] = await load.run_level(
+                            client, endpoint, level, args.requests, mode
+                        )
+            fake_stats = {
+                "openai": (await client.get(fake_openai.url + '/stats')).json(),
+                "github": (await client.get(fake_github.url + '/stats')).json(),
+            }
+        rows = summarize(load.records, walls)
+        return {
+            "label": args.label,
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "config": {k: v for k, v in vars(args).items() if k not in ('compare', 'keep')},
+            "fakes": fake_stats,
+            "results": rows,
+        }
+    finally:
+        for service in services:
+            service.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        else:
+            print(f"Kept remotes, clones, traces and service logs in {work_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the backend")
+    parser.add_argument('--concurrency', default='1,4,8', help="comma separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=16, help="requests per endpoint and level")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--repo-modes', default=','.join(REPO_MODES),
+                        help="isolated (one remote per client) and/or shared (all clients on one remote)")
+    parser.add_argument('--modules', type=int, default=40, help="modules per synthetic repo")
+    parser.add_argument('--branches', type=int, default=0, help="extra seeded branches per remote")
+    parser.add_argument('--latency', type=float, default=0.3, help="fake OpenAI time to first token")
+    parser.add_argument('--tokens-per-second', type=float, default=150.0)
+    parser.add_argument('--completion-tokens', type=int, default=300)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of fake OpenAI 429s")
+    parser.add_argument('--github-latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--workers', type=int, default=1, help="backend worker processes")
+    parser.add_argument('--label', default=None, help="results file name (default: timestamp)")
+    parser.add_argument('--compare', default=None, help="results file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed regression, e.g. 0.1 = 10%%")
+    parser.add_argument('--keep', action='store_true', help="keep remotes, clones and logs")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result["results"])
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = args.label or datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    out_file = os.path.join(RESULTS_DIR, f'{name}.json')
+    with open(out_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {out_file}")
+    if args.compare and compare(result["results"], args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
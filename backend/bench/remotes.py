@@ -0,0 +1,94 @@
+"""
+Local bare git remotes with a synthetic Python service in each, for benchmarks:
+
+    python -m bench.remotes /tmp/bench-remotes --count 4 --modules 40 --branches 50
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import List
+
+GIT_IDENTITY = ['-c', 'user.name=bench', '-c', 'user.email=bench@example.com']
+
+
+def _git(cwd: str, *args: str):
+    subprocess.run(['git', *GIT_IDENTITY, *args], cwd=cwd, check=True, capture_output=True)
+
+
+def _module_source(package: str, index: int, modules: int) -> str:
+    # Each module imports its neighbour so the symbol index has dependencies and callers to pack
+    dependency = (index + 1) % modules
+    return (
+        f'"""Synthetic module {index} of {package}."""\n'
+        f'from {package}.module_{dependency} import step_{dependency}\n\n\n'
+        f'class Handler{index}:\n'
+        f'    def __init__(self, scale={index + 1}):\n'
+        f'        self.scale = scale\n\n'
+        f'    def handle(self, value):\n'
+        f'        return step_{index}(value) * self.scale\n\n\n'
+        f'def step_{index}(value):\n'
+        f'    if value > {index * 10}:\n'
+        f'        return step_{dependency}(value - 1)\n'
+        f'    return value + {index}\n'
+    )
+
+
+def create_remote(path: str, modules: int = 40, branches: int = 0, package: str = 'service') -> str:
+    """
+    Create a bare repo at `path` whose main branch holds a package of `modules` modules,
+    plus `branches` extra feature branches with one commit each. Returns `path`.
+    """
+    work = tempfile.mkdtemp(prefix='bench-work-')
+    try:
+        _git(work, 'init', '-q', '-b', 'main')
+        os.makedirs(os.path.join(work, package))
+        with open(os.path.join(work, package, '__init__.py'), 'w', encoding='utf-8') as f:
+            f.write('')
+        for i in range(modules):
+            with open(os.path.join(work, package, f'module_{i}.py'), 'w', encoding='utf-8') as f:
+                f.write(_module_source(package, i, modules))
+        with open(os.path.join(work, 'main.py'), 'w', encoding='utf-8') as f:
+            f.write(f'from {package}.module_0 import Handler0\n\n\nif __name__ == "__main__":\n'
+                    f'    print(Handler0().handle(1))\n')
+        with open(os.path.join(work, 'requirements.txt'), 'w', encoding='utf-8') as f:
+            f.write('requests>=2.0\n')
+        _git(work, 'add', '-A')
+        _git(work, 'commit', '-q', '-m', 'Initial synthetic service')
+        for b in range(branches):
+            _git(work, 'checkout', '-q', '-b', f'feature/bench/seed-{b:04d}', 'main')
+            with open(os.path.join(work, f'seed_{b}.txt'), 'w', encoding='utf-8') as f:
+                f.write(f'{b}\n')
+            _git(work, 'add', '-A')
+            _git(work, 'commit', '-q', '-m', f'Seed branch {b}')
+        _git(work, 'checkout', '-q', 'main')
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        _git(os.path.dirname(os.path.abspath(path)) or '.', 'clone', '-q', '--bare', work, os.path.abspath(path))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return path
+
+
+def create_remotes(root: str, count: int, modules: int = 40, branches: int = 0, prefix: str = 'bench') -> List[str]:
+    """
+    Create `count` bare remotes named <prefix>-<i>.git under `root`. Returns their paths.
+    """
+    os.makedirs(root, exist_ok=True)
+    return [create_remote(os.path.join(root, f'{prefix}-{i}.git'), modules, branches) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--count', type=int, default=4)
+    parser.add_argument('--modules', type=int, default=40)
+    parser.add_argument('--branches', type=int, default=0)
+    args = parser.parse_args()
+    for path in create_remotes(args.root, args.count, args.modules, args.branches):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Replay a pipeline recording offline.
+
+A backend started with PIPELINE_RECORD=1 writes every request, with its LLM prompts,
+responses and timings, to data/.recordings/<trace_id>.json. This re-sends the request to a
+fresh backend whose fake OpenAI answers those prompts with the recorded responses after the
+recorded latencies, on a local copy of the recorded clone, and compares span timings:
+
+    cd backend
+    python -m bench.replay data/.recordings/<trace_id>.json --repeat 3
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.loadgen import BACKEND_DIR, fmt, percentile, start_services
+
+
+def _git(cwd: str, *args: str) -> str:
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+def span_totals(spans: List[Dict]) -> Dict[str, float]:
+    # Spans that ran more than once (LLM calls, fetches) are summed, in first-seen order
+    totals: Dict[str, float] = {}
+    for s in spans:
+        totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration"]
+    return totals
+
+
+def load_trace(trace_dir: str, trace_id: str) -> List[Dict]:
+    """
+    The spans of one exported trace as [{"name", "duration"}].
+    """
+    for path in sorted(glob.glob(os.path.join(trace_dir, 'traces-*.jsonl')), reverse=True):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if trace_id not in line:
+                    continue
+                spans = json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+                return [{"name": s["name"],
+                         "duration": (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e9}
+                        for s in spans]
+    return []
+
+
+def prepare_repo(body: Dict, source_data_dir: str, remote_dir: str, data_dir: str) -> Dict:
+    """
+    Point the request at a bare remote made from the recorded clone. Branches the request
+    would create again (feature/<username>/...) are dropped from it so it can push them.
+    """
+    link = body.get("github_link") or body.get("repo_path")
+    if not link:
+        return body
+    name = link.rstrip('/').split('/')[-1].replace('.git', '')
+    clone = os.path.join(source_data_dir, name)
+    if not os.path.isdir(os.path.join(clone, '.git')):
+        raise SystemExit(f"No clone of {name} in {source_data_dir} to replay against")
+    remote = os.path.join(remote_dir, f'{name}.git')
+    os.makedirs(remote_dir, exist_ok=True)
+    _git(remote_dir, 'clone', '-q', '--bare', clone, remote)
+    _git(remote, 'symbolic-ref', 'HEAD', 'refs/heads/main')
+    keep = {body.get("source_branch"), body.get("target_branch"), 'main'}
+    for branch in _git(remote, 'for-each-ref', '--format=%(refname:short)', 'refs/heads/').split():
+        if body.get("username") and branch.startswith(f"feature/{body['username']}/") and branch not in keep:
+            _git(remote, 'branch', '-q', '-D', branch)
+
+    body = dict(body)
+    if "github_link" in body:
+        body["github_link"] = remote
+    else:
+        # Endpoints taking a repo_path expect the clone, with its local branches, to exist
+        repo_path = os.path.join(data_dir, name)
+        _git(remote_dir, 'clone', '-q', remote, repo_path)
+        _git(repo_path, 'fetch', '-q', '--update-head-ok', 'origin', '+refs/heads/*:refs/heads/*')
+        body["repo_path"] = repo_path
+    return body
+
+
+def replay_once(args, recording: Dict, run_dir: str) -> Tuple[Dict[str, float], Dict]:
+    """
+    One replay against a fresh backend, so no clone, cache or session of an earlier run is
+    reused. Returns the span totals of the replayed trace and the fake OpenAI counters.
+    """
+    request = recording["request"]
+    body: Optional[Dict] = json.loads(request["body"]) if request.get("body") else None
+    data_dir = os.path.join(run_dir, 'data')
+    os.makedirs(run_dir, exist_ok=True)
+    if body:
+        body = prepare_repo(body, args.data_dir, os.path.join(run_dir, 'remotes'), data_dir)
+    services = ()
+    try:
+        services = start_services(args, run_dir, replay=[args.recording])
+        fake_openai, _, backend = services
+        url = backend.url + request["path"] + (f"?{request['query']}" if request.get("query") else '')
+        with httpx.Client(timeout=args.timeout) as client:
+            response = client.request(request["method"], url, json=body,
+                                      headers={"X-User": request.get("user") or "replay"})
+            openai_stats = client.get(fake_openai.url + '/stats').json()
+    finally:
+        for service in services:
+            service.stop()
+    trace_id = response.headers.get('x-trace-id')
+    print(f"HTTP {response.status_code}, trace {trace_id}")
+    spans = load_trace(os.path.join(data_dir, '.traces'), trace_id) if trace_id else []
+    return span_totals(spans), openai_stats
+
+
+def replay(args) -> Dict:
+    with open(args.recording, 'r', encoding='utf-8') as f:
+        recording = json.load(f)
+    work_dir = tempfile.mkdtemp(prefix='bench-replay-')
+    runs: List[Dict[str, float]] = []
+    openai_stats: Dict[str, int] = {}
+    try:
+        for i in range(args.repeat):
+            print(f"Run {i + 1}/{args.repeat}: ", end='', flush=True)
+            totals, stats = replay_once(args, recording, os.path.join(work_dir, f'run-{i}'))
+            runs.append(totals)
+            for key, value in stats.items():
+                openai_stats[key] = openai_stats.get(key, 0) + value
+    finally:
+        if args.keep:
+            print(f"Kept clones, traces and service logs in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    recorded = span_totals(recording.get("spans") or [])
+    names = list(recorded) + [n for run in runs for n in run if n not in recorded]
+    rows = []
+    for name in dict.fromkeys(names):
+        replayed = percentile([run[name] for run in runs if name in run], 50)
+        before = recorded.get(name)
+        rows.append({"span": name, "recorded": before, "replayed_p50": replayed,
+                     "delta": (replayed - before) / before if before and replayed is not None else None})
+    return {"recording": args.recording, "trace_id": recording.get("trace_id"),
+            "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+            "openai": openai_stats, "rows": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('recording')
+    parser.add_argument('--data-dir', default=os.getenv("DATA_DIR", os.path.join(BACKEND_DIR, 'data')),
+                        help="data directory of the recording backend (holds the clone)")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.3, help="fake OpenAI latency for unrecorded prompts")
+    parser.add_argument('--tokens-per-second', type=float, default=150.0)
+    parser.add_argument('--completion-tokens', type=int, default=300)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--github-latency', type=float, default=0.05)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--keep', action='store_true', help="keep clones, traces and logs")
+    args = parser.parse_args()
+
+    result = replay(args)
+    print(f"\n{'span':<32} {'recorded':>10} {'replayed':>10} {'delta':>8}")
+    for row in result["rows"]:
+        delta = '-' if row["delta"] is None else f"{row['delta']:+.0%}"
+        print(f"{row['span'][:32]:<32} {fmt(row['recorded']):>10} {fmt(row['replayed_p50']):>10} {delta:>8}")
+    stats = result["openai"]
+    print(f"\nLLM calls answered from the recording: {stats.get('replayed', 0)}, "
+          f"synthetic (not in the recording): {stats.get('replay_misses', 0)}")
+
+
+if __name__ == "__main__":
+    main()
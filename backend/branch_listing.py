@@ -0,0 +1,93 @@
+import os
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from shared_cache import shared_cache
+
+# One for-each-ref call returns every branch with its tip; fields are NUL separated
+FOR_EACH_REF_FORMAT = '%(refname:lstrip=2)%00%(objectname)%00%(committerdate:iso-strict)%00%(committerdate:unix)%00%(HEAD)'
+
+_cache: Dict[str, Tuple[Tuple, List[Dict]]] = {}
+_cache_lock = threading.Lock()
+
+
+def _git_dir(repo_path: str) -> str:
+    git_dir = os.path.join(repo_path, '.git')
+    return git_dir if os.path.isdir(git_dir) else repo_path
+
+
+def ref_state(repo_path: str) -> Tuple:
+    """
+    Cheap fingerprint of the ref store: HEAD, packed-refs and every directory under refs/heads.
+    Git updates loose refs by renaming a lock file into place, so any branch create, update or
+    delete changes the mtime of the directory holding it.
+    """
+    git_dir = _git_dir(repo_path)
+    state = []
+    for name in ('HEAD', 'packed-refs'):
+        try:
+            st = os.stat(os.path.join(git_dir, name))
+            state.append((name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            state.append((name, None, None))
+    for root, _, _ in os.walk(os.path.join(git_dir, 'refs', 'heads')):
+        state.append((root, os.stat(root).st_mtime_ns))
+    return tuple(state)
+
+
+def _read_branches(repo_path: str) -> List[Dict]:
+    output = subprocess.run(
+        ['git', 'for-each-ref', f'--format={FOR_EACH_REF_FORMAT}', 'refs/heads/'],
+        cwd=repo_path, capture_output=True, text=True, check=True
+    ).stdout
+    branches = []
+    for line in output.splitlines():
+        name, sha, date, timestamp, head = line.split('\0')
+        branches.append({
+            "name": name,
+            "is_current": head == '*',
+            "last_commit": sha[:7],
+            "last_commit_date": date,
+            "last_commit_timestamp": int(timestamp or 0),
+        })
+    return branches
+
+
+def _cached_branches(repo_path: str, state: Tuple) -> List[Dict]:
+    # In-process first, then the listing another worker already read for the same ref state
+    with _cache_lock:
+        cached = _cache.get(repo_path)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+    shared = shared_cache.get('branches', repo_path)
+    if shared is not None and shared.get("state") == repr(state):
+        branches = shared["branches"]
+    else:
+        branches = _read_branches(repo_path)
+        shared_cache.set('branches', repo_path, {"state": repr(state), "branches": branches})
+    with _cache_lock:
+        _cache[repo_path] = (state, branches)
+    return branches
+
+
+def list_branches(repo_path: str, prefix: Optional[str] = None, sort: str = 'name', descending: bool = False,
+                  offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """
+    List branches with optional prefix filter, sorting ('name' or 'date') and pagination.
+    The full listing is cached per repo, in this process and for the other workers, until the
+    ref store changes.
+    Returns (page of branches, total matching branches).
+    """
+    repo_path = os.path.abspath(repo_path)
+    branches = _cached_branches(repo_path, ref_state(repo_path))
+
+    if prefix:
+        branches = [b for b in branches if b["name"].startswith(prefix)]
+    key = 'last_commit_timestamp' if sort == 'date' else 'name'
+    # for-each-ref already returns branches sorted by name
+    if key != 'name' or descending:
+        branches = sorted(branches, key=lambda b: b[key], reverse=descending)
+    total = len(branches)
+    end = None if limit is None else offset + limit
+    return branches[offset:end], total
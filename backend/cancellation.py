@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional, Set
+
+from starlette.responses import JSONResponse
+
+from config import settings
+
+CANCEL_POLL_SECONDS = settings.cancel_poll_seconds
+# nginx's "client closed request"; nobody reads it, but it shows up in access logs
+CLIENT_CLOSED_STATUS = 499
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """
+    Cancellation state of one request, shared by the coroutine running it and any worker
+    threads it started. Cancelling kills the child processes registered with the token and
+    runs the registered cleanup callbacks; threads notice it at their next `checkpoint()`.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._processes: Set[subprocess.Popen] = set()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            processes, callbacks = list(self._processes), list(self._callbacks)
+        for process in processes:
+            kill_process(process)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in cancellation callback: {str(e)}")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        self._callbacks.append(callback)
+
+    def add_process(self, process: subprocess.Popen):
+        with self._lock:
+            cancelled = self._event.is_set()
+            if not cancelled:
+                self._processes.add(process)
+        if cancelled:
+            kill_process(process)
+
+    def remove_process(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar('cancel_token', default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+def checkpoint():
+    """
+    Raise RequestCancelled if the current request has been abandoned. Call before any step
+    that is expensive or has side effects (LLM call, commit, push, PR creation).
+    """
+    token = _current.get()
+    if token is not None and token.cancelled:
+        raise RequestCancelled("Client disconnected")
+
+
+def kill_process(process: subprocess.Popen):
+    if process.poll() is not None:
+        return
+    try:
+        # Processes are started in their own session, so this also takes down their children
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+def run_process(args, timeout: Optional[float] = None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run(capture_output=True, text=True) that is killed, with its children, when the
+    current request is cancelled (raising RequestCancelled) or when `timeout` expires.
+    """
+    token = _current.get()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               start_new_session=True, **kwargs)
+    if token is not None:
+        token.add_process(process)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    try:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=0.1)
+                break
+            except subprocess.TimeoutExpired:
+                if deadline is not None and time.monotonic() > deadline:
+                    kill_process(process)
+                    process.communicate()
+                    raise subprocess.TimeoutExpired(args, timeout)
+                if token is not None and token.cancelled:
+                    kill_process(process)
+                    process.communicate()
+                    raise RequestCancelled("Client disconnected")
+    finally:
+        if token is not None:
+            token.remove_process(process)
+    if token is not None and token.cancelled:
+        raise RequestCancelled("Client disconnected")
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+async def _watch_disconnect(request, token: CancelToken, task: asyncio.Task):
+    while not task.done():
+        if await request.is_disconnected():
+            print(f"Client disconnected, cancelling {request.method} {request.url.path}")
+            token.cancel()
+            task.cancel()
+            return
+        await asyncio.sleep(CANCEL_POLL_SECONDS)
+
+
+async def cancel_on_disconnect(request, coro, on_cancel: Optional[Callable[[], None]] = None):
+    """
+    Await `coro` as a task that is cancelled as soon as the client of `request` disconnects.
+
+    The task and the worker threads it starts see a fresh CancelToken (see checkpoint() and
+    run_process()); `on_cancel` runs once when the client goes away, e.g. to roll back
+    uncommitted changes. Returns the coroutine's result, or a 499 response after a disconnect.
+    """
+    token = CancelToken()
+    if on_cancel is not None:
+        token.on_cancel(on_cancel)
+    reset = _current.set(token)
+    try:
+        # The task copies the current context, token included
+        task = asyncio.ensure_future(coro)
+    finally:
+        _current.reset(reset)
+    watcher = asyncio.ensure_future(_watch_disconnect(request, token, task))
+    try:
+        return await task
+    except (asyncio.CancelledError, RequestCancelled):
+        if not token.cancelled:
+            task.cancel()
+            raise
+        return JSONResponse(status_code=CLIENT_CLOSED_STATUS, content={"status": "cancelled"})
+    finally:
+        watcher.cancel()
@@ -0,0 +1,170 @@
+import os
+import tempfile
+from typing import Dict, Optional
+
+from git import Repo
+
+from cancellation import checkpoint, run_process
+
+# pylint exit status is a bit mask; only fatal (1) and error (2) messages reject a change set
+PYLINT_REJECT_MASK = 1 | 2
+# Generated code routinely imports packages that are not installed in the backend environment
+PYLINT_ARGS = ['--disable=import-error,no-name-in-module', '--score=n']
+
+
+class ChangeSetError(Exception):
+    pass
+
+
+class ChangeSet:
+    """
+    A batch of file changes that is validated, written and committed as one unit.
+
+    Files are held in memory until `commit()`, which writes each one atomically
+    (temp file + rename), updates the git index once and commits once. If anything
+    fails on the way, the working tree and index are restored to their previous state.
+    """
+
+    def __init__(self, repo: Repo, repo_path: str):
+        self.repo = repo
+        self.repo_path = os.path.abspath(repo_path)
+        self.files: Dict[str, str] = {}         # relative path -> new content
+        self.descriptions: Dict[str, str] = {}  # relative path -> change description
+        self._backups: Dict[str, Optional[bytes]] = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def _relative(self, file_path: str) -> str:
+        abs_path = os.path.abspath(os.path.join(self.repo_path, file_path))
+        if os.path.commonpath([abs_path, self.repo_path]) != self.repo_path or abs_path == self.repo_path:
+            raise ChangeSetError(f"File {file_path} is outside the repository")
+        return os.path.relpath(abs_path, self.repo_path)
+
+    def stage(self, file_path: str, content: str, description: str = '') -> str:
+        """
+        Add (or replace) a file in the change set. Nothing touches the disk yet.
+        Returns the path relative to the repo root.
+        """
+        path = self._relative(file_path)
+        self.files[path] = content
+        self.descriptions[path] = description
+        return path
+
+    def validate(self) -> Dict[str, str]:
+        """
+        Check every staged Python file in one pass: a syntax check in-process, then a single
+        pylint run over all of them. Raises ChangeSetError listing the problems, otherwise
+        returns the non-blocking pylint report per file.
+        """
+        python_files = {path: content for path, content in self.files.items() if path.endswith('.py')}
+        errors = []
+        for path, content in python_files.items():
+            try:
+                compile(content, path, 'exec')
+            except (SyntaxError, ValueError) as e:
+                # Null bytes raise ValueError (SyntaxError without a line number on newer Pythons)
+                lineno = getattr(e, 'lineno', None)
+                message = getattr(e, 'msg', None) or str(e)
+                errors.append(f"{path}:{lineno}: {message}" if lineno else f"{path}: {message}")
+        if errors:
+            raise ChangeSetError("Syntax errors:\n" + '\n'.join(errors))
+        if not python_files:
+            return {}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for path, content in python_files.items():
+                temp_path = os.path.join(temp_dir, path)
+                os.makedirs(os.path.dirname(temp_path), exist_ok=True)
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            # Killed if the request is abandoned while pylint runs
+            result = run_process(['pylint', *PYLINT_ARGS, *python_files.keys()], cwd=temp_dir)
+        report: Dict[str, str] = {}
+        for line in result.stdout.splitlines():
+            path = line.split(':', 1)[0]
+            if path in python_files:
+                report[path] = report.get(path, '') + line + '\n'
+        if result.returncode & PYLINT_REJECT_MASK:
+            raise ChangeSetError(f"Pylint issues found:\n{result.stdout}")
+        return report
+
+    def _write(self):
+        # Write every file to a temp file next to its target first, then rename them all into place
+        temp_paths: Dict[str, str] = {}
+        try:
+            for path, content in self.files.items():
+                abs_path = os.path.join(self.repo_path, path)
+                os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(abs_path), prefix='.changeset-')
+                temp_paths[path] = temp_path
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                # mkstemp creates 0600 files; keep the mode of the file being replaced
+                os.chmod(temp_path, os.stat(abs_path).st_mode if os.path.exists(abs_path) else 0o644)
+            for path, temp_path in list(temp_paths.items()):
+                abs_path = os.path.join(self.repo_path, path)
+                if path not in self._backups:
+                    if os.path.exists(abs_path):
+                        with open(abs_path, 'rb') as f:
+                            self._backups[path] = f.read()
+                    else:
+                        self._backups[path] = None
+                os.replace(temp_path, abs_path)
+                del temp_paths[path]
+        finally:
+            for temp_path in temp_paths.values():
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def rollback(self):
+        """
+        Restore every written file to its previous content (or remove it if it was new)
+        and reset the index entries for the staged paths.
+        """
+        for path, previous in self._backups.items():
+            abs_path = os.path.join(self.repo_path, path)
+            try:
+                if previous is None:
+                    if os.path.exists(abs_path):
+                        os.remove(abs_path)
+                else:
+                    with open(abs_path, 'wb') as f:
+                        f.write(previous)
+            except Exception as e:
+                print(f"Error rolling back {path}: {str(e)}")
+        self._backups = {}
+        if self.files:
+            try:
+                self.repo.git.reset('-q', 'HEAD', '--', *self.files.keys())
+            except Exception as e:
+                print(f"Error resetting index: {str(e)}")
+
+    def commit(self, message: str) -> str:
+        """
+        Write all staged files, add them to the index in one call and commit once.
+        Returns the new commit SHA; on failure everything is rolled back and the error re-raised.
+        """
+        if not self.files:
+            raise ChangeSetError("No changes staged")
+        # Last chance to drop the change set before anything touches the working tree
+        checkpoint()
+        try:
+            self._write()
+            # `git add` rather than IndexFile.add, which chdirs the whole process into the working
+            # tree and so races with other threads working in other repos
+            self.repo.git.add('--', *self.files.keys())
+            commit = self.repo.index.commit(message)
+        except Exception:
+            self.rollback()
+            raise
+        self._backups = {}
+        return commit.hexsha
+
+    def apply(self, message: str, validate: bool = True) -> str:
+        """
+        Validate (optionally) and commit the change set in one step.
+        """
+        if validate:
+            self.validate()
+        return self.commit(message)
@@ -1,34 +1,28 @@
+import asyncio
 import os
-import subprocess
-import tempfile
-from typing import List, Dict, Optional
-import git
+from typing import Dict, Optional, Tuple
 from git import Repo
-import pylint.lint
-import pytest
-from openai import AzureOpenAI
-from dotenv import load_dotenv
+from config import settings
+from symbol_index import get_symbol_index
+from change_set import ChangeSet, ChangeSetError
+from llm import complete, openai_client
+from locks import LockTimeout, repo_lock, run_locked
+from cancellation import RequestCancelled, checkpoint
+from timing import stage
 
-load_dotenv()
-
-# Get environment variables - using the exact names Azure OpenAI client expects
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("OPENAI_ENDPOINT")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1")
-OPENAI_DEPLOYMENT = os.getenv("OPENAI_MODEL", "gpt-4.1")  # Using same as model
-OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION", "2024-12-01-preview")
+OPENAI_DEPLOYMENT = settings.openai_deployment
 
 class CodeChangeHandler:
     def __init__(self, repo_path: str):
         self.repo_path = repo_path
         self.changes: Dict[str, str] = {}  # file_path -> change_description
+        # Why the last create_pull_request returned None (e.g. the generated code was rejected)
+        self.last_error: Optional[str] = None
+        # Commit of the branch checked out by the last create_or_checkout_branch
+        self.branch_commit: Optional[str] = None
         
         # Initialize OpenAI client
-        self.openai_client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY,
-        )
+        self.openai_client = openai_client()
         
         # Initialize git repository if it doesn't exist
         if not os.path.exists(os.path.join(repo_path, '.git')):
@@ -47,6 +41,13 @@ class CodeChangeHandler:
                 print(f"Error opening git repository: {str(e)}")
                 self.repo = None
 
+        # Generated files are staged here and written/committed together in create_pull_request
+        self.change_set = ChangeSet(self.repo, repo_path) if self.repo else None
+
+    @staticmethod
+    def branch_name_for(username: str, descriptive_name: str) -> str:
+        return f"feature/{username}/{descriptive_name.lower().replace(' ', '-')}"
+
     def create_or_checkout_branch(self, username: str, descriptive_name: str) -> Optional[str]:
         """
         Create or checkout a branch with format feature/username/descriptive-name
@@ -57,67 +58,63 @@ class CodeChangeHandler:
 
         try:
             # Format branch name
-            branch_name = f"feature/{username}/{descriptive_name.lower().replace(' ', '-')}"
-            
-            # Check if branch exists
-            if branch_name in self.repo.heads:
-                # Checkout existing branch
-                self.repo.heads[branch_name].checkout()
-            else:
-                # Create and checkout new branch
-                current = self.repo.create_head(branch_name)
-                current.checkout()
+            branch_name = self.branch_name_for(username, descriptive_name)
+
+            # Other requests (in any worker) must not change the working tree mid-checkout
+            with repo_lock(self.repo_path).hold():
+                # Check if branch exists
+                if branch_name in self.repo.heads:
+                    # Checkout existing branch
+                    self.repo.heads[branch_name].checkout()
+                else:
+                    # Create and checkout new branch; `checkout -b` records the creation in the
+                    # branch's reflog, which tells pruning that nothing was committed yet
+                    self.repo.git.checkout('-b', branch_name)
+                # The working tree may be on another request's branch as soon as the lock is
+                # released: the rest of the request reads the branch's files at this commit
+                self.branch_commit = self.repo.head.commit.hexsha
             
             return branch_name
+        except LockTimeout:
+            raise
         except Exception as e:
             print(f"Error managing branch: {str(e)}")
             return None
         
     def accept_changes(self, file_path: str, new_content: str, change_description: str) -> bool:
         """
-        Accept changes for a specific file and store the change description.
+        Stage changes for a specific file and store the change description.
+        The whole change set is validated, written and committed at once by create_pull_request.
         """
+        if self.change_set is None:
+            print("No git repository available")
+            return False
+
         try:
-            # Validate the file path
-            abs_path = os.path.join(self.repo_path, file_path)
-            if not os.path.exists(abs_path):
-                raise FileNotFoundError(f"File {file_path} does not exist")
-            
-            # Run pylint on the new content
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
-                temp_file.write(new_content)
-                temp_file.flush()
-                
-                pylint_output = subprocess.run(
-                    ['pylint', temp_file.name],
-                    capture_output=True,
-                    text=True
-                )
-                
-                if pylint_output.returncode != 0:
-                    print(f"Pylint issues found:\n{pylint_output.stdout}")
-                    return False
-            
-            # Store the changes
-            self.changes[file_path] = change_description
-            
-            # Write the new content
-            with open(abs_path, 'w') as f:
-                f.write(new_content)
-                
+            path = self.change_set.stage(file_path, new_content, change_description)
+            self.changes[path] = change_description
             return True
-            
         except Exception as e:
             print(f"Error accepting changes: {str(e)}")
             return False
 
+    def discard_changes(self):
+        """
+        Drop every staged change that has not been committed yet.
+        """
+        if self.change_set is not None:
+            for path in self.change_set.files:
+                self.changes.pop(path, None)
+        if self.repo:
+            self.change_set = ChangeSet(self.repo, self.repo_path)
+
     def generate_pr_description(self, original_prompt: str) -> str:
         """
         Generate PR description using OpenAI based on changes and original prompt
         """
         try:
-            # Create a summary of changes
-            changes_summary = "\n".join([f"- {file}: {desc}" for file, desc in self.changes.items()])
+            # Create a summary of changes (from a copy: a /chat turn on the session may be adding to them)
+            changes_summary = "\n".join([f"- {file}: {desc}" for file, desc in dict(self.changes).items()])
             
             prompt = f"""Based on the following information, generate a detailed PR description:
 
@@ -133,7 +130,8 @@ Please provide a comprehensive PR description that includes:
 4. Testing performed
 """
 
-            response = self.openai_client.chat.completions.create(
+            response = complete(
+                self.openai_client,
                 stream=False,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant that writes clear and professional PR descriptions."},
@@ -152,38 +150,130 @@ Please provide a comprehensive PR description that includes:
             print(f"Error generating PR description: {str(e)}")
             return "Error generating PR description"
     
-    def create_pull_request(self, original_prompt: str) -> Optional[str]:
+    def create_pull_request(self, original_prompt: str, branch: Optional[str] = None) -> Optional[str]:
+        """
+        Create a pull request with all accepted changes, committed and pushed on `branch`
+        (default: the checked-out branch). Other sessions may have checked out a different
+        branch in the same clone since this one was last used. Blocking, and it may wait for
+        the repo lock in this thread: async code uses `create_pull_request_async`.
+        """
+        described = self._describe_pull_request(original_prompt)
+        if described is None:
+            return None
+        return self._commit_pull_request(*described, branch)
+
+    async def create_pull_request_async(self, original_prompt: str, branch: Optional[str] = None) -> Optional[str]:
         """
-        Create a pull request with all accepted changes.
+        `create_pull_request` for async callers: validation and the description run in a worker
+        thread, the repo lock is waited for on the event loop, and commit and push run in a worker
+        thread holding it.
+        """
+        described = await asyncio.to_thread(self._describe_pull_request, original_prompt)
+        if described is None:
+            return None
+        try:
+            return await run_locked(repo_lock(self.repo_path), self._commit_pull_request, *described, branch)
+        except LockTimeout as e:
+            print(f"Error creating pull request: {str(e)}")
+            self.last_error = str(e)
+            return None
+
+    def _describe_pull_request(self, original_prompt: str) -> Optional[Tuple[Optional[ChangeSet], str]]:
+        """
+        Validate the staged changes and describe them; needs no lock. Returns the change set to
+        commit (None if nothing is staged) and the description, or None on failure.
         """
         if not self.repo:
             print("No git repository available")
             return None
             
+        # discard_changes() may swap in a fresh change set while this runs in a worker thread
+        change_set = self.change_set
+        self.last_error = None
         try:
-            # Stage all changes
-            self.repo.index.add(list(self.changes.keys()))
-            
+            staged = change_set is not None and len(change_set) > 0
+            if staged:
+                # Validate the whole batch before spending a completion on the description
+                with stage("validate"):
+                    try:
+                        change_set.validate()
+                    except ChangeSetError:
+                        # Rejected files must not stay staged and fail every later turn too
+                        if self.change_set is change_set:
+                            self.discard_changes()
+                        raise
+
             # Generate PR description
-            pr_description = self.generate_pr_description(original_prompt)
-            
+            checkpoint()
+            with stage("describe"):
+                pr_description = self.generate_pr_description(original_prompt)
+            return (change_set if staged else None), pr_description
+
+        except RequestCancelled:
+            print("Pull request cancelled, staged changes dropped")
+            if self.change_set is change_set:
+                self.discard_changes()
+            return None
+        except Exception as e:
+            print(f"Error creating pull request: {str(e)}")
+            self.last_error = str(e)
+            return None
+
+    def _commit_pull_request(self, change_set: Optional[ChangeSet], pr_description: str,
+                             branch: Optional[str]) -> Optional[str]:
+        """
+        Check out `branch`, commit the change set (or the accepted changes already written)
+        and push. Returns the description, or None on failure.
+        """
+        try:
             # Create commit message
             commit_message = pr_description.split('\n')[0]  # Use first line as commit message
-            
-            # Commit changes
-            self.repo.index.commit(commit_message)
-            
-            # Push changes if remote exists
-            try:
-                origin = self.repo.remote(name='origin')
-                origin.push(self.repo.active_branch)
-                return pr_description
-            except ValueError:
-                print("No remote repository configured. Changes are committed locally.")
-                return pr_description
-            
+
+            # Only checkout, commit and push hold the repo exclusively (not validation or the
+            # description); reentrant when the caller took it with run_locked
+            with repo_lock(self.repo_path).hold():
+                if branch is not None:
+                    # Commit and push on this session's branch, whatever was checked out meanwhile
+                    self.repo.heads[branch].checkout()
+
+                if change_set is not None:
+                    # Write atomically, update the index once and commit once (rolled back on failure)
+                    with stage("commit"):
+                        change_set.commit(commit_message)
+                    if self.change_set is change_set:
+                        self.change_set = ChangeSet(self.repo, self.repo_path)
+                else:
+                    # Stage all changes; changes already committed by an earlier turn leave nothing to commit
+                    if self.changes:
+                        self.repo.git.add('--', *self.changes.keys())
+                    if self.repo.index.diff('HEAD'):
+                        self.repo.index.commit(commit_message)
+
+                # Keep the symbol index in step with the new commit (only changed files are re-parsed)
+                try:
+                    get_symbol_index(self.repo_path)
+                except Exception as e:
+                    print(f"Error updating symbol index: {str(e)}")
+
+                # Push changes if remote exists
+                checkpoint()
+                try:
+                    origin = self.repo.remote(name='origin')
+                    with stage("push"):
+                        origin.push(self.repo.active_branch)
+                    return pr_description
+                except ValueError:
+                    print("No remote repository configured. Changes are committed locally.")
+                    return pr_description
+
+        except RequestCancelled:
+            print("Pull request cancelled, staged changes dropped")
+            if change_set is not None and self.change_set is change_set:
+                self.discard_changes()
+            return None
         except Exception as e:
             print(f"Error creating pull request: {str(e)}")
+            self.last_error = str(e)
             return None
     
     def run_tests(self) -> bool:
@@ -191,6 +281,9 @@ Please provide a comprehensive PR description that includes:
         Run pytest on the codebase.
         """
         try:
+            # Imported here: pytest is slow to import and only needed when tests are run
+            import pytest
+
             result = pytest.main([self.repo_path])
             return result == 0
         except Exception as e:
@@ -0,0 +1,124 @@
+"""
+Backend configuration, read once from the environment (and .env) when first imported.
+Modules take their settings from the shared `settings` object instead of calling
+os.getenv and load_dotenv themselves.
+"""
+import os
+from typing import List, Mapping, Optional
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Settings:
+    def __init__(self, env: Mapping[str, str]):
+        self.env = dict(env)
+
+        # Clones, caches, traces and recordings
+        self.data_dir = self.get("DATA_DIR", os.path.join(BACKEND_DIR, 'data'))
+
+        # Azure OpenAI - using the exact names the Azure OpenAI client expects, with the older names as fallback
+        self.azure_openai_api_key = self.get("AZURE_OPENAI_API_KEY") or self.get("OPENAI_KEY")
+        self.azure_openai_endpoint = self.get("AZURE_OPENAI_ENDPOINT") or self.get("OPENAI_ENDPOINT")
+        self.openai_model = self.get("OPENAI_MODEL", "gpt-4.1")
+        # Using same as model
+        self.openai_deployment = self.openai_model
+        self.openai_api_version = self.get("OPENAI_API_VERSION", "2024-12-01-preview")
+
+        self.github_token = self.get("GITHUB_TOKEN")
+        self.github_org = self.get("GITHUB_ORG")
+        # Point at a GitHub Enterprise or mock API server
+        self.github_api_url = self.get("GITHUB_API_URL", "https://api.github.com")
+
+        # Token budget for existing code packed into the generation prompt
+        self.code_context_token_budget = self.get_int("CODE_CONTEXT_TOKEN_BUDGET", 3000)
+        # Concurrent per-file completions in fan-out mode
+        self.fanout_concurrency = self.get_int("FANOUT_CONCURRENCY", 6)
+        self.fanout_file_max_tokens = self.get_int("FANOUT_FILE_MAX_TOKENS", 2000)
+        # How many times a truncated completion (finish_reason == "length") is asked to continue
+        self.max_continuations = self.get_int("MAX_CONTINUATIONS", 3)
+        # Repos with more files than this drill down the directory summaries instead of sending a flat list
+        self.flat_file_list_limit = self.get_int("FLAT_FILE_LIST_LIMIT", 1000)
+        self.summary_concurrency = self.get_int("SUMMARY_CONCURRENCY", 4)
+        # Repos processed at the same time by one fleet run
+        self.fleet_concurrency = self.get_int("FLEET_CONCURRENCY", 4)
+
+        self.session_ttl_seconds = self.get_int("SESSION_TTL_SECONDS", 1800)
+        self.session_max_sessions = self.get_int("SESSION_MAX_SESSIONS", 64)
+        self.session_max_bytes = self.get_int("SESSION_MAX_BYTES", 256 * 1024 * 1024)
+        # Conversation messages kept per session for follow-up turns (user/assistant pairs)
+        self.session_history_messages = self.get_int("SESSION_HISTORY_MESSAGES", 6)
+
+        # Objects up to this size are kept in the per-repo LRU cache (keyed by SHA, so never stale)
+        self.git_small_object_limit = self.get_int("GIT_SMALL_OBJECT_LIMIT", 256 * 1024)
+        self.git_object_cache_bytes = self.get_int("GIT_OBJECT_CACHE_BYTES", 64 * 1024 * 1024)
+
+        # 0 disables eviction
+        self.repo_store_budget_mb = self.get_int("REPO_STORE_BUDGET_MB", 10240)
+        # Comma separated repo names that are never evicted
+        self.repo_store_pinned = self.get_list("REPO_STORE_PINNED")
+        self.stale_branch_days = self.get_int("STALE_BRANCH_DAYS", 30)
+        # A repo is maintained at most once per interval, and only after it has been idle for a while
+        self.maintenance_interval_seconds = self.get_int("MAINTENANCE_INTERVAL_SECONDS", 3600)
+        self.maintenance_idle_seconds = self.get_int("MAINTENANCE_IDLE_SECONDS", 900)
+        self.maintenance_check_seconds = self.get_int("MAINTENANCE_CHECK_SECONDS", 60)
+
+        # How often an in-flight request checks whether its client is still connected
+        self.cancel_poll_seconds = self.get_float("CANCEL_POLL_SECONDS", 0.25)
+
+        # Requests running at once across all classes
+        self.admission_max_concurrency = self.get_int("ADMISSION_MAX_CONCURRENCY", 32)
+        # Slots only interactive requests may take, so bursts of PR/batch work never fill the server
+        self.admission_interactive_reserve = self.get_int("ADMISSION_INTERACTIVE_RESERVE", 4)
+        # Queued requests per user and class; beyond this the user is shed before anyone else
+        self.admission_max_queue_per_user = self.get_int("ADMISSION_MAX_QUEUE_PER_USER", 8)
+
+        self.tracing_enabled = self.get_bool("TRACING_ENABLED", True)
+        # One OTLP/JSON ExportTraceServiceRequest per line, one file per day
+        self.trace_dir = self.get("TRACE_DIR", os.path.join(self.data_dir, '.traces'))
+        self.service_name = self.get("SERVICE_NAME", "amsgenie-backend")
+        # off | cprofile | sample; profiles are kept only for requests slower than profile_slow_ms
+        self.profiler = self.get("PROFILER", "off")
+        self.profile_slow_ms = self.get_float("PROFILE_SLOW_MS", 2000.0)
+        self.profile_sample_interval = self.get_float("PROFILE_SAMPLE_INTERVAL", 0.01)
+        # Opt-in: store prompts, responses and timings of every request for offline replay
+        self.pipeline_record = self.get_bool("PIPELINE_RECORD", False)
+        self.record_dir = self.get("RECORD_DIR", os.path.join(self.data_dir, '.recordings'))
+
+        # Cross-process repo locks, so several workers (or hosts sharing DATA_DIR) can serve the same repos
+        self.lock_dir = self.get("LOCK_DIR", os.path.join(self.data_dir, '.locks'))
+        # How long a request waits for a repo another request is writing to before giving up with a 503
+        self.lock_timeout_seconds = self.get_float("LOCK_TIMEOUT_SECONDS", 300.0)
+        # SQLite file caches are shared through by every worker
+        self.shared_cache_path = self.get("SHARED_CACHE_PATH", os.path.join(self.data_dir, '.cache', 'shared.sqlite3'))
+        # wal for local disks; delete when DATA_DIR is on a network filesystem (WAL needs shared memory)
+        self.shared_cache_journal_mode = self.get("SHARED_CACHE_JOURNAL_MODE", "wal")
+
+        # Heavy modules imported in the background once the worker is serving, so the first
+        # request that needs them does not pay for the import
+        self.preload_modules = self.get_list("PRELOAD_MODULES", "openai,github")
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.env.get(name, default)
+
+    def get_int(self, name: str, default: int) -> int:
+        return int(self.env.get(name, default))
+
+    def get_float(self, name: str, default: float) -> float:
+        return float(self.env.get(name, default))
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        value = self.env.get(name)
+        return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
+    def get_list(self, name: str, default: str = "") -> List[str]:
+        return [v.strip() for v in self.env.get(name, default).split(',') if v.strip()]
+
+
+def load_settings() -> Settings:
+    load_dotenv()
+    return Settings(os.environ)
+
+
+settings = load_settings()
@@ -0,0 +1,255 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import settings
+from git_objects import get_object_store
+from llm import complete
+from prompts import DIRECTORY_SUMMARY_PROMPT, DRILL_DOWN_PROMPT
+
+SUMMARY_DIR = os.path.join(settings.data_dir, '.dir_summaries')
+
+OPENAI_DEPLOYMENT = settings.openai_deployment
+SUMMARY_CONCURRENCY = settings.summary_concurrency
+
+# Directories this small are described from their file names instead of asking the model
+TRIVIAL_DIR_FILES = 3
+# Cap on names listed in a single summary or drill-down prompt
+MAX_LISTED_ENTRIES = 100
+
+# Refreshes run one at a time per process; each refresh fans out summaries on its own pool
+_refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dir-summaries")
+
+
+class DirectorySummaryStore:
+    """
+    Hierarchical, content-addressed summaries of a repo's directories.
+
+    Each summary is keyed by the git tree SHA of its directory, so after a fetch only the
+    subtrees whose SHA changed are summarized again. Summaries are built bottom-up so that a
+    directory's summary can use the summaries of its children.
+    """
+
+    def __init__(self, repo_path: str, client, store_dir: str = SUMMARY_DIR,
+                 max_workers: int = SUMMARY_CONCURRENCY):
+        self.repo_path = repo_path
+        self.store = get_object_store(repo_path)
+        self.client = client
+        self.max_workers = max_workers
+        self.store_file = os.path.join(store_dir, f"{os.path.basename(os.path.normpath(repo_path))}.json")
+        self.summaries: Dict[str, str] = {}  # tree sha -> summary
+        self.dirs: Dict[str, Dict] = {}      # dir path ('' is the root) -> {sha, subdirs, files}
+        self.commit: Optional[str] = None
+        self._lock = threading.Lock()
+        self._pending: Optional[Future] = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.store_file):
+            return
+        try:
+            with open(self.store_file, 'r', encoding='utf-8') as f:
+                self.summaries = json.load(f).get("summaries", {})
+        except Exception as e:
+            print(f"Error loading directory summaries: {str(e)}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.store_file), exist_ok=True)
+        with self._lock:
+            # Keep only summaries reachable from the current tree
+            live = {d["sha"] for d in self.dirs.values()}
+            if live:
+                self.summaries = {sha: s for sha, s in self.summaries.items() if sha in live}
+            data = {"commit": self.commit, "summaries": dict(self.summaries)}
+        # Per writer, so workers saving the same file at once never interleave
+        tmp_file = f"{self.store_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.store_file)
+
+    def _walk(self, commit: str) -> Dict[str, Dict]:
+        dirs = {'': {"sha": self.store.rev_parse(f"{commit}^{{tree}}"), "subdirs": [], "files": []}}
+        for _, obj_type, sha, path in self.store.ls_tree(commit, include_trees=True):
+            parent, name = os.path.split(path)
+            if obj_type == 'tree':
+                dirs[path] = {"sha": sha, "subdirs": [], "files": []}
+                dirs[parent]["subdirs"].append(path)
+            else:
+                dirs[parent]["files"].append(name)
+        return dirs
+
+    def summary(self, path: str) -> Optional[str]:
+        entry = self.dirs.get(path)
+        return self.summaries.get(entry["sha"]) if entry else None
+
+    def _summarize(self, path: str) -> str:
+        entry = self.dirs[path]
+        files = entry["files"]
+        if not entry["subdirs"] and len(files) <= TRIVIAL_DIR_FILES:
+            return f"Contains {', '.join(files)}." if files else "Empty directory."
+        children = '\n'.join(
+            f"- {os.path.basename(sub)}/: {self.summary(sub) or 'no summary'}"
+            for sub in entry["subdirs"][:MAX_LISTED_ENTRIES]
+        )
+        prompt = DIRECTORY_SUMMARY_PROMPT.format(
+            directory=path or '(repository root)',
+            files=', '.join(files[:MAX_LISTED_ENTRIES]) + (' ...' if len(files) > MAX_LISTED_ENTRIES else ''),
+            subdirectories=children or '(none)',
+        )
+        response = complete(
+            self.client,
+            stream=False,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": prompt},
+            ],
+            max_completion_tokens=120,
+            temperature=0.2,
+            model=OPENAI_DEPLOYMENT,
+        )
+        return response.choices[0].message.content.strip()
+
+    def refresh(self, rev: str = 'HEAD') -> int:
+        """
+        Summarize every directory at `rev` whose tree SHA has no summary yet.
+        Directories are processed deepest first, each depth level with bounded concurrency.
+        Returns the number of directories summarized.
+        """
+        commit = self.store.rev_parse(f"{rev}^{{commit}}")
+        dirs = self._walk(commit)
+        with self._lock:
+            self.dirs = dirs
+            self.commit = commit
+        stale = [path for path, entry in dirs.items() if entry["sha"] not in self.summaries]
+        levels: Dict[int, List[str]] = {}
+        for path in stale:
+            levels.setdefault(path.count('/') + (1 if path else 0), []).append(path)
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for depth in sorted(levels, reverse=True):
+                futures = {path: pool.submit(self._summarize, path) for path in levels[depth]}
+                for path, future in futures.items():
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        print(f"Error summarizing {path or '/'}: {str(e)}")
+                        continue
+                    with self._lock:
+                        self.summaries[dirs[path]["sha"]] = summary
+                    done += 1
+                self.save()
+        return done
+
+    def refresh_async(self, rev: str = 'HEAD') -> Future:
+        """
+        Schedule a background refresh. A refresh already queued or running is reused.
+        """
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return self._pending
+            self._pending = _refresh_executor.submit(self.refresh, rev)
+            return self._pending
+
+    def is_ready(self) -> bool:
+        return bool(self.dirs) and self.summary('') is not None
+
+    def outline(self, path: str = '') -> str:
+        """
+        One line per subdirectory of `path` with its summary, followed by the files it holds directly.
+        """
+        entry = self.dirs.get(path)
+        if not entry:
+            return ''
+        lines = [f"{sub}/: {self.summary(sub) or 'no summary'}" for sub in entry["subdirs"][:MAX_LISTED_ENTRIES]]
+        if entry["files"]:
+            prefix = f"{path}/" if path else ''
+            lines.append("Files: " + ', '.join(prefix + f for f in entry["files"][:MAX_LISTED_ENTRIES]))
+        return '\n'.join(lines)
+
+    def files_under(self, path: str) -> List[str]:
+        files = []
+        stack = [path]
+        while stack:
+            current = stack.pop()
+            entry = self.dirs.get(current)
+            if not entry:
+                continue
+            prefix = f"{current}/" if current else ''
+            files.extend(prefix + f for f in entry["files"])
+            stack.extend(entry["subdirs"])
+        return files
+
+    def drill_down(self, user_request: str, max_depth: int = 4, max_files: int = 300) -> List[str]:
+        """
+        Walk the summary tree from the root, asking the model at each level which subdirectories
+        are relevant, and return a shortlist of candidate files for target identification.
+        """
+        shortlist: List[str] = []
+        frontier = ['']
+        for _ in range(max_depth):
+            next_frontier = []
+            for path in frontier:
+                entry = self.dirs[path]
+                if not entry["subdirs"]:
+                    shortlist.extend(self.files_under(path))
+                    continue
+                prompt = DRILL_DOWN_PROMPT.format(
+                    user_request=user_request,
+                    directory=path or '(repository root)',
+                    outline=self.outline(path),
+                )
+                response = complete(
+                    self.client,
+                    stream=False,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_completion_tokens=200,
+                    temperature=0.2,
+                    model=OPENAI_DEPLOYMENT,
+                )
+                answer = response.choices[0].message.content
+                chosen = [
+                    p.rstrip('/') for p in re.split(r'[\s,;`\'"]+', answer)
+                    if p.rstrip('/') in self.dirs and p.rstrip('/') in entry["subdirs"]
+                ]
+                prefix = f"{path}/" if path else ''
+                shortlist.extend(prefix + f for f in entry["files"])
+                next_frontier.extend(chosen)
+            frontier = next_frontier
+            if not frontier or len(shortlist) >= max_files:
+                break
+        # Whatever is still open at the depth limit contributes all of its files
+        for path in frontier:
+            shortlist.extend(self.files_under(path))
+        return shortlist[:max_files]
+
+
+_stores: Dict[str, DirectorySummaryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_summary_store(repo_path: str, client) -> DirectorySummaryStore:
+    repo_path = os.path.abspath(repo_path)
+    with _stores_lock:
+        store = _stores.get(repo_path)
+        if store is None:
+            store = _stores[repo_path] = DirectorySummaryStore(repo_path, client)
+        return store
+
+
+def forget_summary_store(repo_path: str):
+    """
+    Drop the in-memory and on-disk summaries of a repo (e.g. when its clone is evicted).
+    """
+    with _stores_lock:
+        store = _stores.pop(os.path.abspath(repo_path), None)
+    store_file = store.store_file if store else os.path.join(
+        SUMMARY_DIR, f"{os.path.basename(os.path.normpath(repo_path))}.json")
+    if os.path.exists(store_file):
+        os.remove(store_file)
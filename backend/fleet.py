@@ -0,0 +1,215 @@
+import asyncio
+import os
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import git
+
+from change_set import ChangeSet
+from config import settings
+from generation import generate_fanout
+from locks import LockTimeout, repo_lock, run_locked, run_using
+from repo_sync import ensure_clone, fetch
+from symbol_index import pack_repo_context
+from targeting import identify_target_files
+
+DATA_DIR = settings.data_dir
+
+FLEET_CONCURRENCY = settings.fleet_concurrency
+CODE_CONTEXT_TOKEN_BUDGET = settings.code_context_token_budget
+
+GITHUB_LINK_RE = re.compile(r'github\.com[:/]([^/]+)/([^/]+?)(?:\.git)?/?$')
+
+# Fleet runs recreate and force-push their branch, so it lives outside the feature/ namespace
+# of /chat and /studio/pr branches (which are never overwritten)
+FLEET_BRANCH_PREFIX = 'fleet/'
+
+# Repos a fleet run is working on right now (kept out of disk-budget eviction)
+active_repo_paths: Set[str] = set()
+
+
+def repo_name_for(link: str) -> str:
+    return link.rstrip('/').split('/')[-1].replace('.git', '')
+
+
+def fleet_branch_name(username: str, descriptive_name: str) -> str:
+    return f"{FLEET_BRANCH_PREFIX}{username}/{descriptive_name.lower().replace(' ', '-')}"
+
+
+def github_full_name(link: str, default_owner: str) -> str:
+    """
+    owner/name of the GitHub repo behind a clone link. Links that are not on github.com
+    (e.g. local bare remotes in tests) map to `default_owner`/<repo name>.
+    """
+    m = GITHUB_LINK_RE.search(link)
+    if m:
+        return f"{m.group(1)}/{m.group(2)}"
+    return f"{default_owner}/{repo_name_for(link)}"
+
+
+def _prepare_branch(repo_path: str, branch_name: str, base_branch: str) -> Tuple[git.Repo, str]:
+    # (Re)create the fleet branch from the freshly fetched base without touching the local base branch.
+    # Returns the repo and the branch's commit, which identification and context are read from
+    repo = git.Repo(repo_path)
+    with repo_lock(repo_path).hold():
+        repo.git.checkout('-B', branch_name, f'origin/{base_branch}')
+        return repo, repo.head.commit.hexsha
+
+
+def _validated_change_set(repo, repo_path: str, code_files: Dict[str, str]) -> ChangeSet:
+    change_set = ChangeSet(repo, repo_path)
+    for filename, content in code_files.items():
+        change_set.stage(filename, content, f"Generated code for {filename}")
+    change_set.validate()
+    return change_set
+
+
+def _commit_and_push(repo, repo_path: str, branch_name: str, change_set: ChangeSet, message: str) -> str:
+    # Other requests may have checked out another branch while this one was generating
+    with repo_lock(repo_path).hold():
+        repo.git.checkout(branch_name)
+        sha = change_set.commit(message)
+        # Fleet branches belong to the fleet; a re-run replaces the previous attempt
+        repo.git.push('--force-with-lease', '--set-upstream', 'origin', branch_name)
+    return sha
+
+
+def _pr_body(message: str, plan: Optional[str], code_files: Dict[str, str]) -> str:
+    files = '\n'.join(f"- {filename}" for filename in code_files)
+    body = f"Automated fleet change.\n\nRequest: {message}\n\nFiles changed:\n{files}\n"
+    if plan:
+        body += f"\nPlan:\n{plan}\n"
+    return body
+
+
+async def run_repo(link: str, message: str, username: str, branch_name: str, pr_title: str,
+                   base_branch: str, client, async_client, github=None, draft: bool = True,
+                   data_dir: str = DATA_DIR) -> Dict:
+    """
+    Clone/fetch, identify, generate, validate, commit, push and open a draft PR for one repo.
+    Never raises: the outcome (and the stage that failed) is reported in the returned dict.
+    """
+    repo_path = os.path.join(data_dir, repo_name_for(link))
+    result = {"repo": link, "repo_path": repo_path, "status": "failed", "branch": None,
+              "pr_url": None, "commit": None, "files": [], "failed_files": {}, "error": None, "stage": None,
+              "timings": {}}
+    started = time.perf_counter()
+
+    def stage(name: str):
+        result["stage"] = name
+        result["timings"][name] = time.perf_counter()
+
+    def end_stage():
+        name = result["stage"]
+        result["timings"][name] = round(time.perf_counter() - result["timings"][name], 3)
+
+    active_repo_paths.add(repo_path)
+    try:
+        stage("sync")
+        await ensure_clone(link, repo_path)
+        await fetch(repo_path, 'origin', base_branch)
+        # The repo lock is waited for on the event loop; the thread holds it until checkout is done
+        repo, rev = await run_locked(repo_lock(repo_path), _prepare_branch, repo_path, branch_name, base_branch)
+        result["branch"] = branch_name
+        end_stage()
+
+        stage("identify")
+        target_files, parsed_targets = await identify_target_files(client, repo_path, message, async_client, rev)
+        end_stage()
+
+        stage("generate")
+        def context_for(filename: str) -> str:
+            try:
+                return pack_repo_context(repo_path, [filename], message, CODE_CONTEXT_TOKEN_BUDGET, rev)
+            except Exception as e:
+                print(f"Error packing code context for {filename}: {str(e)}")
+                return ''
+
+        plan, code_files, result["failed_files"] = await generate_fanout(
+            async_client, message, target_files, parsed_targets, context_for
+        )
+        code_files = {f: c for f, c in code_files.items() if f.endswith('.py') or f.endswith('.txt')}
+        result["files"] = sorted(code_files)
+        if not code_files and result["failed_files"]:
+            raise RuntimeError(f"Generation failed for {', '.join(sorted(result['failed_files']))}")
+        end_stage()
+        if not code_files:
+            result["status"] = "no_changes"
+            result["stage"] = None
+            return result
+
+        stage("commit")
+        change_set = await asyncio.to_thread(_validated_change_set, repo, repo_path, code_files)
+        result["commit"] = await run_locked(
+            repo_lock(repo_path), _commit_and_push, repo, repo_path, branch_name, change_set, f"[Fleet] {pr_title}"
+        )
+        end_stage()
+
+        if github is None:
+            result["status"] = "pushed"
+            result["stage"] = None
+            return result
+
+        stage("pull_request")
+        full_name = github_full_name(link, settings.github_org or username)
+
+        def create_pull():
+            gh_repo = github.get_repo(full_name)
+            return gh_repo.create_pull(title=pr_title, body=_pr_body(message, plan, code_files),
+                                       head=branch_name, base=base_branch, draft=draft)
+
+        pr = await asyncio.to_thread(create_pull)
+        result["pr_url"] = pr.html_url
+        end_stage()
+        result["status"] = "pr_created"
+        result["stage"] = None
+    except Exception as e:
+        print(f"Fleet run failed for {link} during {result['stage']}: {str(e)}")
+        result["error"] = str(e)
+        result["timings"].pop(result["stage"], None)
+    finally:
+        active_repo_paths.discard(repo_path)
+        result["duration"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_fleet(links: List[str], message: str, username: str, branch_name: str, pr_title: str,
+                    client, async_client, github=None, base_branch: str = 'main', draft: bool = True,
+                    max_concurrency: int = FLEET_CONCURRENCY, data_dir: str = DATA_DIR) -> Tuple[List[Dict], Dict]:
+    """
+    Apply one request to many repos with at most `max_concurrency` repos in flight.
+
+    Clients, clones, symbol indexes and identical in-flight completions are shared across the
+    run. Returns the per-repo results (in input order) and a summary of counts per status.
+    `branch_name` must be a fleet branch (see `fleet_branch_name`).
+    """
+    if not branch_name.startswith(FLEET_BRANCH_PREFIX):
+        raise ValueError(f"Fleet branch {branch_name} must start with {FLEET_BRANCH_PREFIX}")
+    os.makedirs(data_dir, exist_ok=True)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    seen: Dict[str, str] = {}
+
+    async def run(link: str) -> Dict:
+        name = repo_name_for(link)
+        if name in seen:
+            # Both links would share one clone under data/<name>
+            return {"repo": link, "status": "failed", "stage": "sync", "duration": 0,
+                    "error": f"Repository name {name} is already used by {seen[name]}"}
+        seen[name] = link
+        async with semaphore:
+            # No worker evicts the clone while the run uses it
+            repo_path = os.path.join(data_dir, name)
+            try:
+                return await run_using(repo_path, run_repo(link, message, username, branch_name, pr_title,
+                                                           base_branch, client, async_client, github, draft,
+                                                           data_dir))
+            except LockTimeout as e:
+                return {"repo": link, "repo_path": repo_path, "status": "failed", "stage": "lock",
+                        "duration": e.timeout, "error": str(e)}
+
+    results = await asyncio.gather(*(run(link) for link in links))
+    summary: Dict[str, int] = {}
+    for r in results:
+        summary[r["status"]] = summary.get(r["status"], 0) + 1
+    return list(results), summary
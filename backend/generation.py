@@ -0,0 +1,141 @@
+import asyncio
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import settings
+from llm import acomplete
+from prompts import CODE_CONTEXT_PROMPT, FANOUT_PLAN_PROMPT, FILE_GENERATION_PROMPT
+
+OPENAI_DEPLOYMENT = settings.openai_deployment
+FANOUT_CONCURRENCY = settings.fanout_concurrency
+FANOUT_FILE_MAX_TOKENS = settings.fanout_file_max_tokens
+MAX_CONTINUATIONS = settings.max_continuations
+
+CONTINUE_MESSAGE = (
+    "Your previous response was cut off. Continue exactly where it stopped, "
+    "without repeating anything and without commentary."
+)
+
+
+async def complete_with_continuation(client, messages: List[Dict[str, str]], max_completion_tokens: int,
+                                     temperature: float, max_continuations: int = MAX_CONTINUATIONS) -> str:
+    """
+    Run a chat completion on an async client, continuing it while it stops on the token limit.
+    The partial outputs are concatenated into one response.
+    """
+    messages = list(messages)
+    parts = []
+    for _ in range(max_continuations + 1):
+        response = await acomplete(
+            client,
+            stream=False,
+            messages=messages,
+            max_completion_tokens=max_completion_tokens,
+            temperature=temperature,
+            top_p=1.0,
+            frequency_penalty=0.0,
+            presence_penalty=0.0,
+            model=OPENAI_DEPLOYMENT,
+        )
+        choice = response.choices[0]
+        content = choice.message.content or ''
+        parts.append(content)
+        if choice.finish_reason != "length":
+            break
+        messages = messages + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": CONTINUE_MESSAGE},
+        ]
+    return ''.join(parts)
+
+
+def parse_plan_response(full_response: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Split a FANOUT_PLAN_PROMPT response into the plan text and the list of files to write.
+    """
+    plan, files = None, []
+    for part in full_response.split('---'):
+        part = part.strip()
+        if part.startswith('Plan:'):
+            plan = part[5:].strip()
+        elif part.startswith('Files:'):
+            for line in part[6:].splitlines():
+                path = line.strip().strip('-*`').strip()
+                if path.startswith('./'):
+                    path = path[2:]
+                if path and path not in files:
+                    files.append(path)
+    return plan, files
+
+
+def strip_code_fences(content: str, filename: str) -> str:
+    content = content.strip()
+    fenced = re.match(r'^```[\w.+-]*\n(.*?)\n?```$', content, re.S)
+    if fenced:
+        content = fenced.group(1)
+    # Drop an echoed "# filename" header line
+    lines = content.split('\n', 1)
+    if lines[0].strip() == f"# {filename}":
+        content = lines[1] if len(lines) > 1 else ''
+    return content.strip()
+
+
+async def generate_fanout(client, user_request: str, target_files: str, fallback_files: List[str],
+                          context_for: Callable[[str], str],
+                          max_concurrency: int = FANOUT_CONCURRENCY
+                          ) -> Tuple[Optional[str], Dict[str, str], Dict[str, str]]:
+    """
+    Plan once, then generate every planned file in its own concurrent completion.
+
+    `context_for(filename)` returns the packed existing code for one file ('' if none); it may
+    block and runs in a worker thread. Returns (plan, code_files, failed_files): the first two in
+    the same shape as the single-completion path, the last mapping each file whose generation
+    failed to the error.
+    """
+    plan_response = await complete_with_continuation(
+        client,
+        [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": FANOUT_PLAN_PROMPT.format(user_request=user_request, target_files=target_files)},
+        ],
+        max_completion_tokens=800,
+        temperature=0.5,
+    )
+    plan, planned_files = parse_plan_response(plan_response)
+    planned_files = planned_files or fallback_files
+    if plan is None:
+        plan = plan_response.strip()
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate_file(filename: str) -> str:
+        prompt = FILE_GENERATION_PROMPT.format(
+            user_request=user_request,
+            plan=plan,
+            all_files=', '.join(planned_files),
+            filename=filename,
+        )
+        async with semaphore:
+            code_context = await asyncio.to_thread(context_for, filename)
+            if code_context:
+                prompt += CODE_CONTEXT_PROMPT.format(code_context=code_context)
+            content = await complete_with_continuation(
+                client,
+                [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": prompt},
+                ],
+                max_completion_tokens=FANOUT_FILE_MAX_TOKENS,
+                temperature=0.5,
+            )
+        return strip_code_fences(content, filename)
+
+    results = await asyncio.gather(*(generate_file(f) for f in planned_files), return_exceptions=True)
+    code_files, failed_files = {}, {}
+    for filename, result in zip(planned_files, results):
+        if isinstance(result, Exception):
+            print(f"Error generating {filename}: {str(result)}")
+            failed_files[filename] = str(result) or type(result).__name__
+            continue
+        code_files[filename] = result
+    return plan, code_files, failed_files
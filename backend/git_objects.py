@@ -0,0 +1,304 @@
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+
+SMALL_OBJECT_LIMIT = settings.git_small_object_limit
+OBJECT_CACHE_BYTES = settings.git_object_cache_bytes
+# Requests written to cat-file before reading responses back; small enough that the
+# request lines always fit in the pipe buffer, so pipelining cannot deadlock
+PIPELINE_CHUNK = 256
+STREAM_CHUNK = 1024 * 1024
+
+ObjectInfo = Tuple[str, str, int]  # (sha, type, size)
+TreeEntry = Tuple[str, str, str, str]  # (mode, type, sha, path)
+
+
+def _is_sha(spec: str) -> bool:
+    return len(spec) == 40 and all(c in '0123456789abcdef' for c in spec)
+
+
+class GitObjectStore:
+    """
+    Read-only access to a repo's object database through long-lived
+    `git cat-file --batch` / `--batch-check` processes.
+
+    Blobs and trees can be read at any commit (`<rev>:<path>` or a SHA) without a checkout and
+    without forking a process per object. Requests are pipelined in chunks, small objects are
+    cached by SHA and large blobs can be streamed.
+    """
+
+    def __init__(self, repo_path: str, cache_bytes: int = OBJECT_CACHE_BYTES):
+        self.repo_path = repo_path
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._batch: Optional[subprocess.Popen] = None
+        self._check: Optional[subprocess.Popen] = None
+        self._batch_lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    def _spawn(self, mode: str) -> subprocess.Popen:
+        return subprocess.Popen(
+            ['git', 'cat-file', mode],
+            cwd=self.repo_path,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def _batch_process(self) -> subprocess.Popen:
+        if self._batch is None or self._batch.poll() is not None:
+            self._batch = self._spawn('--batch')
+        return self._batch
+
+    def _check_process(self) -> subprocess.Popen:
+        if self._check is None or self._check.poll() is not None:
+            self._check = self._spawn('--batch-check')
+        return self._check
+
+    def close(self):
+        for proc in (self._batch, self._check):
+            if proc is not None and proc.poll() is None:
+                proc.stdin.close()
+                proc.wait()
+        self._batch = self._check = None
+
+    # -- cache --------------------------------------------------------------------------
+
+    def _cache_get(self, sha: str) -> Optional[Tuple[str, bytes]]:
+        with self._cache_lock:
+            entry = self._cache.get(sha)
+            if entry is not None:
+                self._cache.move_to_end(sha)
+            return entry
+
+    def _cache_put(self, sha: str, obj_type: str, data: bytes):
+        if len(data) > SMALL_OBJECT_LIMIT:
+            return
+        with self._cache_lock:
+            if sha in self._cache:
+                return
+            self._cache[sha] = (obj_type, data)
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and self._cache:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    # -- batch-check --------------------------------------------------------------------
+
+    def info_many(self, specs: List[str]) -> List[Optional[ObjectInfo]]:
+        """
+        Resolve object names (SHAs, `<rev>:<path>`, `<rev>^{tree}`...) to (sha, type, size).
+        Missing objects come back as None.
+        """
+        results: List[Optional[ObjectInfo]] = []
+        with self._check_lock:
+            proc = self._check_process()
+            for start in range(0, len(specs), PIPELINE_CHUNK):
+                chunk = specs[start:start + PIPELINE_CHUNK]
+                proc.stdin.write(''.join(f"{spec}\n" for spec in chunk).encode('utf-8'))
+                proc.stdin.flush()
+                for _ in chunk:
+                    parts = proc.stdout.readline().decode('utf-8').split()
+                    if len(parts) == 3 and parts[1] != 'missing':
+                        results.append((parts[0], parts[1], int(parts[2])))
+                    else:
+                        results.append(None)
+        return results
+
+    def info(self, spec: str) -> Optional[ObjectInfo]:
+        return self.info_many([spec])[0]
+
+    def rev_parse(self, rev: str) -> Optional[str]:
+        found = self.info(rev)
+        return found[0] if found else None
+
+    # -- batch --------------------------------------------------------------------------
+
+    def _read_header(self, proc: subprocess.Popen) -> Optional[ObjectInfo]:
+        parts = proc.stdout.readline().decode('utf-8').split()
+        if len(parts) != 3 or parts[1] == 'missing':
+            return None
+        return parts[0], parts[1], int(parts[2])
+
+    def read_many(self, specs: List[str]) -> List[Optional[Tuple[str, str, bytes]]]:
+        """
+        Read many objects in one pipelined pass. Returns (sha, type, data) or None per spec.
+        """
+        results: List[Optional[Tuple[str, str, bytes]]] = [None] * len(specs)
+        # Names that are not SHAs (e.g. `<rev>:<path>`) are resolved first so the cache can answer them
+        names = [i for i, spec in enumerate(specs) if not _is_sha(spec)]
+        resolved = list(specs)
+        for i, found in zip(names, self.info_many([specs[i] for i in names])):
+            resolved[i] = found[0] if found else None
+        pending = []
+        for i, sha in enumerate(resolved):
+            if sha is None:
+                continue
+            cached = self._cache_get(sha)
+            if cached is not None:
+                results[i] = (sha, cached[0], cached[1])
+            else:
+                pending.append(i)
+
+        with self._batch_lock:
+            proc = self._batch_process()
+            for start in range(0, len(pending), PIPELINE_CHUNK):
+                chunk = pending[start:start + PIPELINE_CHUNK]
+                proc.stdin.write(''.join(f"{resolved[i]}\n" for i in chunk).encode('utf-8'))
+                proc.stdin.flush()
+                for i in chunk:
+                    header = self._read_header(proc)
+                    if header is None:
+                        continue
+                    sha, obj_type, size = header
+                    data = proc.stdout.read(size)
+                    proc.stdout.read(1)  # trailing newline
+                    self._cache_put(sha, obj_type, data)
+                    results[i] = (sha, obj_type, data)
+        return results
+
+    def read(self, spec: str) -> Optional[bytes]:
+        found = self.read_many([spec])[0]
+        return found[2] if found else None
+
+    def read_paths(self, rev: str, paths: List[str]) -> Dict[str, bytes]:
+        """
+        Read files at `rev` by path, skipping paths that do not exist there.
+        """
+        found = self.read_many([f"{rev}:{path}" for path in paths])
+        return {path: obj[2] for path, obj in zip(paths, found) if obj is not None}
+
+    def stream(self, spec: str, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        """
+        Stream a (large) object in chunks without holding it in memory.
+        The batch process is reserved until the generator is exhausted or closed.
+        """
+        with self._batch_lock:
+            proc = self._batch_process()
+            proc.stdin.write(f"{spec}\n".encode('utf-8'))
+            proc.stdin.flush()
+            header = self._read_header(proc)
+            if header is None:
+                return
+            remaining = header[2]
+            try:
+                while remaining:
+                    data = proc.stdout.read(min(chunk_size, remaining))
+                    remaining -= len(data)
+                    yield data
+            finally:
+                # Drain whatever the caller did not consume so the next response lines up
+                while remaining:
+                    remaining -= len(proc.stdout.read(min(chunk_size, remaining)))
+                proc.stdout.read(1)
+
+    # -- trees --------------------------------------------------------------------------
+
+    @staticmethod
+    def parse_tree(data: bytes) -> List[Tuple[str, str, str, str]]:
+        """
+        Parse a raw tree object into (mode, type, sha, name) entries.
+        """
+        entries = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(b' ', pos)
+            nul = data.index(b'\0', space)
+            mode = data[pos:space].decode('ascii')
+            name = data[space + 1:nul].decode('utf-8', errors='surrogateescape')
+            sha = data[nul + 1:nul + 21].hex()
+            obj_type = 'tree' if mode == '40000' else ('commit' if mode == '160000' else 'blob')
+            entries.append((mode, obj_type, sha, name))
+            pos = nul + 21
+        return entries
+
+    def ls_tree(self, treeish: str, recursive: bool = True, include_trees: bool = False) -> List[TreeEntry]:
+        """
+        List a tree (a commit, `<rev>^{tree}`, `<rev>:<dir>` or a tree SHA), reading
+        each level of subtrees in one pipelined batch.
+        """
+        root = self.info(f"{treeish}^{{tree}}")
+        if root is None:
+            return []
+        entries: List[TreeEntry] = []
+        level = [(root[0], '')]
+        while level:
+            trees = self.read_many([sha for sha, _ in level])
+            next_level = []
+            for (sha, prefix), obj in zip(level, trees):
+                if obj is None:
+                    continue
+                for mode, obj_type, child_sha, name in self.parse_tree(obj[2]):
+                    path = f"{prefix}{name}"
+                    if obj_type == 'tree':
+                        if include_trees or not recursive:
+                            entries.append((mode, obj_type, child_sha, path))
+                        if recursive:
+                            next_level.append((child_sha, f"{path}/"))
+                    else:
+                        entries.append((mode, obj_type, child_sha, path))
+            level = next_level
+        return entries
+
+    def diff_trees(self, a: str, b: str) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """
+        Paths of blobs that differ between two tree-ish objects as (path, a_sha, b_sha);
+        a side is None when the path does not exist there. Identical subtrees are skipped
+        without being read.
+        """
+        a_root, b_root = self.info_many([f"{a}^{{tree}}", f"{b}^{{tree}}"])
+        changes: List[Tuple[str, Optional[str], Optional[str]]] = []
+        level = [(a_root[0] if a_root else None, b_root[0] if b_root else None, '')]
+        while level:
+            shas = sorted({sha for pair in level for sha in pair[:2] if sha})
+            trees = {sha: self.parse_tree(obj[2]) for sha, obj in zip(shas, self.read_many(shas)) if obj}
+            next_level = []
+            for a_sha, b_sha, prefix in level:
+                if a_sha == b_sha:
+                    continue
+                a_entries = {name: (t, s) for _, t, s, name in trees.get(a_sha, [])}
+                b_entries = {name: (t, s) for _, t, s, name in trees.get(b_sha, [])}
+                for name in sorted(set(a_entries) | set(b_entries)):
+                    a_type, a_child = a_entries.get(name, (None, None))
+                    b_type, b_child = b_entries.get(name, (None, None))
+                    if a_child == b_child:
+                        continue
+                    path = f"{prefix}{name}"
+                    if a_type == 'tree' or b_type == 'tree':
+                        next_level.append((a_child if a_type == 'tree' else None,
+                                           b_child if b_type == 'tree' else None, f"{path}/"))
+                    if a_type not in (None, 'tree') or b_type not in (None, 'tree'):
+                        changes.append((path,
+                                        a_child if a_type not in (None, 'tree') else None,
+                                        b_child if b_type not in (None, 'tree') else None))
+            level = next_level
+        return changes
+
+
+_stores: Dict[str, GitObjectStore] = {}
+_stores_lock = threading.Lock()
+
+
+def close_object_store(repo_path: str):
+    with _stores_lock:
+        store = _stores.pop(os.path.abspath(repo_path), None)
+    if store is not None:
+        store.close()
+
+
+def get_object_store(repo_path: str) -> GitObjectStore:
+    """
+    Return the process-wide object store for a repo, creating it on first use.
+    """
+    repo_path = os.path.abspath(repo_path)
+    with _stores_lock:
+        store = _stores.get(repo_path)
+        if store is None:
+            store = _stores[repo_path] = GitObjectStore(repo_path)
+        return store
@@ -0,0 +1,17 @@
+"""
+Multi-worker deployment: gunicorn main:app -c gunicorn.conf.py (run from backend/).
+
+Workers share the clones, locks and caches under DATA_DIR, so they can also run on several
+hosts mounting the same volume.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# /chat and /fleet wait on LLM calls, pylint and pushes for minutes
+timeout = 600
+graceful_timeout = 30
+# Each worker imports the app itself (its own OpenAI client, repo store thread and sessions)
+preload_app = False
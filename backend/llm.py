@@ -0,0 +1,125 @@
+import time
+from typing import Any, Dict
+
+from config import settings
+from single_flight import flight_key, flights
+from tracing import current_trace, span, traceparent
+
+_async_client = None
+
+
+def openai_client():
+    """
+    A sync Azure OpenAI client. The openai package (a large import) is loaded on first use.
+    """
+    from openai import AzureOpenAI
+
+    return AzureOpenAI(
+        api_version=settings.openai_api_version,
+        azure_endpoint=settings.azure_openai_endpoint,
+        api_key=settings.azure_openai_api_key,
+    )
+
+
+def async_openai_client():
+    """
+    The async Azure OpenAI client shared by every request; cancelling a request aborts its
+    HTTP calls on it. Created on first use.
+    """
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncAzureOpenAI
+
+        _async_client = AsyncAzureOpenAI(
+            api_version=settings.openai_api_version,
+            azure_endpoint=settings.azure_openai_endpoint,
+            api_key=settings.azure_openai_api_key,
+        )
+    return _async_client
+
+
+def _completion_key(kwargs) -> tuple:
+    # Identical prompts with identical sampling parameters share one in-flight completion
+    return flight_key("completion", kwargs)
+
+
+def _with_traceparent(kwargs) -> Dict:
+    # Added after the coalescing key is taken, so traced requests still share completions
+    header = traceparent()
+    if header is None:
+        return kwargs
+    return {**kwargs, "extra_headers": {**(kwargs.get("extra_headers") or {}), "traceparent": header}}
+
+
+def _trace_completion(current, kwargs, response, started: float):
+    """
+    Usage and finish reason on the llm span; prompt and response in the request's recording.
+    """
+    elapsed = time.perf_counter() - started
+    choice = response.choices[0] if getattr(response, 'choices', None) else None
+    usage = getattr(response, 'usage', None)
+    finish_reason = getattr(choice, 'finish_reason', None)
+    if current is not None:
+        current.set_attribute("llm.finish_reason", finish_reason)
+        if usage is not None:
+            current.set_attribute("llm.prompt_tokens", usage.prompt_tokens)
+            current.set_attribute("llm.completion_tokens", usage.completion_tokens)
+    trace = current_trace()
+    if trace is not None and trace.recording is not None:
+        trace.record({
+            "span_id": current.span_id if current else None,
+            "messages": kwargs.get("messages"),
+            "params": {k: v for k, v in kwargs.items() if k not in ("messages", "extra_headers")},
+            "content": choice.message.content if choice is not None else None,
+            "finish_reason": finish_reason,
+            "usage": usage.model_dump() if hasattr(usage, 'model_dump') else None,
+            "duration": round(elapsed, 6),
+        })
+
+
+def _span_attributes(kwargs) -> Dict:
+    return {
+        "llm.model": kwargs.get("model"),
+        "llm.max_tokens": kwargs.get("max_completion_tokens") or kwargs.get("max_tokens"),
+        "llm.prompt_chars": sum(len(m.get("content") or '') for m in kwargs.get("messages", [])),
+    }
+
+
+def complete(client, **kwargs) -> Any:
+    """
+    Blocking chat completion on a sync client, coalesced with identical in-flight requests.
+    """
+    with span("llm", **_span_attributes(kwargs)) as current:
+        started = time.perf_counter()
+        response = flights.do(_completion_key(kwargs), client.chat.completions.create, **_with_traceparent(kwargs))
+        _trace_completion(current, kwargs, response, started)
+        return response
+
+
+async def complete_in_thread(client, **kwargs) -> Any:
+    """
+    Chat completion on a sync client from async code: runs in a worker thread so the event
+    loop stays free, coalesced with identical in-flight requests.
+    """
+    with span("llm", **_span_attributes(kwargs)) as current:
+        started = time.perf_counter()
+        response = await flights.do_async(_completion_key(kwargs), client.chat.completions.create,
+                                          **_with_traceparent(kwargs))
+        _trace_completion(current, kwargs, response, started)
+        return response
+
+
+async def acomplete(client, **kwargs) -> Any:
+    """
+    Chat completion on an async client, coalesced with identical in-flight requests.
+    """
+    with span("llm", **_span_attributes(kwargs)) as current:
+        started = time.perf_counter()
+        headed = _with_traceparent(kwargs)
+
+        async def create():
+            return await client.chat.completions.create(**headed)
+
+        response = await flights.do_async(_completion_key(kwargs), create)
+        _trace_completion(current, kwargs, response, started)
+        return response
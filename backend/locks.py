@@ -0,0 +1,212 @@
+"""
+Cross-process locks, so several workers (uvicorn/gunicorn processes, or hosts sharing the data
+volume) can serve the same repos. Locks are flock()s on files under DATA_DIR/.locks; every
+acquisition opens its own file description, so they exclude other threads of this process
+as well as other processes, and the kernel drops them when a worker dies.
+"""
+import asyncio
+import contextvars
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from cancellation import checkpoint
+from config import settings
+from timing import stage
+
+LOCK_DIR = settings.lock_dir
+LOCK_TIMEOUT_SECONDS = settings.lock_timeout_seconds
+# First retry delay while a lock is busy; doubled up to LOCK_MAX_POLL_SECONDS
+LOCK_POLL_SECONDS = 0.01
+LOCK_MAX_POLL_SECONDS = 0.2
+
+T = TypeVar('T')
+
+# Lock files held by the current request (path -> exclusive), shared with the tasks and threads
+# it starts, so nested acquisitions of a lock it already holds do not wait on themselves
+_held: contextvars.ContextVar[Dict[str, bool]] = contextvars.ContextVar('held_locks', default={})
+
+
+class LockTimeout(Exception):
+    def __init__(self, path: str, timeout: float):
+        super().__init__(f"Timed out after {timeout:g}s waiting for {os.path.basename(path)}")
+        self.path = path
+        self.timeout = timeout
+
+
+class FileLock:
+    """
+    Shared/exclusive lock on one lock file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def try_acquire(self, exclusive: bool = True) -> Optional[int]:
+        """
+        Take the lock if it is free; returns the file descriptor to pass to `release`, or None.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def acquire(self, exclusive: bool = True, timeout: float = LOCK_TIMEOUT_SECONDS) -> int:
+        """
+        Wait for the lock (blocking). Cancelled requests stop waiting. A wait can last minutes:
+        async code waits with `acquire_async` / `run_locked` instead of in a to_thread worker,
+        whose pool is small and shared by every request.
+        """
+        deadline = time.monotonic() + timeout
+        delay = LOCK_POLL_SECONDS
+        while True:
+            fd = self.try_acquire(exclusive)
+            if fd is not None:
+                return fd
+            checkpoint()
+            if time.monotonic() >= deadline:
+                raise LockTimeout(self.path, timeout)
+            time.sleep(delay)
+            delay = min(delay * 2, LOCK_MAX_POLL_SECONDS)
+
+    async def acquire_async(self, exclusive: bool = True, timeout: float = LOCK_TIMEOUT_SECONDS) -> int:
+        """
+        Wait for the lock without blocking the event loop.
+        """
+        deadline = time.monotonic() + timeout
+        delay = LOCK_POLL_SECONDS
+        while True:
+            fd = self.try_acquire(exclusive)
+            if fd is not None:
+                return fd
+            if time.monotonic() >= deadline:
+                raise LockTimeout(self.path, timeout)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_MAX_POLL_SECONDS)
+
+    @staticmethod
+    def release(fd: int):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _reentrant(self, exclusive: bool) -> bool:
+        held = _held.get().get(self.path)
+        if held is None:
+            return False
+        if exclusive and not held:
+            raise RuntimeError(f"Cannot upgrade a shared lock on {self.path} to exclusive")
+        return True
+
+    @contextmanager
+    def hold(self, exclusive: bool = True, timeout: float = LOCK_TIMEOUT_SECONDS):
+        if self._reentrant(exclusive):
+            yield
+            return
+        fd = self.acquire(exclusive, timeout)
+        reset = _held.set({**_held.get(), self.path: exclusive})
+        try:
+            yield
+        finally:
+            _held.reset(reset)
+            self.release(fd)
+
+    @asynccontextmanager
+    async def hold_async(self, exclusive: bool = True, timeout: float = LOCK_TIMEOUT_SECONDS):
+        if self._reentrant(exclusive):
+            yield
+            return
+        with stage("lock"):
+            fd = await self.acquire_async(exclusive, timeout)
+        reset = _held.set({**_held.get(), self.path: exclusive})
+        try:
+            yield
+        finally:
+            _held.reset(reset)
+            self.release(fd)
+
+
+def _lock_path(repo_path: str, kind: str) -> str:
+    # Named after the repo for humans, hashed on the full path so equal names never collide
+    repo_path = os.path.abspath(repo_path)
+    digest = hashlib.sha1(repo_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(LOCK_DIR, f"{os.path.basename(os.path.normpath(repo_path))}-{digest}.{kind}.lock")
+
+
+def repo_lock(repo_path: str) -> FileLock:
+    """
+    Readers-writer lock on a repo's working tree: shared while walking it, exclusive only around
+    the short steps that change it (checkout, write + commit, push, pruning, eviction). Requests
+    take it with `run_locked`, so it outlives a cancelled request until the work is done.
+    Ref-only reads (branch listings, diffs between branches) need no lock: git updates refs
+    by atomic renames.
+    """
+    return FileLock(_lock_path(repo_path, 'repo'))
+
+
+def use_lock(repo_path: str) -> FileLock:
+    """
+    Held shared for as long as a request works with a clone; eviction needs it exclusively.
+    """
+    return FileLock(_lock_path(repo_path, 'use'))
+
+
+def clone_lock(repo_path: str) -> FileLock:
+    """
+    Held while cloning into `repo_path`, so only one worker clones a given repo.
+    """
+    return FileLock(_lock_path(repo_path, 'clone'))
+
+
+async def run_locked(lock: FileLock, func: Callable[..., T], *args, exclusive: bool = True,
+                     timeout: float = LOCK_TIMEOUT_SECONDS) -> T:
+    """
+    Wait for `lock` on the event loop, then run the blocking `func(*args)` in a worker thread
+    that holds it; `hold()` inside `func` is reentrant. The lock is released when the thread is
+    done, even if the caller is cancelled first, so the work is never cut off halfway.
+    """
+    if lock._reentrant(exclusive):
+        return await asyncio.to_thread(func, *args)
+    with stage("lock"):
+        fd = await lock.acquire_async(exclusive, timeout)
+    try:
+        # The task (and so the thread) copies the context with the lock marked as held
+        reset = _held.set({**_held.get(), lock.path: exclusive})
+        try:
+            future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        finally:
+            _held.reset(reset)
+    except BaseException:
+        lock.release(fd)
+        raise
+
+    def done(f: asyncio.Future):
+        lock.release(fd)
+        if not f.cancelled():
+            # Marks the exception as retrieved when the caller was cancelled and never awaits it
+            f.exception()
+
+    future.add_done_callback(done)
+    return await asyncio.shield(future)
+
+
+async def run_using(repo_path: str, coro: Awaitable[T], timeout: float = LOCK_TIMEOUT_SECONDS) -> T:
+    """
+    Await `coro` while holding the repo's use lock, so no worker evicts the clone under it.
+    Threads the request started may outlive a cancellation; eviction also needs the repo lock,
+    which they hold while they change the working tree.
+    """
+    try:
+        async with use_lock(repo_path).hold_async(exclusive=False, timeout=timeout):
+            return await coro
+    finally:
+        # Never started if the lock timed out
+        coro.close()
@@ -1,41 +1,102 @@
+# First, so the startup report covers every import below
+from startup import boot
 import os
+import asyncio
 from fastapi import FastAPI, Request, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from dotenv import load_dotenv
 import git
-from openai import AzureOpenAI
-from prompts import IDENTIFY_TARGET_PROMPT, CODE_GENERATION_PROMPT
-import subprocess
+from config import settings
+from prompts import CODE_GENERATION_PROMPT, CODE_CONTEXT_PROMPT
 from code_change_handler import CodeChangeHandler
+from change_set import ChangeSet
+from symbol_index import pack_repo_context, forget_symbol_index
+from generation import generate_fanout
+from git_objects import get_object_store, close_object_store
+from branch_listing import list_branches
+from sessions import Session, SessionManager
+from llm import acomplete, async_openai_client, openai_client
+from cancellation import cancel_on_disconnect, checkpoint
+from timing import ServerTimingMiddleware, stage
+from tracing import TracingMiddleware
+from targeting import identify_target_files
+from fleet import FLEET_CONCURRENCY, fleet_branch_name, run_fleet
+import fleet
+from repo_sync import ensure_clone, fetch
+from repo_store import RepoStore
+from admission import AdmissionController, AdmissionMiddleware
+from locks import LockTimeout, repo_lock, run_locked, run_using
+from dir_summaries import forget_summary_store
 from typing import List, Dict, Optional
-from github import Github
 import time
 import datetime
 import traceback
 import re
+import difflib
+from contextlib import nullcontext
 
-load_dotenv()
+DATA_DIR = settings.data_dir
 
-BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
-
-# Get environment variables - using the exact names Azure OpenAI client expects
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("OPENAI_ENDPOINT")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1")
-OPENAI_DEPLOYMENT = os.getenv("OPENAI_MODEL", "gpt-4.1")  # Using same as model
-OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION", "2024-12-01-preview")
+AZURE_OPENAI_API_KEY = settings.azure_openai_api_key
+AZURE_OPENAI_ENDPOINT = settings.azure_openai_endpoint
+OPENAI_MODEL = settings.openai_model
+OPENAI_DEPLOYMENT = settings.openai_deployment
+OPENAI_API_VERSION = settings.openai_api_version
+CODE_CONTEXT_TOKEN_BUDGET = settings.code_context_token_budget
 
 # Validate required environment variables
 if not AZURE_OPENAI_ENDPOINT or not AZURE_OPENAI_API_KEY:
     raise ValueError("Missing required environment variables: AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY must be set")
 
-GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-GITHUB_ORG = os.getenv("GITHUB_ORG")
+GITHUB_TOKEN = settings.github_token
+GITHUB_ORG = settings.github_org
+GITHUB_API_URL = settings.github_api_url
+
+def github_client(token: Optional[str] = GITHUB_TOKEN):
+    """PyGithub client for the configured API; PyGithub is imported on first use."""
+    from github import Github
+    return Github(token, base_url=GITHUB_API_URL)
 
 app = FastAPI()
 
+# Per-class queues, caps and priorities; overload is shed with 429 + Retry-After
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+# Stage durations (queue wait included) in a Server-Timing header on every response
+app.add_middleware(ServerTimingMiddleware)
+# One trace per request (stages, git, LLM calls) exported as OTLP/JSON under data/.traces;
+# optional pipeline recordings (PIPELINE_RECORD=1) and profiles of slow requests (PROFILER)
+app.add_middleware(TracingMiddleware)
+
+# Warm handlers, repo handles and prompt context per (user, repo, branch)
+session_manager = SessionManager()
+
+# Disk-budgeted clone store under backend/data with background pruning and git maintenance
+repo_store = RepoStore()
+repo_store.active_repos = lambda: [*session_manager.repo_paths(), *fleet.active_repo_paths]
+repo_store.live_branches = session_manager.branches
+
+def forget_repo(repo_path: str):
+    """Drop every in-memory handle and cache of a repo whose clone is being evicted."""
+    session_manager.drop_repo(repo_path)
+    close_object_store(repo_path)
+    forget_symbol_index(repo_path)
+    forget_summary_store(repo_path)
+
+repo_store.on_evict.append(forget_repo)
+# Branch pruning and git gc wait until no interactive or PR request is running or queued
+repo_store.defer = lambda: not admission.is_idle()
+
+@app.on_event("startup")
+async def start_repo_maintenance():
+    repo_store.start()
+
+@app.on_event("startup")
+async def report_startup():
+    # openai and PyGithub are imported lazily; warm them up now that requests can be served
+    boot.ready(preload=settings.preload_modules)
+
 # Update CORS middleware with more specific settings
 app.add_middleware(
     CORSMiddleware,
@@ -51,6 +112,10 @@ class ChatRequest(BaseModel):
     github_link: str
     username: str = "kkahol-toronto"
     descriptive_name: str
+    # Plan once and generate each target file in its own concurrent completion
+    fanout: bool = False
+    # Drop the session's prompt context (target files, packed code, history) and start over
+    reset_context: bool = False
 
 class BranchInfo(BaseModel):
     name: str
@@ -64,12 +129,32 @@ class PRRequest(BaseModel):
     target_branch: str = "main"
     title: str
     description: str
+    username: Optional[str] = None
+
+class FleetRequest(BaseModel):
+    message: str
+    github_links: List[str]
+    username: str = "kkahol-toronto"
+    descriptive_name: str
+    pr_title: str
+    base_branch: str = "main"
+    draft: bool = True
+    max_concurrency: int = FLEET_CONCURRENCY
 
 class PRResponse(BaseModel):
     pr_url: Optional[str]
     diff_files: List[Dict[str, str]]
     pr_content: str
 
+@app.exception_handler(LockTimeout)
+async def lock_timeout_handler(request: Request, exc: LockTimeout):
+    # Another request (possibly in another worker) kept the repo busy for too long
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc), "detail": "Repository is busy, try again later"},
+        headers={"Retry-After": "5"}
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
@@ -81,12 +166,8 @@ async def global_exception_handler(request: Request, exc: Exception):
 async def health_check():
     """Health check endpoint"""
     try:
-        # Test OpenAI connection
-        client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY,
-        )
+        # Test OpenAI connection (off the event loop: the first call imports openai)
+        await asyncio.to_thread(openai_client)
         return {
             "status": "healthy",
             "openai_connection": "ok",
@@ -107,107 +188,233 @@ async def health_check():
         )
 
 @app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, request: Request):
+    # Closing the tab cancels generation, pylint and the push; staged changes are dropped
+    repo_name = req.github_link.rstrip('/').split('/')[-1].replace('.git', '')
+    # No worker evicts the clone while the request runs
+    return await cancel_on_disconnect(request, run_using(os.path.join(DATA_DIR, repo_name), run_chat(req)))
+
+async def run_chat(req: ChatRequest):
     try:
         repo_path = None
-        plan = code = target_files = None
         if not req.github_link:
             raise HTTPException(status_code=400, detail="GitHub link is required")
             
         repo_name = req.github_link.rstrip('/').split('/')[-1].replace('.git', '')
-        repo_path = os.path.join(BACKEND_DIR, 'data', repo_name)
+        repo_path = os.path.join(DATA_DIR, repo_name)
         
         # Create data directory if it doesn't exist
-        os.makedirs(os.path.join(BACKEND_DIR, 'data'), exist_ok=True)
+        os.makedirs(DATA_DIR, exist_ok=True)
         
         if not os.path.exists(repo_path):
             try:
-                git.Repo.clone_from(req.github_link, repo_path)
+                # Concurrent requests for the same repo share one clone
+                with stage("clone"):
+                    await ensure_clone(req.github_link, repo_path)
+                # A new clone may push the store over its disk budget
+                repo_store.request_cycle()
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Failed to clone repository: {str(e)}")
+        repo_store.touch(repo_path)
                 
-        # Initialize code handler and create/checkout branch
+        # Reuse the warm session for this user, repo and branch (handler, open Repo, prompt context)
         try:
-            code_handler = CodeChangeHandler(repo_path)
-            branch_name = code_handler.create_or_checkout_branch(req.username, req.descriptive_name)
-            if not branch_name:
-                raise HTTPException(status_code=400, detail="Failed to create/checkout branch")
+            branch_name = CodeChangeHandler.branch_name_for(req.username, req.descriptive_name)
+            session = session_manager.get_or_create(req.username, repo_path, branch_name)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error with code handler: {str(e)}")
-
-        # Initialize OpenAI client with your environment variables
-        client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY,
-        )
-            
-        # Step 1: List files
-        files = list_files(repo_path)
-        files_str = ', '.join(files)
-        
-        # Rest of your existing code...
-        
-        # After saving generated files, create PR
-        if code_files and repo_path:
-            for filename, filecontent in code_files.items():
-                if filename.endswith('.py') or filename.endswith('.txt'):
-                    save_dir = repo_path
-                    os.makedirs(save_dir, exist_ok=True)
-                    file_path = os.path.join(save_dir, filename)
-                    try:
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(filecontent)
-                        # Accept changes through code handler
-                        code_handler.accept_changes(
-                            file_path,
-                            filecontent,
-                            f"Generated code for {filename}"
-                        )
-                    except Exception as e:
-                        print(f'Error saving {filename}:', e)
-            
-            # Create PR with all changes
-            pr_description = code_handler.create_pull_request(req.message)
-            if pr_description:
-                return {
-                    "status": "success",
-                    "message": "Request processed successfully",
-                    "branch_name": branch_name,
-                    "repo_path": repo_path,
-                    "pr_description": pr_description
-                }
-        
-        return {
-            "status": "success",
-            "message": "Request processed successfully",
-            "branch_name": branch_name,
-            "repo_path": repo_path
-        }
-        
+        # One turn at a time per session: a second tab's request waits instead of interleaving its
+        # staged changes, history and context with this one, and eviction skips the session meanwhile
+        async with session.turn():
+            return await run_chat_turn(req, session, repo_path, branch_name)
     except HTTPException as he:
         raise he
+    except LockTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_chat_turn(req: ChatRequest, session: Session, repo_path: str, branch_name: str):
+    plan = code = target_files = None
+    try:
+        if req.reset_context:
+            session.reset_context()
+        code_handler = session.handler
+        # Waits (on the event loop) for other requests' checkouts and commits in this clone
+        if not await run_locked(repo_lock(repo_path), code_handler.create_or_checkout_branch,
+                                req.username, req.descriptive_name):
+            raise HTTPException(status_code=400, detail="Failed to create/checkout branch")
+    except HTTPException as he:
+        raise he
+    except LockTimeout:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error with code handler: {str(e)}")
+
+    # The session's OpenAI client stays open across turns
+    client = code_handler.openai_client
+    # Files, summaries and code context come from the branch's commit: the working tree may
+    # already be on another request's branch
+    rev = code_handler.branch_commit
+
+    if session.target_files is not None:
+        # Follow-up turn: keep the target files identified on the first turn
+        target_files = session.target_files
+        parsed_targets = session.parsed_targets
+    else:
+        # Steps 1-2: List files (narrowed down for large repos) and identify target file(s)
+        with stage("identify"):
+            target_files, parsed_targets = await identify_target_files(
+                client, repo_path, req.message, async_client=async_openai_client(), rev=rev
+            )
+        session.target_files, session.parsed_targets = target_files, parsed_targets
+
+    # Step 3: Pack the relevant existing code into the prompt(s) under a token budget (cached per session).
+    # Blocking (the index may need updating): runs in a worker thread
+    def context_for(paths: List[str]) -> str:
+        key = tuple(paths)
+        if key not in session.context_cache:
+            try:
+                with stage("context"):
+                    session.context_cache[key] = pack_repo_context(
+                        repo_path, paths, req.message, CODE_CONTEXT_TOKEN_BUDGET, rev
+                    )
+            except Exception as e:
+                print(f"Error packing code context: {str(e)}")
+                return ''
+        return session.context_cache[key]
+
+    # Step 4: Generate plan and code
+    if req.fanout:
+        # Plan once, then one concurrent completion per file
+        with stage("generate"):
+            plan, code_files, failed_files = await generate_fanout(
+                async_openai_client(), req.message, target_files, parsed_targets, lambda f: context_for([f])
+            )
+    else:
+        failed_files = {}
+        code_prompt = CODE_GENERATION_PROMPT.format(user_request=req.message, target_files=target_files)
+        if not session.history:
+            # On follow-up turns the packed context is already part of the conversation
+            code_context = await asyncio.to_thread(context_for, parsed_targets)
+            if code_context:
+                code_prompt += CODE_CONTEXT_PROMPT.format(code_context=code_context)
+        with stage("generate"):
+            response2 = await acomplete(
+                async_openai_client(),
+                stream=False,
+                messages=[
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    *session.history,
+                    {"role": "user", "content": code_prompt},
+                ],
+                max_completion_tokens=1200,
+                temperature=0.5,
+                top_p=1.0,
+                frequency_penalty=0.0,
+                presence_penalty=0.0,
+                model=OPENAI_DEPLOYMENT,
+            )
+        full_response = response2.choices[0].message.content.strip()
+        session.add_turn(code_prompt, full_response)
+        plan, code = None, None
+        if '---' in full_response:
+            for part in full_response.split('---'):
+                if part.strip().startswith('Plan:'):
+                    plan = part.strip()[5:].strip()
+                if part.strip().startswith('Code:'):
+                    code = part.strip()[5:].strip()
+        else:
+            code = full_response
+        # Parse multiple files from code block using # filename.py delimiter
+        code_files = {}
+        if code:
+            file_blocks = re.split(r'(?m)^# (\S+)$', code)
+            for i in range(1, len(file_blocks), 2):
+                code_files[file_blocks[i].strip()] = file_blocks[i + 1].strip()
+
+    # After saving generated files, create PR
+    if code_files and repo_path:
+        try:
+            for filename, filecontent in code_files.items():
+                if filename.endswith('.py') or filename.endswith('.txt'):
+                    # Stage through the code handler; files are written once, together, on commit
+                    code_handler.accept_changes(
+                        filename,
+                        filecontent,
+                        f"Generated code for {filename}"
+                    )
+
+            # Validate, write and commit all changes at once, then create PR (off the event loop)
+            pr_description = await code_handler.create_pull_request_async(req.message, branch_name)
+        except asyncio.CancelledError:
+            code_handler.discard_changes()
+            raise
+        if pr_description:
+            return {
+                "status": "success",
+                "message": "Request processed successfully",
+                "branch_name": branch_name,
+                "repo_path": repo_path,
+                "pr_description": pr_description,
+                "plan": plan,
+                "code_files": code_files,
+                "failed_files": failed_files,
+                "target_files": target_files
+            }
+        if code_handler.last_error:
+            # e.g. the generated code failed validation; nothing was committed
+            return {
+                "status": "error",
+                "message": "Generated changes were not committed",
+                "error": code_handler.last_error,
+                "branch_name": branch_name,
+                "repo_path": repo_path,
+                "plan": plan,
+                "code_files": code_files,
+                "failed_files": failed_files,
+                "target_files": target_files
+            }
+
+    return {
+        "status": "success",
+        "message": "Request processed successfully",
+        "branch_name": branch_name,
+        "repo_path": repo_path,
+        "plan": plan,
+        "code_files": code_files,
+        "failed_files": failed_files,
+        "target_files": target_files
+    }
+
+
 @app.get("/branches/{repo_path:path}")
-async def get_branches(repo_path: str):
-    """Get all branches for a repository"""
+async def get_branches(repo_path: str, prefix: Optional[str] = None, sort: str = "name",
+                       order: str = "asc", offset: int = 0, limit: Optional[int] = None):
+    """Get branches for a repository, optionally filtered by name prefix, sorted and paginated"""
+    if sort not in ("name", "date") or order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="sort must be name|date and order asc|desc")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise HTTPException(status_code=400, detail="offset and limit must not be negative")
     try:
-        repo = git.Repo(repo_path)
-        branches = []
-        current = repo.active_branch.name
-        
-        for branch in repo.heads:
-            commit = branch.commit
-            branches.append(BranchInfo(
-                name=branch.name,
-                is_current=(branch.name == current),
-                last_commit=commit.hexsha[:7],
-                last_commit_date=commit.committed_datetime.isoformat()
-            ))
-        
-        return {"branches": branches}
+        repo_store.touch(repo_path)
+        # No repo lock: for-each-ref reads refs only, and git updates them by atomic renames.
+        # Off the event loop: runs git and reads the shared cache
+        with stage("list"):
+            page, total = await asyncio.to_thread(
+                list_branches, repo_path, prefix=prefix, sort=sort, descending=(order == "desc"),
+                offset=offset, limit=limit
+            )
+        branches = [
+            BranchInfo(
+                name=b["name"],
+                is_current=b["is_current"],
+                last_commit=b["last_commit"],
+                last_commit_date=b["last_commit_date"]
+            )
+            for b in page
+        ]
+        return {"branches": branches, "total": total, "offset": offset, "limit": limit}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -215,57 +422,82 @@ async def get_branches(repo_path: str):
 async def generate_pr(req: PRRequest):
     """Generate PR content and diff"""
     try:
-        repo = git.Repo(req.repo_path)
-        
-        # Get diff between branches
-        source = repo.heads[req.source_branch]
-        target = repo.heads[req.target_branch]
-        
-        # Get diff files
+        repo_store.touch(req.repo_path)
+        store = get_object_store(req.repo_path)
+        source = f"refs/heads/{req.source_branch}"
+        target = f"refs/heads/{req.target_branch}"
+        if store.info(source) is None or store.info(target) is None:
+            raise HTTPException(status_code=404, detail="Branch not found")
+
+        # Get diff between branches straight from the object store (no checkout, one batched read)
+        with stage("diff"):
+            changes = store.diff_trees(source, target)
+            blobs = store.read_many(sorted({sha for _, a, b in changes for sha in (a, b) if sha}))
+            contents = {obj[0]: obj[2].decode('utf-8', errors='ignore') for obj in blobs if obj}
         diff_files = []
-        for diff in source.commit.diff(target.commit):
-            if diff.a_path:
-                diff_files.append({
-                    "path": diff.a_path,
-                    "status": diff.change_type,
-                    "diff": diff.diff.decode('utf-8', errors='ignore')
-                })
+        for path, a_sha, b_sha in changes:
+            old_lines = contents.get(a_sha, '').splitlines(keepends=True) if a_sha else []
+            new_lines = contents.get(b_sha, '').splitlines(keepends=True) if b_sha else []
+            # Skip the ---/+++ header lines to match the hunk-only diff text returned before
+            hunks = list(difflib.unified_diff(old_lines, new_lines, n=3))[2:]
+            diff_files.append({
+                "path": path,
+                "status": 'A' if a_sha is None else ('D' if b_sha is None else 'M'),
+                "diff": ''.join(hunks)
+            })
         
-        # Generate PR content using OpenAI
-        code_handler = CodeChangeHandler(req.repo_path)
-        pr_content = code_handler.generate_pr_description(
-            f"Title: {req.title}\n\nDescription: {req.description}\n\nFiles changed:\n" + 
-            "\n".join([f"- {f['path']} ({f['status']})" for f in diff_files])
-        )
+        # Generate PR content using OpenAI (with the requesting user's session handler when there is one).
+        # Read-only, so it does not wait for a turn running on the session
+        session = session_manager.find(req.repo_path, req.source_branch, req.username)
+        code_handler = session.handler if session else CodeChangeHandler(req.repo_path)
+        # Blocking completion: off the event loop so other requests keep being served
+        with stage("describe"):
+            pr_content = await asyncio.to_thread(
+                code_handler.generate_pr_description,
+                f"Title: {req.title}\n\nDescription: {req.description}\n\nFiles changed:\n" +
+                "\n".join([f"- {f['path']} ({f['status']})" for f in diff_files])
+            )
         
         return PRResponse(
             pr_url=None,  # Will be set when PR is actually created
             diff_files=diff_files,
             pr_content=pr_content
         )
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/pr/create")
-async def create_pr(req: PRRequest):
+async def create_pr(req: PRRequest, request: Request):
     """Create the actual PR"""
+    return await cancel_on_disconnect(request, run_using(req.repo_path, run_create_pr(req)))
+
+async def run_create_pr(req: PRRequest):
     try:
-        code_handler = CodeChangeHandler(req.repo_path)
-        pr_url = code_handler.create_pull_request(
-            f"Title: {req.title}\n\nDescription: {req.description}"
-        )
+        repo_store.touch(req.repo_path)
+        # The requesting user's session keeps the changes accepted during /chat for this branch;
+        # waits for a turn still running on it
+        session = session_manager.find(req.repo_path, req.source_branch, req.username)
+        code_handler = session.handler if session else CodeChangeHandler(req.repo_path)
+        async with session.turn() if session else nullcontext():
+            pr_url = await code_handler.create_pull_request_async(
+                f"Title: {req.title}\n\nDescription: {req.description}",
+                req.source_branch
+            )
         
         return {"pr_url": pr_url}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 def get_github_repo(repo_name):
-    g = Github(GITHUB_TOKEN)
+    g = github_client()
     org = g.get_organization(GITHUB_ORG)
     return org.get_repo(repo_name)
 
 @app.post("/studio/pr")
 async def studio_pr(
+    request: Request,
     repo_path: str = Body(...),
     files: Dict[str, str] = Body(...),
     original_query: str = Body(...),
@@ -275,18 +507,15 @@ async def studio_pr(
 ):
     """
     Studio PR endpoint: saves files, creates branch, commits, pushes, generates PR, creates draft PR on GitHub.
+    Nothing is pushed or created on GitHub once the client has disconnected.
     """
-    import git
-    import os
-    import traceback
-
-    GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-    GITHUB_ORG = os.getenv("GITHUB_ORG")
-    AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY") or os.getenv("OPENAI_KEY")
-    AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT") or os.getenv("OPENAI_ENDPOINT")
-    OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION", "2024-12-01-preview")
-    OPENAI_DEPLOYMENT = os.getenv("OPENAI_MODEL", "gpt-4.1")
+    return await cancel_on_disconnect(
+        request, run_using(repo_path, run_studio_pr(repo_path, files, original_query, username, pr_title,
+                                                    pr_description))
+    )
 
+async def run_studio_pr(repo_path: str, files: Dict[str, str], original_query: str, username: str,
+                        pr_title: str, pr_description: str):
     try:
         # Auto-clone repo if not present or not a git repo
         if not os.path.exists(repo_path) or not os.path.exists(os.path.join(repo_path, '.git')):
@@ -295,90 +524,163 @@ async def studio_pr(
                 remote_url = f"https://github.com/{GITHUB_ORG}/{repo_name}.git"
             else:
                 remote_url = f"https://github.com/{username}/{repo_name}.git"
-            git.Repo.clone_from(remote_url, repo_path)
+            with stage("clone"):
+                await ensure_clone(remote_url, repo_path)
+            repo_store.request_cycle()
+        repo_store.touch(repo_path)
         
         # 1. Auto-generate branch name
         timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         branch_name = f"feature/{username}/{timestamp}"
         repo = git.Repo(repo_path)
-        # 2. Create and checkout new branch
-        repo.git.checkout('main')
-        repo.git.pull()
-        repo.git.checkout('-b', branch_name)
-        # 3. Save files
-        for fname, content in files.items():
-            fpath = os.path.join(repo_path, fname)
-            os.makedirs(os.path.dirname(fpath), exist_ok=True)
-            with open(fpath, 'w', encoding='utf-8') as f:
-                f.write(content)
-        # 4. Add, commit, push
-        repo.git.add(A=True)
-        commit_msg = f"[Studio] {pr_title}"
-        repo.git.commit('-m', commit_msg)
-        repo.git.push('--set-upstream', 'origin', branch_name)
-        # 5. Generate PR description using OpenAI
-        diff = repo.git.diff('main', branch_name)
-        openai_prompt = f"""You are an expert software engineer. Write a professional pull request description for the following changes.\n\nOriginal user request: {original_query}\n\nGit diff between main and {branch_name}:\n{diff}\n"""
-        client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_key=AZURE_OPENAI_API_KEY,
-        )
-        response = client.chat.completions.create(
-            stream=False,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that writes clear and professional PR descriptions."},
-                {"role": "user", "content": openai_prompt}
-            ],
-            max_completion_tokens=800,
-            temperature=0.7,
-            top_p=1.0,
-            frequency_penalty=0.0,
-            presence_penalty=0.0,
-            model=OPENAI_DEPLOYMENT,
-        )
-        pr_body = response.choices[0].message.content.strip()
-        print('OpenAI PR description:', pr_body)
-        print('OpenAI prompt sent:', openai_prompt)
-        print('OpenAI API response:', response)
+        # Coalesced fetch (refs only, so before taking the repo), then the merge half of the former `git pull`
+        with stage("sync"):
+            await fetch(repo_path, 'origin', 'main')
+
+        def branch_commit_push():
+            # Changes the working tree: exclusive in every worker, taken by run_locked below and
+            # held until this thread is done even if the request is cancelled meanwhile
+            with repo_lock(repo_path).hold():
+                # 2. Create and checkout new branch
+                repo.git.checkout('main')
+                repo.git.merge('origin/main')
+                repo.git.checkout('-b', branch_name)
+                # 3-4. Save files atomically, add and commit them in one batch (rolled back on failure), push
+                change_set = ChangeSet(repo, repo_path)
+                for fname, content in files.items():
+                    change_set.stage(fname, content)
+                commit_msg = f"[Studio] {pr_title}"
+                with stage("commit"):
+                    change_set.apply(commit_msg, validate=False)
+                checkpoint()
+                with stage("push"):
+                    repo.git.push('--set-upstream', 'origin', branch_name)
+            # Between two refs: quick, and would need no lock
+            return repo.git.diff('main', branch_name)
+
+        diff = await run_locked(repo_lock(repo_path), branch_commit_push)
+        # 5. Use the caller's PR description, or generate one using OpenAI
+        pr_body = pr_description.strip()
         if not pr_body:
-            print('WARNING: OpenAI PR description is empty!')
+            openai_prompt = f"""You are an expert software engineer. Write a professional pull request description for the following changes.\n\nOriginal user request: {original_query}\n\nGit diff between main and {branch_name}:\n{diff}\n"""
+            with stage("describe") as describe_span:
+                response = await acomplete(
+                    async_openai_client(),
+                    stream=False,
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant that writes clear and professional PR descriptions."},
+                        {"role": "user", "content": openai_prompt}
+                    ],
+                    max_completion_tokens=800,
+                    temperature=0.7,
+                    top_p=1.0,
+                    frequency_penalty=0.0,
+                    presence_penalty=0.0,
+                    model=OPENAI_DEPLOYMENT,
+                )
+            pr_body = response.choices[0].message.content.strip()
+            if describe_span is not None:
+                describe_span.set_attribute("diff_chars", len(diff))
+                describe_span.set_attribute("pr_body_chars", len(pr_body))
+                if not pr_body:
+                    describe_span.add_event("empty_pr_description")
+            if not pr_body:
+                print('WARNING: OpenAI PR description is empty!')
         # 6. Create draft PR on GitHub
+        checkpoint()
         repo_url = repo.remotes.origin.url
         repo_name = repo_url.split(":")[-1].replace(".git","").split("/")[-1]
-        g = Github(GITHUB_TOKEN)
-        gh_repo = None
-        if GITHUB_ORG:
-            try:
-                gh_repo = g.get_organization(GITHUB_ORG).get_repo(repo_name)
-            except Exception:
+
+        def create_draft_pr():
+            # PyGithub makes blocking HTTP calls
+            g = github_client()
+            gh_repo = None
+            if GITHUB_ORG:
+                try:
+                    gh_repo = g.get_organization(GITHUB_ORG).get_repo(repo_name)
+                except Exception:
+                    gh_repo = g.get_user().get_repo(repo_name)
+            else:
                 gh_repo = g.get_user().get_repo(repo_name)
-        else:
-            gh_repo = g.get_user().get_repo(repo_name)
-        pr = gh_repo.create_pull(
-            title=pr_title,
-            body=pr_body,
-            head=branch_name,
-            base="main",
-            draft=True
-        )
+            return gh_repo.create_pull(
+                title=pr_title,
+                body=pr_body,
+                head=branch_name,
+                base="main",
+                draft=True
+            )
+
+        with stage("github"):
+            pr = await asyncio.to_thread(create_draft_pr)
         return {
             "pr_url": pr.html_url,
             "status": "success",
             "pr_description": pr_body,
             "pr_title": pr_title
         }
+    except LockTimeout:
+        raise
     except Exception as e:
         return {"status": "error", "error": str(e), "trace": traceback.format_exc()}
 
+@app.post("/fleet")
+async def fleet_endpoint(req: FleetRequest):
+    """
+    Apply one request to many repositories: clone/fetch, identify, generate, validate, commit,
+    push and open a draft PR per repo, with bounded concurrency. Returns a per-repo report.
+    """
+    if not req.github_links:
+        raise HTTPException(status_code=400, detail="At least one GitHub link is required")
+    branch_name = fleet_branch_name(req.username, req.descriptive_name)
+    # One sync client (directory summaries) for the whole run, next to the shared async client
+    client = openai_client()
+    github = github_client() if GITHUB_TOKEN else None
+    started = time.perf_counter()
+    results, summary = await run_fleet(
+        req.github_links, req.message, req.username, branch_name, req.pr_title,
+        client, async_openai_client(), github, base_branch=req.base_branch, draft=req.draft,
+        max_concurrency=req.max_concurrency
+    )
+    for r in results:
+        if r.get("repo_path"):
+            repo_store.touch(r["repo_path"])
+    repo_store.request_cycle()
+    return {
+        "status": "success" if summary.get("failed", 0) == 0 else "partial",
+        "branch_name": branch_name,
+        "summary": summary,
+        "duration": round(time.perf_counter() - started, 3),
+        "results": results
+    }
+
+@app.get("/admission")
+async def admission_stats():
+    """Running and queued requests, caps and rejections per request class"""
+    return admission.stats()
+
+@app.get("/repos")
+async def get_repos():
+    """Disk usage, last use and pinning of every cloned repo"""
+    # May measure clones on disk and waits on the metadata file lock: off the event loop
+    return {"repos": await asyncio.to_thread(repo_store.stats), "budget_bytes": repo_store.budget_bytes}
+
+@app.post("/repos/{repo_name}/pin")
+async def pin_repo(repo_name: str, pinned: bool = Body(True, embed=True)):
+    """Pin (or unpin) a hot repo so it is never evicted"""
+    await asyncio.to_thread(repo_store.set_pinned, repo_name, pinned)
+    return {"status": "success", "repo": repo_name, "pinned": pinned}
+
+@app.get("/startup")
+async def startup_report():
+    """How long this worker took to import and become ready, by module"""
+    return boot.as_dict()
+
 @app.post("/studio/pr/update")
 async def update_pr(pr_url: str = Body(...), title: str = Body(...), body: str = Body(...)):
     """
     Update the PR title and body on GitHub.
     """
-    import os
-    GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-    g = Github(GITHUB_TOKEN)
+    g = github_client()
     # Extract owner/repo and PR number from the URL
     m = re.match(r'https://github.com/([^/]+)/([^/]+)/pull/(\d+)', pr_url)
     if not m:
@@ -389,6 +691,8 @@ async def update_pr(pr_url: str = Body(...), title: str = Body(...), body: str =
     pr.edit(title=title, body=body)
     return {"status": "success"}
 
+boot.imports_done()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
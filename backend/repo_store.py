@@ -0,0 +1,372 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import settings
+from locks import FileLock, repo_lock, use_lock
+
+DATA_DIR = settings.data_dir
+LOCK_DIR = settings.lock_dir
+
+REPO_STORE_BUDGET_MB = settings.repo_store_budget_mb
+REPO_STORE_PINNED = settings.repo_store_pinned
+STALE_BRANCH_DAYS = settings.stale_branch_days
+MAINTENANCE_INTERVAL_SECONDS = settings.maintenance_interval_seconds
+MAINTENANCE_IDLE_SECONDS = settings.maintenance_idle_seconds
+MAINTENANCE_CHECK_SECONDS = settings.maintenance_check_seconds
+
+# Branches created by /chat and /studio/pr; only these are ever pruned
+PRUNABLE_PREFIX = 'feature/'
+
+MAINTENANCE_COMMANDS = [
+    ['git', 'gc', '--auto', '--quiet'],
+    ['git', 'repack', '-d', '--quiet'],
+    ['git', 'commit-graph', 'write', '--reachable', '--split'],
+]
+
+
+def disk_usage(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class RepoStore:
+    """
+    Keeps the cloned repos under backend/data within a disk budget.
+
+    Access times are tracked per repo (in memory, written out by the maintenance thread, so
+    requests never wait on the metadata file); when the store is over budget the least recently used
+    clones are removed (pinned and in-use repos are kept). Idle repos periodically get their
+    merged or stale feature branches pruned and run git gc / repack / commit-graph.
+
+    Every worker has its own RepoStore over the same directory: metadata is re-read and written
+    under a file lock, only one worker at a time runs maintenance, and a repo is only pruned,
+    compacted or evicted while no request anywhere holds its repo lock.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, budget_bytes: int = REPO_STORE_BUDGET_MB * 1024 * 1024,
+                 pinned: Iterable[str] = REPO_STORE_PINNED):
+        self.data_dir = data_dir
+        self.budget_bytes = budget_bytes
+        self.meta_file = os.path.join(data_dir, '.repo_store.json')
+        self.meta: Dict[str, Dict] = {}
+        self.on_evict: List[Callable[[str], None]] = []
+        # Returns the repo paths currently in use (never evicted)
+        self.active_repos: Callable[[], Iterable[str]] = lambda: ()
+        # Returns the branches of a repo that sessions in this worker are using (never pruned)
+        self.live_branches: Callable[[str], Iterable[str]] = lambda repo_path: ()
+        # Returns True while foreground work should not compete with maintenance
+        self.defer: Callable[[], bool] = lambda: False
+        self._lock = threading.Lock()
+        self._meta_lock = FileLock(os.path.join(LOCK_DIR, 'repo_store.lock'))
+        self._maintenance_lock = FileLock(os.path.join(LOCK_DIR, 'repo_store.maintenance.lock'))
+        self._pinned = list(pinned)
+        # Inode of each clone's .git as this worker last saw it; a new one means another worker
+        # evicted and re-cloned the repo, so handles opened on the old clone are stale
+        self._clone_ids: Dict[str, int] = {}
+        # name -> last use recorded by touch() and not yet flushed to the metadata file
+        self._touched: Dict[str, float] = {}
+        self._touched_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.meta_file):
+            try:
+                with open(self.meta_file, 'r', encoding='utf-8') as f:
+                    self.meta = json.load(f)
+            except Exception as e:
+                print(f"Error loading repo store metadata: {str(e)}")
+        for name in self._pinned:
+            self._entry(name)["pinned"] = True
+
+    def _save(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        tmp_file = f"{self.meta_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_file, self.meta_file)
+
+    @contextmanager
+    def _update(self):
+        """
+        Change the metadata on top of what the other workers last saved, then save it.
+        """
+        with self._lock, self._meta_lock.hold():
+            self._load()
+            yield
+            self._save()
+
+    def _entry(self, name: str) -> Dict:
+        return self.meta.setdefault(name, {"last_used": 0, "last_maintenance": 0, "pinned": False,
+                                           "size": None, "size_measured": 0})
+
+    def repos(self) -> List[str]:
+        if not os.path.isdir(self.data_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.data_dir)
+            if not name.startswith('.') and os.path.isdir(os.path.join(self.data_dir, name, '.git'))
+        )
+
+    def touch(self, repo_path: str):
+        """
+        Record that a repo was just used. Only kept in memory until the next `flush()`.
+        """
+        name = os.path.basename(os.path.normpath(repo_path))
+        self._check_clone(name)
+        with self._touched_lock:
+            self._touched[name] = time.time()
+
+    def flush(self):
+        """
+        Write the access times recorded since the last flush, and pick up the other workers'.
+        """
+        with self._touched_lock:
+            touched, self._touched = self._touched, {}
+        with self._update():
+            for name, used in touched.items():
+                entry = self._entry(name)
+                entry["last_used"] = max(entry["last_used"], used)
+
+    def _last_used(self, name: str) -> float:
+        return max(self._entry(name)["last_used"], self._touched.get(name, 0))
+
+    def _check_clone(self, name: str):
+        try:
+            clone_id = os.stat(os.path.join(self.data_dir, name, '.git')).st_ino
+        except OSError:
+            return
+        previous = self._clone_ids.get(name)
+        self._clone_ids[name] = clone_id
+        if previous is not None and previous != clone_id:
+            self._forget(name)
+
+    def _forget(self, name: str):
+        repo_path = os.path.join(self.data_dir, name)
+        for callback in self.on_evict:
+            try:
+                callback(repo_path)
+            except Exception as e:
+                print(f"Error in eviction callback for {name}: {str(e)}")
+
+    def set_pinned(self, name: str, pinned: bool):
+        if pinned:
+            self._pinned.append(name)
+        elif name in self._pinned:
+            self._pinned.remove(name)
+        with self._update():
+            self._entry(name)["pinned"] = pinned
+
+    def _sizes(self, names: List[str]) -> Dict[str, int]:
+        """
+        Disk usage per repo. Only repos used or maintained since their last measurement are
+        re-measured, and the disk walks happen outside the locks.
+        """
+        with self._lock:
+            entries = {name: (dict(self._entry(name)), self._last_used(name)) for name in names}
+        sizes: Dict[str, int] = {}
+        measured: Dict[str, int] = {}
+        started = time.time()
+        for name, (entry, last_used) in entries.items():
+            if entry["size"] is None or entry["size_measured"] < max(last_used, entry["last_maintenance"]):
+                measured[name] = disk_usage(os.path.join(self.data_dir, name))
+            sizes[name] = measured.get(name, entry["size"])
+        if measured:
+            with self._update():
+                for name, size in measured.items():
+                    self._entry(name).update(size=size, size_measured=started)
+        return sizes
+
+    def stats(self) -> List[Dict]:
+        names = self.repos()
+        sizes = self._sizes(names)
+        with self._lock:
+            return [
+                {"name": name, "size": sizes[name], "last_used": self._last_used(name),
+                 "pinned": self._entry(name)["pinned"]}
+                for name in names
+            ]
+
+    def evict(self, name: str) -> bool:
+        """
+        Remove a clone, unless a request in any worker is using it. Returns True if it was removed.
+        """
+        repo_path = os.path.join(self.data_dir, name)
+        # Requests hold the use lock for their whole duration, and threads they started the repo
+        # lock while changing the working tree
+        locks = [use_lock(repo_path), repo_lock(repo_path)]
+        fds = []
+        try:
+            for lock in locks:
+                fd = lock.try_acquire(exclusive=True)
+                if fd is None:
+                    return False
+                fds.append(fd)
+            self._forget(name)
+            shutil.rmtree(repo_path, ignore_errors=True)
+            self._clone_ids.pop(name, None)
+        finally:
+            for fd in fds:
+                FileLock.release(fd)
+        with self._update():
+            self.meta.pop(name, None)
+        return True
+
+    def enforce_budget(self, keep: Iterable[str] = ()) -> List[str]:
+        """
+        Evict least recently used clones until the store fits its budget. Returns evicted names.
+        """
+        if self.budget_bytes <= 0:
+            return []
+        keep = {os.path.basename(os.path.normpath(p)) for p in [*keep, *self.active_repos()]}
+        sizes = self._sizes(self.repos())
+        with self._lock:
+            candidates = sorted(
+                (name for name in sizes if not self._entry(name)["pinned"] and name not in keep),
+                key=self._last_used
+            )
+        total = sum(sizes.values())
+        evicted = []
+        for name in candidates:
+            if total <= self.budget_bytes:
+                break
+            if self.evict(name):
+                total -= sizes[name]
+                evicted.append(name)
+        return evicted
+
+    def prune_branches(self, repo_path: str, base: Optional[str] = None,
+                       stale_days: int = STALE_BRANCH_DAYS) -> List[str]:
+        """
+        Delete feature branches that are merged into `base` (default: the remote's default branch)
+        or whose tip is older than `stale_days`. Never deleted: the checked-out branch, branches
+        a live session uses, and branches nothing was committed to yet (their tip is still the
+        commit they were created from, which also makes them look merged, and their date is the
+        base's).
+        """
+        def git(*args) -> str:
+            return subprocess.run(['git', *args], cwd=repo_path, capture_output=True, text=True, check=True).stdout
+
+        def created_from(name: str) -> Optional[str]:
+            # The oldest reflog entry is the branch's creation ("branch: Created from ...")
+            try:
+                entries = git('reflog', 'show', '--format=%H', f'refs/heads/{name}', '--').split()
+            except subprocess.CalledProcessError:
+                return None
+            return entries[-1] if entries else None
+
+        if base is None:
+            try:
+                base = git('symbolic-ref', '--short', 'refs/remotes/origin/HEAD').strip()
+            except subprocess.CalledProcessError:
+                base = 'main'
+        try:
+            merged = set(git('branch', '--merged', base, '--format=%(refname:short)').split())
+            base_sha = git('rev-parse', '--verify', '--quiet', f'{base}^{{commit}}').strip()
+        except subprocess.CalledProcessError:
+            merged, base_sha = set(), None
+        live = set(self.live_branches(repo_path))
+        cutoff = time.time() - stale_days * 86400
+        prune = []
+        refs = git('for-each-ref', '--format=%(refname:lstrip=2) %(objectname) %(committerdate:unix) %(HEAD)',
+                   f'refs/heads/{PRUNABLE_PREFIX}')
+        for line in refs.splitlines():
+            name, sha, timestamp, head = (line.split(' ') + [''])[:4]
+            if head == '*' or name in live:
+                continue
+            if not (name in merged or int(timestamp or 0) < cutoff):
+                continue
+            # Without a reflog (e.g. a branch fetched from elsewhere) fall back to the base's tip
+            if sha == (created_from(name) or base_sha):
+                continue
+            prune.append(name)
+        if prune:
+            git('branch', '-D', *prune)
+        return prune
+
+    def maintain(self, repo_path: str):
+        for command in MAINTENANCE_COMMANDS:
+            result = subprocess.run(command, cwd=repo_path, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"Maintenance command {' '.join(command)} failed in {repo_path}: {result.stderr.strip()}")
+
+    def run_cycle(self, now: Optional[float] = None):
+        """
+        One maintenance pass: prune and compact idle repos that are due, then enforce the budget.
+        Skipped while another worker is running one.
+        """
+        # Every worker writes out its access times, whether or not it runs maintenance
+        self.flush()
+        leader = self._maintenance_lock.try_acquire(exclusive=True)
+        if leader is None:
+            return
+        try:
+            self._run_cycle(now or time.time())
+        finally:
+            self._maintenance_lock.release(leader)
+
+    def _run_cycle(self, now: float):
+        for name in self.repos():
+            with self._lock:
+                entry = dict(self._entry(name), last_used=self._last_used(name))
+            if now - entry["last_used"] < MAINTENANCE_IDLE_SECONDS:
+                continue
+            if now - entry["last_maintenance"] < MAINTENANCE_INTERVAL_SECONDS:
+                continue
+            if self.defer():
+                break
+            repo_path = os.path.join(self.data_dir, name)
+            lock = repo_lock(repo_path)
+            fd = lock.try_acquire(exclusive=True)
+            if fd is None:
+                # In use by a request somewhere; try again next cycle
+                continue
+            try:
+                pruned = self.prune_branches(repo_path)
+                if pruned:
+                    print(f"Pruned {len(pruned)} branches in {name}")
+                self.maintain(repo_path)
+            except Exception as e:
+                print(f"Error maintaining {name}: {str(e)}")
+            finally:
+                lock.release(fd)
+            with self._update():
+                self._entry(name)["last_maintenance"] = time.time()
+        evicted = self.enforce_budget()
+        if evicted:
+            print(f"Evicted repos over disk budget: {', '.join(evicted)}")
+
+    def request_cycle(self):
+        """
+        Wake the background thread early (e.g. right after a new clone).
+        """
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                self._wake.wait(MAINTENANCE_CHECK_SECONDS)
+                self._wake.clear()
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    print(f"Error in repo store maintenance: {str(e)}")
+
+        self._thread = threading.Thread(target=loop, name="repo-store", daemon=True)
+        self._thread.start()
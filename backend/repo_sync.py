@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+import git
+
+from locks import clone_lock, run_locked
+from single_flight import flight_key, flights
+from tracing import span
+
+
+def clone_repo(url: str, repo_path: str):
+    """
+    Clone into a temporary directory next to `repo_path` and rename it into place, so a
+    half-finished clone is never visible at `repo_path`. A no-op if the repo already exists.
+    Other workers cloning the same repo wait for this clone instead of making their own.
+    """
+    if os.path.exists(repo_path):
+        return
+    with clone_lock(repo_path).hold():
+        # Another worker may have finished while we waited
+        if os.path.exists(repo_path):
+            return
+        parent = os.path.dirname(os.path.abspath(repo_path))
+        os.makedirs(parent, exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix=f".{os.path.basename(repo_path)}-clone-", dir=parent)
+        try:
+            with span("git.clone", url=url):
+                git.Repo.clone_from(url, temp_path)
+            try:
+                os.rename(temp_path, repo_path)
+            except OSError:
+                # Someone else (e.g. a host that does not share our lock directory) finished first
+                if not os.path.exists(repo_path):
+                    raise
+        finally:
+            if os.path.exists(temp_path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+
+
+def fetch_repo(repo_path: str, remote: str = 'origin', ref: str = 'main'):
+    with span("git.fetch", remote=remote, ref=ref):
+        git.Repo(repo_path).git.fetch(remote, ref)
+
+
+async def _clone_locked(url: str, repo_path: str):
+    # Another worker's clone is waited for on the event loop, not in a worker thread
+    await run_locked(clone_lock(repo_path), clone_repo, url, repo_path)
+
+
+async def ensure_clone(url: str, repo_path: str):
+    """
+    Clone `url` to `repo_path` unless it is already there; concurrent callers share one clone.
+    """
+    if not os.path.exists(repo_path):
+        await flights.do_async(flight_key("clone", url, os.path.abspath(repo_path)), _clone_locked, url, repo_path)
+
+
+async def fetch(repo_path: str, remote: str = 'origin', ref: str = 'main'):
+    """
+    Fetch `ref` from `remote`; concurrent fetches of the same target share one network round trip.
+    """
+    await flights.do_async(flight_key("fetch", os.path.abspath(repo_path), remote, ref),
+                           fetch_repo, repo_path, remote, ref)
@@ -0,0 +1,175 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from code_change_handler import CodeChangeHandler
+from config import settings
+
+SESSION_TTL_SECONDS = settings.session_ttl_seconds
+SESSION_MAX_SESSIONS = settings.session_max_sessions
+SESSION_MAX_BYTES = settings.session_max_bytes
+SESSION_HISTORY_MESSAGES = settings.session_history_messages
+
+SessionKey = Tuple[str, str, str]  # (user, repo path, branch)
+
+
+class Session:
+    """
+    Warm per-(user, repo, branch) state: the CodeChangeHandler (with its open Repo, OpenAI
+    client and accepted changes) plus the prompt context built on the first turn.
+    """
+
+    def __init__(self, user: str, repo_path: str, branch: str):
+        self.user = user
+        self.repo_path = repo_path
+        self.branch = branch
+        self.handler = CodeChangeHandler(repo_path)
+        self.target_files: Optional[str] = None  # raw identification answer from the first turn
+        self.parsed_targets: List[str] = []
+        self.context_cache: Dict[Tuple[str, ...], str] = {}  # packed code context per file set
+        self.history: List[Dict[str, str]] = []  # previous generation turns
+        self.created = self.last_used = time.time()
+        # Requests using the session, waiting ones included; eviction skips it while non-zero
+        self.active = 0
+        self._turn_lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def turn(self):
+        """
+        Hold the session for one request (a /chat turn, or creating its PR). Requests on the same
+        session run one after the other; the session is not evicted while any is running or waiting.
+        """
+        self.active += 1
+        try:
+            async with self._turn_lock:
+                yield self
+        finally:
+            self.active -= 1
+            self.last_used = time.time()
+
+    def busy(self) -> bool:
+        return self.active > 0
+
+    def add_turn(self, prompt: str, response: str):
+        self.history.extend([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": response},
+        ])
+        # Keep the first turn (it carries the packed code context) plus the most recent ones
+        if len(self.history) > SESSION_HISTORY_MESSAGES:
+            self.history = self.history[:2] + self.history[-(SESSION_HISTORY_MESSAGES - 2):]
+
+    def reset_context(self):
+        self.handler.discard_changes()
+        self.target_files = None
+        self.parsed_targets = []
+        self.context_cache = {}
+        self.history = []
+
+    def approx_bytes(self) -> int:
+        size = sum(len(m["content"]) for m in self.history)
+        size += sum(len(c) for c in self.context_cache.values())
+        if self.handler.change_set is not None:
+            size += sum(len(c) for c in self.handler.change_set.files.values())
+        return size
+
+    def close(self):
+        if self.handler.repo is not None:
+            # Releases the git cat-file processes GitPython keeps per Repo
+            self.handler.repo.close()
+
+
+class SessionManager:
+    """
+    In-memory session store with TTL expiry, LRU eviction and a memory cap.
+    """
+
+    def __init__(self, ttl_seconds: int = SESSION_TTL_SECONDS, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_bytes: int = SESSION_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[SessionKey, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, user: str, repo_path: str, branch: str) -> SessionKey:
+        return user, os.path.abspath(repo_path), branch
+
+    def get(self, user: str, repo_path: str, branch: str) -> Optional[Session]:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(self._key(user, repo_path, branch))
+            if session is not None:
+                session.last_used = time.time()
+                self._sessions.move_to_end(self._key(user, repo_path, branch))
+            return session
+
+    def get_or_create(self, user: str, repo_path: str, branch: str) -> Session:
+        session = self.get(user, repo_path, branch)
+        if session is not None:
+            return session
+        session = Session(user, os.path.abspath(repo_path), branch)
+        with self._lock:
+            # Another request may have created it meanwhile; keep the first one
+            existing = self._sessions.setdefault(self._key(user, repo_path, branch), session)
+            self._evict(keep=existing)
+        if existing is not session:
+            session.close()
+        return existing
+
+    def find(self, repo_path: str, branch: str, user: str) -> Optional[Session]:
+        """
+        Look up a user's session by repo and branch. Sessions are never shared between users.
+        """
+        if not user:
+            return None
+        return self.get(user, repo_path, branch)
+
+    def drop(self, user: str, repo_path: str, branch: str):
+        with self._lock:
+            session = self._sessions.pop(self._key(user, repo_path, branch), None)
+        if session is not None:
+            session.close()
+
+    def drop_repo(self, repo_path: str):
+        repo_path = os.path.abspath(repo_path)
+        with self._lock:
+            keys = [key for key in self._sessions if key[1] == repo_path]
+            dropped = [self._sessions.pop(key) for key in keys]
+        for session in dropped:
+            session.close()
+
+    def repo_paths(self) -> List[str]:
+        with self._lock:
+            return list({key[1] for key in self._sessions})
+
+    def branches(self, repo_path: str) -> List[str]:
+        repo_path = os.path.abspath(repo_path)
+        with self._lock:
+            return list({key[2] for key in self._sessions if key[1] == repo_path})
+
+    def _evict(self, keep: Optional[Session] = None):
+        # Expired sessions first, then least recently used until under the count and memory caps;
+        # sessions a request is using stay, even if that leaves the store over its caps for a while
+        now = time.time()
+        for key in [k for k, s in self._sessions.items()
+                    if now - s.last_used > self.ttl_seconds and s is not keep and not s.busy()]:
+            self._sessions.pop(key).close()
+        total = sum(s.approx_bytes() for s in self._sessions.values())
+        for key in [k for k, s in self._sessions.items() if s is not keep and not s.busy()]:
+            if len(self._sessions) <= self.max_sessions and total <= self.max_bytes:
+                break
+            session = self._sessions.pop(key)
+            total -= session.approx_bytes()
+            session.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "approx_bytes": sum(s.approx_bytes() for s in self._sessions.values()),
+            }
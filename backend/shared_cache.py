@@ -0,0 +1,76 @@
+"""
+Key/value cache in a SQLite file under DATA_DIR, shared by every worker process (and by hosts
+mounting the same volume), so work one worker did is not repeated by the others. Values are
+JSON; anything that goes wrong with the store is treated as a miss, never as an error.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from config import settings
+
+SHARED_CACHE_PATH = settings.shared_cache_path
+SHARED_CACHE_JOURNAL_MODE = settings.shared_cache_journal_mode
+# How long a writer waits for another process's write to finish
+BUSY_TIMEOUT_MS = 5000
+
+
+class SharedCache:
+    def __init__(self, path: str = SHARED_CACHE_PATH, journal_mode: str = SHARED_CACHE_JOURNAL_MODE):
+        self.path = path
+        self.journal_mode = journal_mode
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            row = self._connection().execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Error reading shared cache: {str(e)}")
+            return None
+
+    def set(self, namespace: str, key: str, value: Any):
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, updated) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time())
+            )
+        except sqlite3.Error as e:
+            print(f"Error writing shared cache: {str(e)}")
+
+    def delete(self, namespace: str, key: Optional[str] = None):
+        """
+        Drop one key, or the whole namespace when `key` is None.
+        """
+        try:
+            if key is None:
+                self._connection().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            else:
+                self._connection().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            print(f"Error writing shared cache: {str(e)}")
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+def flight_key(operation: str, *parts: Any) -> Tuple[str, str]:
+    """
+    Build a coalescing key from an operation name and its arguments (hashed, so prompts stay small).
+    """
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return operation, digest
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight operations: while a call for a key is running, every other
+    caller with the same key waits for it and receives the same result (or exception).
+    Nothing is cached once the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, "asyncio.Future"] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking `fn` once per key across threads.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Await `fn` once per key. Coroutine functions run on the event loop; blocking functions run
+        in a worker thread and also coalesce with callers of `do()` on other threads.
+        """
+        future = self._async_calls.get(key)
+        if future is None:
+            if asyncio.iscoroutinefunction(fn):
+                future = asyncio.ensure_future(fn(*args, **kwargs))
+            else:
+                # One worker thread per key, however many coroutines are waiting on it
+                future = asyncio.ensure_future(asyncio.to_thread(self.do, key, fn, *args, **kwargs))
+            future.waiters = 0
+            self._async_calls[key] = future
+            future.add_done_callback(lambda _: self._async_calls.pop(key, None))
+        future.waiters += 1
+        try:
+            # shield: one waiter being cancelled must not cancel the call the others wait on
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future.waiters == 1 and not future.done():
+                # Nobody is left waiting (e.g. the client went away): stop the call itself
+                future.cancel()
+            raise
+        finally:
+            future.waiters -= 1
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._async_calls)
+
+
+# Shared by clones, fetches and LLM calls across the whole process
+flights = SingleFlight()
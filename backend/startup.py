@@ -0,0 +1,134 @@
+"""
+Worker startup timing. Importing this module starts timing every import made on the
+importing thread (a `python -X importtime`-style breakdown, without the flag); the app
+reports the result when it is ready to serve, and at GET /startup.
+
+Import it before anything else so the breakdown covers the whole app.
+"""
+import builtins
+import importlib
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class ImportRecord:
+    __slots__ = ("name", "parent", "depth", "self_seconds", "cumulative_seconds")
+
+    def __init__(self, name: str, parent: Optional[str], depth: int, self_seconds: float, cumulative_seconds: float):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.self_seconds = self_seconds
+        self.cumulative_seconds = cumulative_seconds
+
+    def as_dict(self) -> Dict:
+        return {"module": self.name, "imported_by": self.parent, "depth": self.depth,
+                "self_ms": round(self.self_seconds * 1000, 1),
+                "cumulative_ms": round(self.cumulative_seconds * 1000, 1)}
+
+
+class ImportTimer:
+    """
+    Times first imports of modules through `builtins.__import__`. Nested imports are
+    attributed to their importer, so self time excludes the modules a module pulls in.
+    """
+
+    def __init__(self):
+        self.records: List[ImportRecord] = []
+        # [name, started, seconds spent in nested imports]
+        self._stack: List[list] = []
+        self._original = None
+        self._thread: Optional[int] = None
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            self._thread = threading.get_ident()
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        original = self._original or builtins.__import__
+        # Already loaded, relative, or on another thread (e.g. the preloader): not part of boot
+        if level or name in sys.modules or threading.get_ident() != self._thread:
+            return original(name, globals, locals, fromlist, level)
+        frame = [name, time.perf_counter(), 0.0]
+        parent = self._stack[-1][0] if self._stack else None
+        self._stack.append(frame)
+        try:
+            return original(name, globals, locals, fromlist, level)
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+            self.records.append(ImportRecord(name, parent, len(self._stack), elapsed - frame[2], elapsed))
+
+
+class StartupReport:
+    """
+    When the worker started importing the app, what the imports cost, when it could serve
+    and what is being preloaded in the background after that.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self.preloaded: Dict[str, float] = {}
+        self.timer = ImportTimer()
+
+    def imports_done(self):
+        self.timer.uninstall()
+        self.imports_seconds = time.perf_counter() - self.started
+
+    def ready(self, preload: List[str] = ()):
+        """
+        Mark the worker ready, print a one-line summary and import `preload` modules in a
+        background thread so the first request that needs them does not wait for the import.
+        """
+        if self.imports_seconds is None:
+            self.imports_done()
+        self.ready_seconds = time.perf_counter() - self.started
+        top = ', '.join(f"{r['module']} {r['cumulative_ms']:.0f}ms" for r in self.top_imports(5))
+        print(f"Worker ready in {self.ready_seconds:.2f}s (imports {self.imports_seconds:.2f}s: {top})"
+              + (f"; preloading {', '.join(preload)}" if preload else ''))
+        if preload:
+            threading.Thread(target=self._preload, args=(list(preload),), name="preload", daemon=True).start()
+
+    def _preload(self, modules: List[str]):
+        for name in modules:
+            started = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Error preloading {name}: {str(e)}")
+                continue
+            self.preloaded[name] = time.perf_counter() - started
+
+    def top_imports(self, limit: int = 15, depth: int = 0) -> List[Dict]:
+        records = [r for r in self.timer.records if r.depth == depth]
+        return [r.as_dict() for r in sorted(records, key=lambda r: r.cumulative_seconds, reverse=True)[:limit]]
+
+    def as_dict(self, limit: int = 15) -> Dict:
+        heaviest = sorted(self.timer.records, key=lambda r: r.self_seconds, reverse=True)[:limit]
+        return {
+            "imports_seconds": None if self.imports_seconds is None else round(self.imports_seconds, 3),
+            "ready_seconds": None if self.ready_seconds is None else round(self.ready_seconds, 3),
+            "modules_imported": len(self.timer.records),
+            # What the app's own imports cost, nested imports included
+            "imports": self.top_imports(limit),
+            # Where the time actually went
+            "heaviest": [r.as_dict() for r in heaviest],
+            "preloaded_ms": {name: round(seconds * 1000, 1) for name, seconds in self.preloaded.items()},
+        }
+
+
+boot = StartupReport()
+boot.timer.install()
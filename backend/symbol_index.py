@@ -0,0 +1,330 @@
+import ast
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import settings
+from git_objects import get_object_store
+
+INDEX_DIR = os.path.join(settings.data_dir, '.symbol_index')
+
+# Rough token estimate used for budgeting prompt context (no tokenizer dependency)
+CHARS_PER_TOKEN = 4
+INDEX_VERSION = 1
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _call_names(node: ast.AST) -> List[str]:
+    """
+    Collect the names of everything called inside a node (foo(), obj.foo()).
+    """
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Call):
+            func = child.func
+            if isinstance(func, ast.Name):
+                names.add(func.id)
+            elif isinstance(func, ast.Attribute):
+                names.add(func.attr)
+    return sorted(names)
+
+
+def _symbol(node: ast.AST, qualname: str, kind: str) -> Dict:
+    doc = ast.get_docstring(node) or ''
+    return {
+        "name": node.name,
+        "qualname": qualname,
+        "kind": kind,
+        "lineno": node.lineno,
+        "end_lineno": getattr(node, 'end_lineno', node.lineno),
+        "body_lineno": node.body[0].lineno if node.body else node.lineno,
+        "doc": doc.strip().split('\n')[0][:200],
+        "calls": _call_names(node),
+    }
+
+
+def parse_source(source: str) -> Dict:
+    """
+    Extract functions, classes, methods, imports and call references from Python source.
+    Files that do not parse are indexed as empty.
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return {"imports": [], "symbols": []}
+
+    imports = []
+    symbols = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = '.' * node.level + (node.module or '')
+            imports.extend(f"{module}.{alias.name}" for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols.append(_symbol(node, node.name, "function"))
+        elif isinstance(node, ast.ClassDef):
+            symbols.append(_symbol(node, node.name, "class"))
+            for item in node.body:
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    symbols.append(_symbol(item, f"{node.name}.{item.name}", "method"))
+    return {"imports": imports, "symbols": symbols}
+
+
+class SymbolIndex:
+    """
+    Per-repo index of Python symbols built with `ast`.
+
+    Parsed results are cached by blob SHA, so unchanged files are never re-parsed,
+    and `update()` only looks at the paths that changed between the indexed commit and HEAD.
+    Requests use the same index from several threads: hold `lock` across an update and the
+    reads that rely on it.
+    """
+
+    def __init__(self, repo_path: str, index_dir: str = INDEX_DIR):
+        self.repo_path = repo_path
+        self.lock = threading.RLock()
+        self.store = get_object_store(repo_path)
+        self.index_file = os.path.join(index_dir, f"{os.path.basename(os.path.normpath(repo_path))}.json")
+        self.commit: Optional[str] = None
+        self.files: Dict[str, str] = {}   # path -> blob sha at the indexed commit
+        self.blobs: Dict[str, Dict] = {}  # blob sha -> parse_source() result
+        self._load()
+        self._rebuild_lookups()
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return
+            self.commit = data.get("commit")
+            self.files = data.get("files", {})
+            self.blobs = data.get("blobs", {})
+        except Exception as e:
+            print(f"Error loading symbol index: {str(e)}")
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        # Drop cached blobs that are no longer referenced by the indexed commit
+        live = set(self.files.values())
+        self.blobs = {sha: parsed for sha, parsed in self.blobs.items() if sha in live}
+        # Per writer, so workers saving the same file at once never interleave
+        tmp_file = f"{self.index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "commit": self.commit,
+                       "files": self.files, "blobs": self.blobs}, f)
+        os.replace(tmp_file, self.index_file)
+
+    def _read_blob(self, sha: str) -> str:
+        return (self.store.read(sha) or b'').decode('utf-8', errors='ignore')
+
+    def _index_blobs(self, shas: List[str]):
+        # Parse only blobs not seen before, reading them in one batched pass
+        missing = sorted({sha for sha in shas if sha not in self.blobs})
+        for sha, obj in zip(missing, self.store.read_many(missing)):
+            source = obj[2].decode('utf-8', errors='ignore') if obj else ''
+            self.blobs[sha] = parse_source(source)
+
+    def build(self, rev: str = 'HEAD'):
+        """
+        Index every Python file at `rev` from scratch (cached blobs are still reused).
+        """
+        with self.lock:
+            self._build(rev)
+
+    def _build(self, rev: str):
+        commit = self.store.rev_parse(f"{rev}^{{commit}}")
+        self.files = {
+            path: sha for _, obj_type, sha, path in self.store.ls_tree(commit)
+            if obj_type == 'blob' and path.endswith('.py')
+        }
+        self._index_blobs(list(self.files.values()))
+        self.commit = commit
+        self._rebuild_lookups()
+        self.save()
+
+    def update(self, rev: str = 'HEAD') -> bool:
+        """
+        Bring the index up to date with `rev`, re-parsing only changed files.
+        Returns True if anything changed.
+        """
+        with self.lock:
+            return self._update(rev)
+
+    def _update(self, rev: str) -> bool:
+        commit = self.store.rev_parse(f"{rev}^{{commit}}")
+        if commit is None:
+            print(f"Error resolving {rev} for symbol index")
+            return False
+        if self.commit == commit:
+            return False
+        if not self.commit or self.store.info(self.commit) is None:
+            # Nothing indexed yet, or the indexed commit is gone (e.g. branch rewritten)
+            self._build(commit)
+            return True
+        for path, _, new_sha in self.store.diff_trees(self.commit, commit):
+            if not path.endswith('.py'):
+                continue
+            if new_sha is None:
+                self.files.pop(path, None)
+            else:
+                self.files[path] = new_sha
+        self._index_blobs(list(self.files.values()))
+        self.commit = commit
+        self._rebuild_lookups()
+        self.save()
+        return True
+
+    def _rebuild_lookups(self):
+        # name -> [(path, symbol)], and name -> [(path, symbol)] of symbols that call it
+        self.definitions: Dict[str, List[Tuple[str, Dict]]] = {}
+        self.callers: Dict[str, List[Tuple[str, Dict]]] = {}
+        for path, sha in self.files.items():
+            for sym in self.blobs.get(sha, {}).get("symbols", []):
+                self.definitions.setdefault(sym["name"], []).append((path, sym))
+                for name in sym["calls"]:
+                    self.callers.setdefault(name, []).append((path, sym))
+
+    def symbols_in(self, path: str) -> List[Dict]:
+        return self.blobs.get(self.files.get(path, ''), {}).get("symbols", [])
+
+    def _render(self, path: str, sym: Dict, lines: List[str], full: bool) -> str:
+        start, end = sym["lineno"], sym["end_lineno"]
+        if full:
+            body = '\n'.join(lines[start - 1:end])
+        else:
+            # Signature plus the first docstring line only
+            body = '\n'.join(lines[start - 1:max(start, sym["body_lineno"] - 1)])
+            if sym["doc"]:
+                body += f'\n    """{sym["doc"]}"""'
+            body += '\n    ...'
+        return f"# {path}:{start}-{end} ({sym['kind']} {sym['qualname']})\n{body}\n"
+
+    def pack_context(self, target_files: List[str], query: str = '', token_budget: int = 3000) -> str:
+        """
+        Pack the most relevant symbols for a request into a prompt snippet that fits `token_budget`.
+        Priority: symbols in the target files (ranked by overlap with the query), then the symbols
+        they depend on, then their callers, then other symbols whose names match the query.
+        """
+        with self.lock:
+            return self._pack_context(target_files, query, token_budget)
+
+    def _pack_context(self, target_files: List[str], query: str, token_budget: int) -> str:
+        terms = {t.lower() for t in re.findall(r'[A-Za-z_][A-Za-z0-9_]{2,}', query)}
+
+        def score(sym: Dict) -> int:
+            words = set(re.findall(r'[a-z0-9]+', (sym["qualname"] + ' ' + sym["doc"]).lower()))
+            return len(words & terms)
+
+        seeds = []
+        for path in target_files:
+            seeds.extend((path, sym) for sym in self.symbols_in(path))
+        seeds.sort(key=lambda item: -score(item[1]))
+
+        seed_names = {sym["name"] for _, sym in seeds}
+        dependencies = []
+        callers = []
+        for _, sym in seeds:
+            for name in sym["calls"]:
+                if name not in seed_names:
+                    dependencies.extend(self.definitions.get(name, []))
+        for name in seed_names:
+            callers.extend(item for item in self.callers.get(name, []) if item[0] not in target_files)
+
+        matches = []
+        if terms:
+            for name, defs in self.definitions.items():
+                if name.lower() in terms:
+                    matches.extend(defs)
+
+        sections: List[str] = []
+        used = 0
+        seen: Set[Tuple[str, str]] = set()
+        source_cache: Dict[str, List[str]] = {}
+        for path in target_files:
+            imports = self.blobs.get(self.files.get(path, ''), {}).get("imports", [])
+            if imports:
+                header = f"# {path} imports: {', '.join(imports)}\n"
+                if used + estimate_tokens(header) <= token_budget:
+                    sections.append(header)
+                    used += estimate_tokens(header)
+
+        full_classes: Set[Tuple[str, str]] = set()
+        for path, sym in seeds + dependencies + callers + matches:
+            key = (path, sym["qualname"])
+            # Skip methods already included as part of their full class
+            owner = (path, sym["qualname"].split('.')[0])
+            if key in seen or (sym["kind"] == "method" and owner in full_classes):
+                continue
+            seen.add(key)
+            if path not in source_cache:
+                source_cache[path] = self._read_blob(self.files[path]).splitlines()
+            lines = source_cache[path]
+            for full in (True, False):
+                snippet = self._render(path, sym, lines, full)
+                cost = estimate_tokens(snippet)
+                if used + cost <= token_budget:
+                    sections.append(snippet)
+                    used += cost
+                    if full and sym["kind"] == "class":
+                        full_classes.add(key)
+                    break
+            if token_budget - used < 20:
+                break
+        return '\n'.join(sections)
+
+
+_indexes: Dict[str, SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_for(repo_path: str) -> SymbolIndex:
+    repo_path = os.path.abspath(repo_path)
+    with _indexes_lock:
+        index = _indexes.get(repo_path)
+        if index is None:
+            index = _indexes[repo_path] = SymbolIndex(repo_path)
+        return index
+
+
+def get_symbol_index(repo_path: str, rev: str = 'HEAD') -> SymbolIndex:
+    """
+    Return the process-wide index for a repo, brought up to date with `rev`.
+    Blocking (it may parse many files): call it from a worker thread in async code.
+    """
+    index = _index_for(repo_path)
+    index.update(rev)
+    return index
+
+
+def pack_repo_context(repo_path: str, target_files: List[str], query: str = '', token_budget: int = 3000,
+                      rev: str = 'HEAD') -> str:
+    """
+    Bring the repo's index to `rev` and pack context from it, with no other thread moving the
+    index in between. Requests pass their branch's commit: HEAD is whatever another request
+    checked out last. Blocking: call it from a worker thread in async code.
+    """
+    index = _index_for(repo_path)
+    with index.lock:
+        index.update(rev)
+        return index.pack_context(target_files, query, token_budget)
+
+
+def forget_symbol_index(repo_path: str):
+    """
+    Drop the in-memory and on-disk index of a repo (e.g. when its clone is evicted).
+    """
+    with _indexes_lock:
+        index = _indexes.pop(os.path.abspath(repo_path), None)
+    index_file = index.index_file if index else os.path.join(
+        INDEX_DIR, f"{os.path.basename(os.path.normpath(repo_path))}.json")
+    if os.path.exists(index_file):
+        os.remove(index_file)
@@ -0,0 +1,88 @@
+import asyncio
+import re
+from typing import List, Tuple
+
+from config import settings
+from dir_summaries import get_summary_store
+from git_objects import get_object_store
+from llm import acomplete, complete_in_thread
+from prompts import IDENTIFY_TARGET_PROMPT
+from tracing import span
+
+OPENAI_DEPLOYMENT = settings.openai_deployment
+FLAT_FILE_LIST_LIMIT = settings.flat_file_list_limit
+
+
+def list_files(repo_path: str, rev: str = 'HEAD') -> List[str]:
+    """
+    Paths of the files committed at `rev`, read from the object store: unlike the working tree,
+    a commit does not change when another request checks out a different branch.
+    """
+    return [path for _, obj_type, _, path in get_object_store(repo_path).ls_tree(rev) if obj_type == 'blob']
+
+
+def parse_target_files(target_files: str, known_files: List[str]) -> List[str]:
+    """Pick out the repo paths mentioned in the model's free-text target file answer."""
+    known = set(known_files)
+    paths = []
+    for candidate in re.split(r'[\s,;`\'"]+', target_files):
+        candidate = candidate.strip('-*')
+        if candidate.startswith('./'):
+            candidate = candidate[2:]
+        if candidate in known and candidate not in paths:
+            paths.append(candidate)
+    return paths
+
+
+async def identify_target_files(client, repo_path: str, user_request: str,
+                                async_client=None, rev: str = 'HEAD') -> Tuple[str, List[str]]:
+    """
+    List the repo's files (narrowed down through the directory summaries for large repos) and ask
+    the model which ones the request touches. Returns the raw answer and the known paths in it.
+
+    `client` (sync) drives the directory summaries; the completion itself goes through
+    `async_client` when given, so it is aborted if the caller is cancelled. Files and summaries
+    are taken from `rev` (the request's branch commit), so no repo lock is needed.
+    """
+    with span("walk") as current:
+        files = await asyncio.to_thread(list_files, repo_path, rev)
+        if current is not None:
+            current.set_attribute("files", len(files))
+    files_str = None
+    if len(files) > FLAT_FILE_LIST_LIMIT:
+        # Summaries cost LLM calls and are only needed when the flat listing is too long
+        # The first call loads the stored summaries from disk
+        summary_store = await asyncio.to_thread(get_summary_store, repo_path, client)
+        summary_store.refresh_async(rev)
+        if summary_store.is_ready():
+            try:
+                with span("drill_down", files=len(files)):
+                    # Blocking completions per level of the tree
+                    files_str = ', '.join(await asyncio.to_thread(summary_store.drill_down, user_request))
+            except Exception as e:
+                print(f"Error drilling down directory summaries: {str(e)}")
+    if files_str is None:
+        # Summaries still building (or failed): the first FLAT_FILE_LIST_LIMIT files keep the prompt bounded
+        files_str = ', '.join(files[:FLAT_FILE_LIST_LIMIT])
+
+    identify_prompt = IDENTIFY_TARGET_PROMPT.format(user_request=user_request, file_list=files_str)
+    kwargs = dict(
+        stream=False,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": identify_prompt},
+        ],
+        max_completion_tokens=300,
+        temperature=0.2,
+        top_p=1.0,
+        frequency_penalty=0.0,
+        presence_penalty=0.0,
+        model=OPENAI_DEPLOYMENT,
+    )
+    if async_client is not None:
+        completion = acomplete(async_client, **kwargs)
+    else:
+        completion = complete_in_thread(client, **kwargs)
+    response = await completion
+    target_files = response.choices[0].message.content.strip()
+    return target_files, parse_target_files(target_files, files)
@@ -0,0 +1,90 @@
+"""
+End-to-end test of a fleet run against local bare remotes (bench.remotes) and a backend wired
+to the fake Azure OpenAI and GitHub servers (bench.loadgen.start_services):
+
+    cd backend
+    python -m pytest test_fleet.py
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from bench.loadgen import start_services
+from bench.remotes import create_remotes
+
+USERNAME = "fleet-test"
+FLEET_BRANCH = "fleet/fleet-test/add-logging"
+FEATURE_BRANCH = "feature/fleet-test/add-logging"
+
+
+def remote_branch_sha(remote: str, branch: str) -> str:
+    return subprocess.run(['git', 'rev-parse', '--verify', '--quiet', f'refs/heads/{branch}'], cwd=remote,
+                          capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture(scope="module")
+def fleet_env():
+    work_dir = tempfile.mkdtemp(prefix='fleet-test-')
+    services = ()
+    try:
+        remotes = create_remotes(os.path.join(work_dir, 'remotes'), 2, modules=6)
+        args = SimpleNamespace(latency=0.0, tokens_per_second=0.0, error_rate=0.0, completion_tokens=100,
+                               github_latency=0.0, workers=1)
+        services = start_services(args, work_dir)
+        _, fake_github, backend = services
+        yield SimpleNamespace(backend=backend.url, github=fake_github.url, remotes=remotes)
+    finally:
+        for service in services:
+            service.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def failures(body: dict) -> list:
+    return [(r["repo"], r["stage"], r["error"]) for r in body["results"] if r["status"] != "pr_created"]
+
+
+def run_fleet(env, pr_title: str) -> dict:
+    response = httpx.post(env.backend + '/fleet', json={
+        "message": "Add logging to the service handlers",
+        "github_links": env.remotes,
+        "username": USERNAME,
+        "descriptive_name": "add logging",
+        "pr_title": pr_title,
+    }, timeout=300)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_fleet_pushes_branch_and_opens_draft_prs(fleet_env):
+    body = run_fleet(fleet_env, "Add logging")
+
+    assert body["status"] == "success", failures(body)
+    assert body["branch_name"] == FLEET_BRANCH
+    assert body["summary"] == {"pr_created": len(fleet_env.remotes)}
+    for result, remote in zip(body["results"], fleet_env.remotes):
+        assert result["repo"] == remote
+        assert result["pr_url"]
+        assert result["files"]
+        assert result["failed_files"] == {}
+        assert remote_branch_sha(remote, FLEET_BRANCH) == result["commit"]
+    assert httpx.get(fleet_env.github + '/stats').json()["pulls"] == len(fleet_env.remotes)
+
+
+def test_fleet_rerun_replaces_its_branch_but_not_feature_branches(fleet_env):
+    remote = fleet_env.remotes[0]
+    # A /chat branch with the same user and name must survive the fleet's force-push
+    subprocess.run(['git', 'branch', '-f', FEATURE_BRANCH, 'main'], cwd=remote, check=True)
+    feature_sha = remote_branch_sha(remote, FEATURE_BRANCH)
+    previous = remote_branch_sha(remote, FLEET_BRANCH)
+
+    body = run_fleet(fleet_env, "Add logging again")
+
+    assert body["status"] == "success", failures(body)
+    assert remote_branch_sha(remote, FEATURE_BRANCH) == feature_sha
+    assert remote_branch_sha(remote, FLEET_BRANCH) == body["results"][0]["commit"]
+    assert body["results"][0]["commit"] != previous
@@ -0,0 +1,64 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from tracing import span
+
+# (stage, seconds) recorded by the current request; shared with the tasks and threads it starts
+_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar('stages', default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a pipeline stage of the current request; reported in its Server-Timing header and
+    traced as a span.
+    """
+    started = time.perf_counter()
+    try:
+        with span(name) as current:
+            yield current
+    finally:
+        stages = _stages.get()
+        if stages is not None:
+            stages.append((name, time.perf_counter() - started))
+
+
+def stage_totals(stages: List[Tuple[str, float]]) -> Dict[str, float]:
+    # Stages that ran more than once (or concurrently) are summed, in first-seen order
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return totals
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a `Server-Timing` header with the request's stage durations
+    (milliseconds) and its total time in the app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        stages: List[Tuple[str, float]] = []
+        reset = _stages.set(stages)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                totals = stage_totals(stages)
+                totals['total'] = time.perf_counter() - started
+                header = ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+                message = dict(message)
+                message['headers'] = [*message.get('headers', []), (b'server-timing', header.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stages.reset(reset)
@@ -0,0 +1,384 @@
+import contextvars
+import cProfile
+import datetime
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+TRACING_ENABLED = settings.tracing_enabled
+TRACE_DIR = settings.trace_dir
+SERVICE_NAME = settings.service_name
+PROFILER = settings.profiler
+PROFILE_SLOW_MS = settings.profile_slow_ms
+PROFILE_SAMPLE_INTERVAL = settings.profile_sample_interval
+PIPELINE_RECORD = settings.pipeline_record
+RECORD_DIR = settings.record_dir
+# Liveness probes would drown out the requests worth looking at
+UNTRACED_PATHS = ("/health",)
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER = 1, 2
+STATUS_OK, STATUS_ERROR = 1, 2
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.events: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = STATUS_OK
+        self.status_message = ''
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Trace:
+    """
+    The spans of one request. Shared (through contextvars) with every task and worker
+    thread the request starts.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, parent_span_id: Optional[str] = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.parent_span_id = parent_span_id
+        self.spans: List[Span] = []
+        self.lock = threading.Lock()
+        # LLM calls of this request when PIPELINE_RECORD is on
+        self.recording: Optional[List[Dict]] = [] if PIPELINE_RECORD else None
+
+    def start_span(self, name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL,
+                   attributes: Optional[Dict[str, Any]] = None) -> Span:
+        span = Span(self, name, parent_id, kind, attributes)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def record(self, entry: Dict):
+        if self.recording is not None:
+            with self.lock:
+                self.recording.append(entry)
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar('trace', default=None)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('span', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def current_span() -> Optional[Span]:
+    return _span.get()
+
+
+def traceparent() -> Optional[str]:
+    """
+    W3C traceparent of the current span, for outgoing calls.
+    """
+    trace, span = _trace.get(), _span.get()
+    if trace is None:
+        return None
+    return f"00-{trace.trace_id}-{span.span_id if span else '0' * 16}-01"
+
+
+def parse_traceparent(header: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    m = TRACEPARENT_RE.match((header or '').strip().lower())
+    if not m or m.group(1) == '0' * 32:
+        return None, None
+    return m.group(1), m.group(2)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Child span of the current one, for the duration of the block. A no-op outside a traced request.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _span.get()
+    current = trace.start_span(name, parent.span_id if parent else trace.parent_span_id, attributes=attributes)
+    reset = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        current.end()
+        _span.reset(reset)
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def to_otlp(trace: Trace) -> Dict:
+    """
+    The trace as an OTLP/JSON ExportTraceServiceRequest (what the OpenTelemetry file exporter writes).
+    """
+    spans = []
+    for s in trace.spans:
+        entry = {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": s.kind,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns or s.start_ns),
+            "attributes": _otlp_attributes(s.attributes),
+            "status": {"code": s.status, "message": s.status_message} if s.status == STATUS_ERROR else {"code": s.status},
+        }
+        if s.parent_id:
+            entry["parentSpanId"] = s.parent_id
+        if s.events:
+            entry["events"] = [{"timeUnixNano": str(t), "name": n, "attributes": _otlp_attributes(a)}
+                               for t, n, a in s.events]
+        spans.append(entry)
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{"scope": {"name": "amsgenie.tracing"}, "spans": spans}],
+    }]}
+
+
+class TraceExporter:
+    def __init__(self, trace_dir: str = TRACE_DIR):
+        self.trace_dir = trace_dir
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(to_otlp(trace), separators=(',', ':'))
+        path = os.path.join(self.trace_dir, f"traces-{datetime.date.today():%Y%m%d}.jsonl")
+        with self._lock:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread at a fixed interval while at least one profile is
+    active, counting them in collapsed ("folded") form for flame graphs.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._sessions: List[Counter] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> Counter:
+        counts: Counter = Counter()
+        with self._lock:
+            self._sessions.append(counts)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return counts
+
+    def stop(self, counts: Counter):
+        with self._lock:
+            if counts in self._sessions:
+                self._sessions.remove(counts)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    self._thread = None
+                    return
+                sessions = list(self._sessions)
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                folded = ';'.join([names.get(ident, str(ident)), *reversed(stack)])
+                for counts in sessions:
+                    counts[folded] += 1
+            time.sleep(self.interval)
+
+
+_sampler = StackSampler()
+_cprofile_lock = threading.Lock()
+
+
+class Profile:
+    """
+    One request's profile: stack samples ("sample") or cProfile of the event loop thread
+    ("cprofile", one request at a time). `save()` writes it next to the traces.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.counts: Optional[Counter] = None
+        self.profiler: Optional[cProfile.Profile] = None
+
+    def start(self) -> "Profile":
+        if self.kind == 'sample':
+            self.counts = _sampler.start()
+        elif self.kind == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def stop(self):
+        if self.counts is not None:
+            _sampler.stop(self.counts)
+        if self.profiler is not None:
+            self.profiler.disable()
+            _cprofile_lock.release()
+
+    def save(self, trace_id: str, trace_dir: str = TRACE_DIR) -> Optional[str]:
+        profile_dir = os.path.join(trace_dir, 'profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        if self.counts:
+            path = os.path.join(profile_dir, f"{trace_id}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in self.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            return path
+        if self.profiler is not None:
+            path = os.path.join(profile_dir, f"{trace_id}.prof")
+            self.profiler.dump_stats(path)
+            return path
+        return None
+
+
+def save_recording(trace: Trace, request: Dict, status: Optional[int], duration: float,
+                   record_dir: str = RECORD_DIR) -> str:
+    """
+    Write the request, its LLM calls (prompts, responses, timings) and its stage timings
+    as one JSON file, replayable with bench/replay.py.
+    """
+    stages = [{"name": s.name, "span_id": s.span_id, "parent_id": s.parent_id, "duration": round(s.duration, 6)}
+              for s in trace.spans]
+    os.makedirs(record_dir, exist_ok=True)
+    path = os.path.join(record_dir, f"{trace.trace_id}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"trace_id": trace.trace_id, "request": request, "status": status,
+                   "duration": round(duration, 6), "spans": stages, "llm_calls": trace.recording}, f, indent=1)
+    return path
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a trace per HTTP request. Continues an incoming `traceparent`,
+    returns the trace id in `X-Trace-Id` and `traceparent`, exports the finished trace, and
+    optionally records the request and profiles it.
+    """
+
+    def __init__(self, app, exporter: Optional[TraceExporter] = None, profiler: str = PROFILER,
+                 slow_ms: float = PROFILE_SLOW_MS):
+        self.app = app
+        self.exporter = exporter or TraceExporter()
+        self.profiler = profiler
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not TRACING_ENABLED or scope['path'] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+        headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        trace = Trace(*parse_traceparent(headers.get('traceparent')))
+        root = trace.start_span(f"{scope['method']} {scope['path']}", trace.parent_span_id, kind=SPAN_KIND_SERVER,
+                                attributes={"http.method": scope['method'], "http.target": scope['path'],
+                                            "user": headers.get('x-user')})
+        reset_trace, reset_span = _trace.set(trace), _span.set(root)
+        body = bytearray()
+        status: List[int] = []
+
+        async def receive_recorded():
+            message = await receive()
+            if trace.recording is not None and message['type'] == 'http.request':
+                body.extend(message.get('body', b''))
+            return message
+
+        async def send_traced(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+                message = dict(message)
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'x-trace-id', trace.trace_id.encode('latin-1')),
+                    (b'traceparent', f"00-{trace.trace_id}-{root.span_id}-01".encode('latin-1')),
+                ]
+            await send(message)
+
+        profile = Profile(self.profiler).start() if self.profiler in ('sample', 'cprofile') else None
+        try:
+            await self.app(scope, receive_recorded if trace.recording is not None else receive, send_traced)
+        except BaseException as e:
+            root.set_error(e)
+            raise
+        finally:
+            root.end()
+            if profile is not None:
+                profile.stop()
+            root.set_attribute("http.status_code", status[0] if status else None)
+            if status and status[0] >= 500:
+                root.status = STATUS_ERROR
+            try:
+                if profile is not None and root.duration * 1000 >= self.slow_ms:
+                    root.set_attribute("profile.kind", self.profiler)
+                    root.set_attribute("profile.file", profile.save(trace.trace_id, self.exporter.trace_dir))
+                if trace.recording is not None:
+                    request = {"method": scope['method'], "path": scope['path'],
+                               "query": scope.get('query_string', b'').decode('latin-1'),
+                               "user": headers.get('x-user'),
+                               "body": body.decode('utf-8', errors='replace')}
+                    save_recording(trace, request, status[0] if status else None, root.duration)
+                self.exporter.export(trace)
+            except Exception as e:
+                print(f"Error exporting trace {trace.trace_id}: {str(e)}")
+            _span.reset(reset_span)
+            _trace.reset(reset_trace)
@@ -1,38 +1,51 @@
+import asyncio
+import datetime
 import os
-from fastapi import FastAPI, Request
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from dotenv import load_dotenv
-import git
-from openai import AzureOpenAI
-from prompts import IDENTIFY_TARGET_PROMPT, CODE_GENERATION_PROMPT
-import subprocess
-from fastapi import Body
+import sys
 from typing import Dict
-from github import Github
-import datetime
-from openai import AzureOpenAI
-from fastapi import APIRouter, Request
-from pydantic import BaseModel
-import git
 
+import git
+from dotenv import load_dotenv
+from fastapi import Body, FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
 
+from prompts import IDENTIFY_TARGET_PROMPT, CODE_GENERATION_PROMPT
 
+# .env wins over the shell here; loaded before backend/config.py reads the environment
 load_dotenv(override=True)
 
+# Shared request handling helpers live in backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from admission import AdmissionController, AdmissionMiddleware
+from cancellation import cancel_on_disconnect, run_process
+from config import settings
+
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 
-OPENAI_ENDPOINT = os.getenv("OPENAI_ENDPOINT")
-OPENAI_KEY = os.getenv("OPENAI_KEY")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1")
-OPENAI_DEPLOYMENT = os.getenv("OPENAI_MODEL", "gpt-4.1")
-OPENAI_API_VERSION = os.getenv("OPENAI_API_VERSION", "2024-12-01-preview")
+OPENAI_ENDPOINT = settings.get("OPENAI_ENDPOINT")
+OPENAI_KEY = settings.get("OPENAI_KEY")
+OPENAI_MODEL = settings.openai_model
+OPENAI_DEPLOYMENT = settings.openai_deployment
+OPENAI_API_VERSION = settings.openai_api_version
 
 
+def openai_client():
+    # openai takes a large share of startup time; imported on first use
+    from openai import AzureOpenAI
+    return AzureOpenAI(
+        api_version=OPENAI_API_VERSION,
+        azure_endpoint=OPENAI_ENDPOINT,
+        api_key=OPENAI_KEY,
+    )
+
 
 
 app = FastAPI()
 
+# Keep pip installs and PR work from crowding out /chat (see backend/admission.py)
+app.add_middleware(AdmissionMiddleware, controller=AdmissionController())
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -67,11 +80,7 @@ async def chat_endpoint(req: ChatRequest):
         files = list_files(repo_path)
         files_str = ', '.join(files)
         # Step 2: Identify target file(s)
-        client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=OPENAI_ENDPOINT,
-            api_key=OPENAI_KEY,
-        )
+        client = openai_client()
         identify_prompt = IDENTIFY_TARGET_PROMPT.format(user_request=req.message, file_list=files_str)
         response1 = client.chat.completions.create(
             stream=False,
@@ -159,19 +168,20 @@ async def execute_code(request: Request):
         os.makedirs(repo_path, exist_ok=True)
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(code)
-    # Execute code
-    try:
-        if command:
-            cmd = command.split()
-        else:
-            cmd = ['python3', filename]
-        result = subprocess.run(
-            cmd,
-            capture_output=True, text=True, timeout=10, cwd=repo_path
-        )
-        return {'stdout': result.stdout, 'stderr': result.stderr}
-    except Exception as e:
-        return {'stdout': '', 'stderr': str(e)}
+    # Execute code (the process is killed if the client disconnects)
+    if command:
+        cmd = command.split()
+    else:
+        cmd = ['python3', filename]
+
+    async def run():
+        try:
+            result = await asyncio.to_thread(run_process, cmd, timeout=10, cwd=repo_path)
+            return {'stdout': result.stdout, 'stderr': result.stderr}
+        except Exception as e:
+            return {'stdout': '', 'stderr': str(e)}
+
+    return await cancel_on_disconnect(request, run())
 
 @app.post('/install_requirements')
 async def install_requirements(request: Request):
@@ -193,14 +203,15 @@ async def install_requirements(request: Request):
             f.write('\n'.join(combined) + '\n')
     if not os.path.isfile(req_file):
         return {'stdout': '', 'stderr': 'requirements.txt not found'}
-    try:
-        result = subprocess.run(
-            ['pip', 'install', '-r', req_file],
-            capture_output=True, text=True, timeout=60, cwd=repo_path
-        )
-        return {'stdout': result.stdout, 'stderr': result.stderr}
-    except Exception as e:
-        return {'stdout': '', 'stderr': str(e)} 
+
+    async def run():
+        try:
+            result = await asyncio.to_thread(run_process, ['pip', 'install', '-r', req_file], timeout=60, cwd=repo_path)
+            return {'stdout': result.stdout, 'stderr': result.stderr}
+        except Exception as e:
+            return {'stdout': '', 'stderr': str(e)}
+
+    return await cancel_on_disconnect(request, run())
 
 @app.post("/studio/pr")
 async def studio_pr(
@@ -214,10 +225,10 @@ async def studio_pr(
     """
     Studio PR endpoint: saves files, creates branch, commits, pushes, generates PR, creates draft PR on GitHub.
     """
-    
+    from github import Github
 
-    GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
-    GITHUB_ORG = os.getenv("GITHUB_ORG")
+    GITHUB_TOKEN = settings.github_token
+    GITHUB_ORG = settings.github_org
 
     try:
         # 1. Auto-generate branch name
@@ -248,11 +259,7 @@ async def studio_pr(
         Git diff between main and {branch_name}:
         {diff}
         """
-        client = AzureOpenAI(
-            api_version=OPENAI_API_VERSION,
-            azure_endpoint=OPENAI_ENDPOINT,
-            api_key=OPENAI_KEY,
-        )
+        client = openai_client()
         response = client.chat.completions.create(
             stream=False,
             messages=[
@@ -303,7 +310,8 @@ class PRUpdateRequest(BaseModel):
 @app.post("/studio/pr/update")
 async def update_pr(req: PRUpdateRequest):
     try:
-        g = Github(os.getenv("GITHUB_TOKEN"))
+        from github import Github
+        g = Github(settings.github_token)
         pr_url = req.pr_url.split('?', 1)[0].split('#', 1)[0]
         print("Received pr_url:", pr_url)
         # Extract owner/repo and PR number from pr_url
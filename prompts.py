@@ -37,4 +37,63 @@ CODE_GENERATION_PROMPT = (
     "---\n"
     "User request: {user_request}\n"
     "Target file(s): {target_files}\n"
-) 
\ No newline at end of file
+) 
+# Optional section appended to CODE_GENERATION_PROMPT with existing code packed from the symbol index
+CODE_CONTEXT_PROMPT = (
+    "Relevant existing code (symbols from the target file(s), their dependencies and callers):\n"
+    "{code_context}\n"
+)
+
+# Summarize one directory for the hierarchical repo overview (built bottom-up)
+DIRECTORY_SUMMARY_PROMPT = (
+    "You are an expert software architect. "
+    "Summarize in one or two sentences what the following directory of a codebase is responsible for. "
+    "Respond ONLY with the summary.\n"
+    "Directory: {directory}\n"
+    "Files: {files}\n"
+    "Subdirectories and their summaries:\n"
+    "{subdirectories}\n"
+    "Summary:"
+)
+
+# Drill down the directory summaries for large repos before identifying target files
+DRILL_DOWN_PROMPT = (
+    "You are an expert application management AI. "
+    "Given the following user request and an overview of one directory of a codebase, "
+    "identify the subdirectories that are likely to contain the code that should be updated or used to fulfill the request. "
+    "Respond ONLY with the relevant subdirectory paths exactly as listed, or 'none'.\n"
+    "User request: {user_request}\n"
+    "Directory: {directory}\n"
+    "{outline}\n"
+    "Relevant subdirectories:"
+)
+
+# Fan-out mode, step 1: plan once and list every file to write
+FANOUT_PLAN_PROMPT = (
+    "You are an expert developer assistant. "
+    "Given the user's request and the identified target file(s), generate a step-by-step plan to address the request, "
+    "and list every file that must be written (relative paths, one per line). "
+    "If your solution requires any Python dependencies, include requirements-new.txt in the list. Do NOT list requirements.txt.\n"
+    "Format your response as follows:\n"
+    "---\n"
+    "Plan:\n"
+    "<step-by-step plan>\n"
+    "---\n"
+    "Files:\n"
+    "<one relative file path per line>\n"
+    "---\n"
+    "User request: {user_request}\n"
+    "Target file(s): {target_files}\n"
+)
+
+# Fan-out mode, step 2: generate one file of the shared plan (one completion per file, run concurrently)
+FILE_GENERATION_PROMPT = (
+    "You are an expert developer assistant. "
+    "You are implementing one file of a multi-file change. Follow the shared plan and stay consistent with the other files in it.\n"
+    "User request: {user_request}\n"
+    "Plan:\n"
+    "{plan}\n"
+    "All files in this change: {all_files}\n"
+    "Write the complete content of: {filename}\n"
+    "Respond ONLY with the file content, without markdown fences or commentary.\n"
+)